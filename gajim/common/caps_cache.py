@@ -34,6 +34,7 @@ through ClientCaps objects which are hold by contact instances.
 import base64
 import hashlib
 from collections import namedtuple
+from collections import OrderedDict
 
 import logging
 log = logging.getLogger('gajim.c.caps_cache')
@@ -72,10 +73,10 @@ def client_supports(client_caps, requested_feature):
     lookup_item = client_caps.get_cache_lookup_strategy()
     cache_item = lookup_item(capscache)
 
-    supported_features = cache_item.features
-    if requested_feature in supported_features:
+    if cache_item.supports(requested_feature):
         return True
-    elif not supported_features and cache_item.status in (NEW, QUERIED, FAKED):
+    elif not cache_item.has_features() and \
+    cache_item.status in (NEW, QUERIED, FAKED):
         # assume feature is supported, if we don't know yet, what the client
         # is capable of
         return requested_feature not in FEATURE_BLACKLIST
@@ -177,6 +178,37 @@ def compute_caps_hash(identities, features, dataforms=None, hash_method='sha-1')
 ### Internal classes of this module
 ################################################################################
 
+class FeatureTable(object):
+    """
+    Global interning table for feature namespaces
+
+    Every namespace gets a bit assigned the first time it is seen, so the
+    features of a caps entry can be stored as one int.
+    """
+    def __init__(self):
+        self._bits = {}
+
+    def get_bit(self, feature):
+        """
+        Return the bit of a feature, 0 if the feature was never seen
+        """
+        return self._bits.get(feature, 0)
+
+    def to_bits(self, features):
+        """
+        Return the bitset of the features, assigning bits to new features
+        """
+        bits = 0
+        for feature in features:
+            bit = self._bits.get(feature)
+            if bit is None:
+                bit = self._bits[feature] = 1 << len(self._bits)
+            bits |= bit
+        return bits
+
+feature_table = FeatureTable()
+
+
 class AbstractClientCaps(object):
     """
     Base class representing a client and its capabilities as advertised by a
@@ -309,14 +341,18 @@ class CapsCache(object):
     """
     This object keeps the mapping between caps data and real disco features they
     represent, and provides simple way to query that info
+
+    Entries are loaded from the db on first use. At most `max_items` entries
+    that can be reloaded from the db are kept in memory.
     """
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, max_items=1000):
         # our containers:
         # __cache is a dictionary mapping: pair of hash method and hash maps
-        #   to CapsCacheItem object
+        #   to CapsCacheItem object, ordered from least to most recently used
         # __CacheItem is a class that stores data about particular
         #   client (hash method/hash pair)
-        self.__cache = {}
+        self.__cache = OrderedDict()
+        self.__max_items = max_items
 
         class CacheItem(object):
             # __names is a string cache; every string long enough is given
@@ -328,8 +364,9 @@ class CapsCache(object):
                 # cached into db
                 self.hash_method = hash_method
                 self.hash = hash_
-                self._features = []
-                self._identities = []
+                self._features = ()
+                self._feature_bits = 0
+                self._identities = ()
                 self._logger = logger
 
                 self.status = NEW
@@ -339,12 +376,19 @@ class CapsCache(object):
                 return self._features
 
             def _set_features(self, value):
-                self._features = []
-                for feature in value:
-                    self._features.append(self.__names.setdefault(feature, feature))
+                self._features = tuple(
+                    self.__names.setdefault(feature, feature)
+                    for feature in value)
+                self._feature_bits = feature_table.to_bits(self._features)
 
             features = property(_get_features, _set_features)
 
+            def supports(self, feature):
+                return bool(self._feature_bits & feature_table.get_bit(feature))
+
+            def has_features(self):
+                return self._feature_bits != 0
+
             def _get_identities(self):
                 list_ = []
                 for i in self._identities:
@@ -361,12 +405,13 @@ class CapsCache(object):
                 return list_
 
             def _set_identities(self, value):
-                self._identities = []
+                identities = []
                 for identity in value:
                     # dict are not hashable, so transform it into a tuple
                     t = (identity['category'], identity.get('type'),
                             identity.get('xml:lang'), identity.get('name'))
-                    self._identities.append(self.__names.setdefault(t, t))
+                    identities.append(self.__names.setdefault(t, t))
+                self._identities = tuple(identities)
 
             identities = property(_get_identities, _set_identities)
 
@@ -396,13 +441,10 @@ class CapsCache(object):
         self.logger = logger
 
     def initialize_from_db(self):
+        """
+        Prepare the db for use, entries are loaded lazily by __getitem__
+        """
         self._remove_outdated_caps()
-        for hash_method, hash_, identities, features in \
-        self.logger.iter_caps_data():
-            x = self[(hash_method, hash_)]
-            x.identities = identities
-            x.features = features
-            x.status = CACHED
 
     def _remove_outdated_caps(self):
         """
@@ -412,14 +454,39 @@ class CapsCache(object):
 
     def __getitem__(self, caps):
         if caps in self.__cache:
+            self.__cache.move_to_end(caps)
             return self.__cache[caps]
 
         hash_method, hash_ = caps
 
         x = self.__CacheItem(hash_method, hash_, self.logger)
+        if self.logger is not None and hash_method not in ('no', 'dummy'):
+            entry = self.logger.get_caps_entry(hash_method, hash_)
+            if entry is not None:
+                x.identities, x.features = entry
+                x.status = CACHED
         self.__cache[(hash_method, hash_)] = x
+        self._evict(keep=caps)
         return x
 
+    def _evict(self, keep):
+        """
+        Drop the least recently used entries which can be reloaded from the db
+        """
+        excess = len(self.__cache) - self.__max_items
+        if excess <= 0:
+            return
+        to_remove = []
+        for key, item in self.__cache.items():
+            if key == keep:
+                break
+            if item.status == CACHED and item.hash_method != 'no':
+                to_remove.append(key)
+                if len(to_remove) == excess:
+                    break
+        for key in to_remove:
+            del self.__cache[key]
+
     def query_client_of_jid_if_unknown(self, connection, jid, client_caps):
         """
         Start a disco query to determine caps (node, ver, exts). Won't query if
@@ -447,6 +514,7 @@ class CapsCache(object):
 
 class MucCapsCache:
 
+    # features is a frozenset of namespaces
     DiscoInfo = namedtuple('DiscoInfo', ['identities', 'features', 'data'])
 
     def __init__(self):
@@ -472,7 +540,7 @@ class MucCapsCache:
                 if child.getNamespace() == nbxmpp.NS_DATA:
                     data.append(nbxmpp.DataForm(node=child))
 
-        self.cache[jid] = self.DiscoInfo(identities, features, data)
+        self.cache[jid] = self.DiscoInfo(identities, frozenset(features), data)
 
     def is_cached(self, jid):
         return jid in self.cache
@@ -49,6 +49,8 @@ def create_log_db():
     # also check optparser.py, which updates databases on gajim updates
     cur.executescript(
             '''
+            PRAGMA auto_vacuum = INCREMENTAL;
+
             CREATE TABLE jids(
                     jid_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
                     jid TEXT UNIQUE,
@@ -89,9 +91,151 @@ def create_log_db():
             );
 
             CREATE INDEX idx_logs_jid_id_time ON logs (jid_id, time DESC);
+
+            CREATE INDEX idx_logs_stanza_id ON logs
+                    (stanza_id, jid_id, account_id);
+
+            CREATE TABLE logs_days(
+                    jid_id INTEGER,
+                    day INTEGER,
+                    messages INTEGER,
+                    first_log_line_id INTEGER,
+                    last_log_line_id INTEGER,
+                    last_time INTEGER,
+                    PRIMARY KEY (jid_id, day)
+            );
+
+            CREATE TABLE logs_blocks(
+                    block_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    jid_id INTEGER,
+                    account_id INTEGER,
+                    start_time INTEGER,
+                    end_time INTEGER,
+                    lines INTEGER,
+                    size INTEGER,
+                    data BLOB
+            );
+
+            CREATE INDEX idx_logs_blocks_jid_id_time ON logs_blocks
+                    (jid_id, end_time);
+
+            CREATE TABLE moved_stanza_ids(
+                    stanza_id TEXT,
+                    jid_id INTEGER,
+                    account_id INTEGER,
+                    time INTEGER
+            );
+
+            CREATE INDEX idx_moved_stanza_ids_stanza_id ON moved_stanza_ids
+                    (stanza_id, jid_id, account_id);
+
+            CREATE INDEX idx_moved_stanza_ids_jid_id_time ON moved_stanza_ids
+                    (jid_id, time);
+
+            CREATE TRIGGER logs_days_insert AFTER INSERT ON logs
+            WHEN new.kind NOT IN (0, 1)
+            BEGIN
+                    INSERT OR IGNORE INTO logs_days VALUES (new.jid_id,
+                        CAST(strftime('%Y%m%d', new.time, 'unixepoch',
+                                      'localtime') AS INTEGER),
+                        0, new.log_line_id, new.log_line_id, new.time);
+                    UPDATE logs_days SET messages = messages + 1,
+                        first_log_line_id = MIN(first_log_line_id,
+                                                new.log_line_id),
+                        last_log_line_id = MAX(last_log_line_id,
+                                               new.log_line_id),
+                        last_time = MAX(last_time, new.time)
+                    WHERE jid_id = new.jid_id AND day =
+                        CAST(strftime('%Y%m%d', new.time, 'unixepoch',
+                                      'localtime') AS INTEGER);
+            END;
+
+            -- When the first or last line of a day is deleted, the
+            -- remaining lines of that day are looked up
+            CREATE TRIGGER logs_days_delete AFTER DELETE ON logs
+            WHEN old.kind NOT IN (0, 1)
+            BEGIN
+                    UPDATE logs_days SET messages = messages - 1
+                    WHERE jid_id = old.jid_id AND day =
+                        CAST(strftime('%Y%m%d', old.time, 'unixepoch',
+                                      'localtime') AS INTEGER);
+                    DELETE FROM logs_days
+                    WHERE jid_id = old.jid_id AND messages <= 0;
+                    UPDATE logs_days SET
+                        first_log_line_id = COALESCE(
+                            (SELECT MIN(log_line_id) FROM logs
+                            WHERE jid_id = old.jid_id AND kind NOT IN (0, 1)
+                            AND time >= CAST(strftime('%s', old.time, 'unixepoch',
+                                'localtime', 'start of day', 'utc') AS INTEGER)
+                            AND time < CAST(strftime('%s', old.time, 'unixepoch',
+                                'localtime', 'start of day', '+1 day', 'utc')
+                                AS INTEGER)),
+                            first_log_line_id),
+                        last_log_line_id = COALESCE(
+                            (SELECT MAX(log_line_id) FROM logs
+                            WHERE jid_id = old.jid_id AND kind NOT IN (0, 1)
+                            AND time >= CAST(strftime('%s', old.time, 'unixepoch',
+                                'localtime', 'start of day', 'utc') AS INTEGER)
+                            AND time < CAST(strftime('%s', old.time, 'unixepoch',
+                                'localtime', 'start of day', '+1 day', 'utc')
+                                AS INTEGER)),
+                            last_log_line_id),
+                        last_time = COALESCE(
+                            (SELECT MAX(time) FROM logs
+                            WHERE jid_id = old.jid_id AND kind NOT IN (0, 1)
+                            AND time >= CAST(strftime('%s', old.time, 'unixepoch',
+                                'localtime', 'start of day', 'utc') AS INTEGER)
+                            AND time < CAST(strftime('%s', old.time, 'unixepoch',
+                                'localtime', 'start of day', '+1 day', 'utc')
+                                AS INTEGER)),
+                            last_time)
+                    WHERE jid_id = old.jid_id AND day =
+                        CAST(strftime('%Y%m%d', old.time, 'unixepoch',
+                                      'localtime') AS INTEGER)
+                    AND (old.log_line_id IN (first_log_line_id, last_log_line_id)
+                         OR old.time >= last_time);
+            END;
             '''
             )
 
+    # The full-text search index needs a sqlite built with FTS5. Without it
+    # the Logger falls back to a LIKE search.
+    try:
+        cur.executescript(
+                '''
+                CREATE VIRTUAL TABLE logs_fts USING fts5(
+                        message, subject, content='logs',
+                        content_rowid='log_line_id'
+                );
+
+                CREATE TRIGGER logs_fts_insert AFTER INSERT ON logs
+                BEGIN
+                        INSERT INTO logs_fts (rowid, message, subject)
+                        VALUES (new.log_line_id, new.message, new.subject);
+                END;
+
+                CREATE TRIGGER logs_fts_delete AFTER DELETE ON logs
+                BEGIN
+                        INSERT INTO logs_fts (logs_fts, rowid, message, subject)
+                        VALUES ('delete', old.log_line_id, old.message,
+                                old.subject);
+                END;
+
+                CREATE TRIGGER logs_fts_update
+                AFTER UPDATE OF message, subject ON logs
+                BEGIN
+                        INSERT INTO logs_fts (logs_fts, rowid, message, subject)
+                        VALUES ('delete', old.log_line_id, old.message,
+                                old.subject);
+                        INSERT INTO logs_fts (rowid, message, subject)
+                        VALUES (new.log_line_id, new.message, new.subject);
+                END;
+                '''
+                )
+    except sqlite.OperationalError as e:
+        print('error creating full-text search index: %s' % str(e),
+            file=sys.stderr)
+
     con.commit()
     con.close()
 
@@ -113,6 +257,8 @@ def create_cache_db():
                     data BLOB,
                     last_seen INTEGER);
 
+            CREATE INDEX idx_caps_cache_hash ON caps_cache (hash_method, hash);
+
             CREATE TABLE rooms_last_message_time(
                     jid_id INTEGER PRIMARY KEY UNIQUE,
                     time INTEGER
@@ -33,6 +33,7 @@
 
 
 import re
+from functools import lru_cache
 from gi.repository import GLib
 from enum import IntEnum, unique
 
@@ -55,6 +56,51 @@ opt_one_window_types = ['never', 'always', 'always_with_roster', 'peracct', 'per
 opt_show_roster_on_startup = ['always', 'never', 'last_state']
 opt_treat_incoming_messages = ['', 'chat', 'normal']
 
+@lru_cache(maxsize=256)
+def get_words_regex(words):
+    """
+    Return a regex finding any of the lowercase words in a lowercase text,
+    when they are not part of a bigger word, or None if there is no word
+
+    :param words: a tuple of words
+    """
+    words = [re.escape(word) for word in words if word]
+    if not words:
+        return None
+    return re.compile(r'(?<![^\W\d_])(?:%s)(?![^\W\d_])' % '|'.join(words))
+
+class AccountPolicy:
+    """
+    Options of an account checked for every message or event, parsed once
+
+    Config.get_policy() builds it and drops it when one of these options
+    changes.
+    """
+
+    # global options the policies are made of
+    GLOBAL_OPTIONS = ('muc_highlight_words', 'autopopup', 'autopopupaway',
+        'sounddnd')
+    # per account options the policy of an account is made of
+    ACCOUNT_OPTIONS = ('no_log_for',)
+
+    def __init__(self, config, account):
+        no_log_for = config.get_per('accounts', account, 'no_log_for') or ''
+        self.no_log_for = frozenset(no_log_for.split())
+        self.log_account = account not in self.no_log_for
+        # lowercase, for case insensitive search
+        self.highlight_words = tuple(word for word in
+            config.get('muc_highlight_words').lower().split(';') if word)
+        self.autopopup = config.get('autopopup')
+        self.autopopupaway = config.get('autopopupaway')
+        self.sounddnd = config.get('sounddnd')
+        # sound events without a soundevents entry are disabled
+        self.enabled_sound_events = frozenset(event for event in
+            config.get_per('soundevents') if config.get_per('soundevents',
+            event, 'enabled'))
+
+    def should_log(self, jid):
+        return self.log_account and jid not in self.no_log_for
+
 class Config:
 
     DEFAULT_ICONSET = 'dcraven'
@@ -182,7 +228,13 @@ class Config:
             'change_roster_title': [ opt_bool, True, _('Add * and [n] in roster title?')],
             'restore_lines': [opt_int, 10, _('How many history messages should be restored when a chat tab/window is reopened?')],
             'restore_timeout': [opt_int, -1, _('How far back in time (minutes) history is restored. -1 means no limit.')],
+            'log_archive_after_days': [opt_int, -1, _('History older than this many days is moved into yearly archive databases next to the logs database. It can still be browsed and searched. -1 means never')],
+            'log_compress_after_days': [opt_int, -1, _('History older than this many days is compressed to save disk space. It can still be browsed and searched, but is slower to read. -1 means never')],
+            'log_write_max_latency': [opt_int, 100, _('How long (milliseconds) new history lines are queued at most, so they can be written to the database together.')],
+            'event_profiling': [opt_bool, False, _('If True, Gajim records how long event handlers take. The statistics can be shown in the XML console or with gajim-remote.')],
+            'event_profiling_threshold': [opt_int, 50, _('Event handlers taking longer than this (milliseconds) are logged while event profiling is enabled.')],
             'muc_restore_lines': [opt_int, 100, _('How many lines to request from server when entering a groupchat. -1 means no limit')],
+            'muc_history_eager_lines': [opt_int, 100, _('How many of the history messages received when joining a groupchat are printed right away. Older ones are printed when scrolling up. -1 means no limit')],
             'muc_restore_timeout': [opt_int, -1, _('Minutes of backlog to request when entering a groupchat. -1 means no limit')],
             'muc_autorejoin_timeout': [opt_int, 1, _('How many seconds to wait before trying to autorejoin to a conference you are being disconnected from. Set to 0 to disable autorejoining.')],
             'muc_autorejoin_on_kick': [opt_bool, False, _('Should autorejoin be activated when we are being kicked from a conference?')],
@@ -357,6 +409,8 @@ class Config:
                     'custom_host': [ opt_str, '', '', True ],
                     'sync_with_global_status': [ opt_bool, False, ],
                     'no_log_for': [ opt_str, '', _('Space separated list of JIDs for which you do not want to store logs. You can also add account name to log nothing for this account.')],
+                    'log_retention_chat': [ opt_int, -1, _('Days the history of chats is kept. Older history is deleted in the background. -1 means forever')],
+                    'log_retention_groupchat': [ opt_int, -1, _('Days the history of groupchats is kept. Older history is deleted in the background. -1 means forever')],
                     'sync_logs_with_server': [ opt_bool, True, _('On startup, Gajim will download logs stored on server, provided the server supports XEP-0313')],
                     'allow_no_log_for': [ opt_str, '', _('Space separated list of JIDs for which you accept to not log conversations if he does not want to.')],
                     'non_minimized_gc': [ opt_str, '' ],
@@ -629,6 +683,7 @@ class Config:
             return
 
         self.__options[1][optname] = value
+        self._changed(optname)
         self._timeout_save()
 
     def get(self, optname=None):
@@ -671,6 +726,7 @@ class Config:
         opt[1][name] = {}
         for o in opt[0]:
             opt[1][name][o] = opt[0][o][Option.VAL]
+        self._changed(typename, name)
         self._timeout_save()
 
     def del_per(self, typename, name, subname = None): # per_group_of_option
@@ -680,9 +736,11 @@ class Config:
         opt = self.__options_per_key[typename]
         if subname is None:
             del opt[1][name]
+            self._changed(typename, name)
         # if subname is specified, delete the item in the group.
         elif subname in opt[1][name]:
             del opt[1][name][subname]
+            self._changed(typename, name, subname)
         self._timeout_save()
 
     def set_per(self, optname, key, subname, value): # per_group_of_option
@@ -701,6 +759,7 @@ class Config:
         if value is None:
             return
         obj[subname] = value
+        self._changed(optname, key, subname)
         self._timeout_save()
 
     def get_per(self, optname, key=None, subname=None): # per_group_of_option
@@ -768,14 +827,84 @@ class Config:
         """
         Should conversations between a local account and a remote jid be logged?
         """
-        no_log_for = self.get_per('accounts', account, 'no_log_for')
+        return self.get_policy(account).should_log(jid)
+
+    def get_policy(self, account):
+        """
+        Return the AccountPolicy of the account
+        """
+        policy = self._policies.get(account)
+        if policy is None:
+            policy = self._policies[account] = AccountPolicy(self, account)
+        return policy
+
+    def _on_option_changed(self, optname, key, subname):
+        if key is None:
+            if optname in AccountPolicy.GLOBAL_OPTIONS:
+                self._policies.clear()
+        elif optname == 'soundevents':
+            self._policies.clear()
+        elif optname == 'accounts' and (subname is None or \
+        subname in AccountPolicy.ACCOUNT_OPTIONS):
+            self._policies.pop(key, None)
+
+    def subscribe_changes(self, listener):
+        """
+        Call listener(optname, key, subname) when an option changes
 
-        if not no_log_for:
-            no_log_for = ''
+        key and subname are None for global options, subname is None when a
+        group of options is added or removed.
+        """
+        if listener not in self._change_listeners:
+            self._change_listeners.append(listener)
+
+    def unsubscribe_changes(self, listener):
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
+
+    def _changed(self, optname, key=None, subname=None):
+        if key is None:
+            self._dirty[(optname,)] = None
+        elif subname is None:
+            self._dirty[(optname, key)] = None
+        else:
+            self._dirty[(optname, key, subname)] = None
+        for listener in self._change_listeners:
+            listener(optname, key, subname)
 
-        no_log_for = no_log_for.split()
+    def pop_changes(self):
+        """
+        Return the options changed since the last call with their current
+        values, and forget them
 
-        return (account not in no_log_for) and (jid not in no_log_for)
+        A change is one of ('set', optname, value), ('per', optname, key,
+        {subname: value}) for a whole added or replaced group, ('set_per',
+        optname, key, subname, value) or ('del_per', optname, key, subname)
+        where subname is None when the whole group was deleted.
+        """
+        changes = []
+        groups = {path for path in self._dirty if len(path) == 2}
+        for path in self._dirty:
+            if len(path) == 1:
+                changes.append(('set', path[0], self.__options[1][path[0]]))
+                continue
+            optname, key = path[:2]
+            if len(path) == 3 and (optname, key) in groups:
+                # the whole group is written
+                continue
+            dict_ = self.__options_per_key[optname][1]
+            if key not in dict_:
+                if len(path) == 2:
+                    changes.append(('del_per', optname, key, None))
+            elif len(path) == 2:
+                changes.append(('per', optname, key, dict(dict_[key])))
+            elif path[2] in dict_[key]:
+                changes.append(('set_per', optname, key, path[2],
+                    dict_[key][path[2]]))
+            else:
+                changes.append(('del_per', optname, key, path[2]))
+        self._dirty = {}
+        return changes
 
     def _init_options(self):
         for opt in self.__options[0]:
@@ -784,7 +913,7 @@ class Config:
     def _really_save(self):
         from gajim.common import app
         if app.interface:
-            app.interface.save_config()
+            app.interface.save_config_changes()
         self.save_timeout_id = None
         return False
 
@@ -794,6 +923,12 @@ class Config:
         self.save_timeout_id = GLib.timeout_add(1000, self._really_save)
 
     def __init__(self):
+        # changed options since the last save {(optname[, key[, subname]]):
+        # None}, to write only them
+        self._dirty = {}
+        self._policies = {} # {account: AccountPolicy}
+        self._change_listeners = []
+        self.subscribe_changes(self._on_option_changed)
         #init default values
         self._init_options()
         self.save_timeout_id = None
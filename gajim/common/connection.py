@@ -512,6 +512,7 @@ class CommonConnection:
         raise NotImplementedError
 
     def account_changed(self, new_name):
+        app.ged.change_account_name(self.name, new_name)
         self.name = new_name
 
     def request_os_info(self, jid, resource):
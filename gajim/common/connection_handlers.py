@@ -287,9 +287,9 @@ class ConnectionVcard:
         self.avatar_presence_sent = False
 
         app.ged.register_event_handler('presence-received', ged.GUI2,
-            self._vcard_presence_received)
+            self._vcard_presence_received, account=self.name)
         app.ged.register_event_handler('gc-presence-received', ged.GUI2,
-            self._vcard_gc_presence_received)
+            self._vcard_gc_presence_received, account=self.name)
 
     def _vcard_presence_received(self, obj):
         if obj.conn.name != self.name:
@@ -775,44 +775,55 @@ class ConnectionHandlersBase:
         self.gpg_messages_to_decrypt = []
 
         app.ged.register_event_handler('iq-error-received', ged.CORE,
-            self._nec_iq_error_received)
+            self._nec_iq_error_received, account=self.name)
         app.ged.register_event_handler('presence-received', ged.CORE,
-            self._nec_presence_received)
+            self._nec_presence_received, account=self.name)
+        app.ged.register_event_handler('gpg-presence-verified', ged.CORE,
+            self._nec_gpg_presence_verified, account=self.name)
         app.ged.register_event_handler('gc-presence-received', ged.CORE,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received, account=self.name)
         app.ged.register_event_handler('message-received', ged.CORE,
-            self._nec_message_received)
+            self._nec_message_received, account=self.name)
         app.ged.register_event_handler('mam-message-received', ged.CORE,
-            self._nec_message_received)
+            self._nec_message_received, account=self.name)
         app.ged.register_event_handler('mam-gc-message-received', ged.CORE,
-            self._nec_message_received)
+            self._nec_message_received, account=self.name)
         app.ged.register_event_handler('decrypted-message-received', ged.CORE,
-            self._nec_decrypted_message_received)
+            self._nec_decrypted_message_received, account=self.name)
         app.ged.register_event_handler('gc-message-received', ged.CORE,
-            self._nec_gc_message_received)
+            self._nec_gc_message_received, account=self.name)
 
     def cleanup(self):
         app.ged.remove_event_handler('iq-error-received', ged.CORE,
-            self._nec_iq_error_received)
+            self._nec_iq_error_received, account=self.name)
         app.ged.remove_event_handler('presence-received', ged.CORE,
-            self._nec_presence_received)
+            self._nec_presence_received, account=self.name)
+        app.ged.remove_event_handler('gpg-presence-verified', ged.CORE,
+            self._nec_gpg_presence_verified, account=self.name)
         app.ged.remove_event_handler('gc-presence-received', ged.CORE,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received, account=self.name)
         app.ged.remove_event_handler('message-received', ged.CORE,
-            self._nec_message_received)
+            self._nec_message_received, account=self.name)
         app.ged.remove_event_handler('mam-message-received', ged.CORE,
-            self._nec_message_received)
+            self._nec_message_received, account=self.name)
         app.ged.remove_event_handler('mam-gc-message-received', ged.CORE,
-            self._nec_message_received)
+            self._nec_message_received, account=self.name)
         app.ged.remove_event_handler('decrypted-message-received', ged.CORE,
-            self._nec_decrypted_message_received)
+            self._nec_decrypted_message_received, account=self.name)
         app.ged.remove_event_handler('gc-message-received', ged.CORE,
-            self._nec_gc_message_received)
+            self._nec_gc_message_received, account=self.name)
 
     def _nec_iq_error_received(self, obj):
         if obj.conn.name != self.name:
             return
 
+    def _nec_gpg_presence_verified(self, obj):
+        if obj.conn.name != self.name:
+            return
+        if obj.keyID.endswith('MISMATCH'):
+            log.warning('Presence of %s/%s is not signed with the assigned key',
+                obj.jid, obj.resource)
+
     def _nec_presence_received(self, obj):
         account = obj.conn.name
         if account != self.name:
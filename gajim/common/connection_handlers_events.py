@@ -769,12 +769,24 @@ PresenceHelperEvent):
         self.keyID = ''
         if sig_tag and self.conn.USE_GPG and self.ptype != 'error':
             # error presences contain our own signature
-            # verify
+            attached_keys = app.config.get_per('accounts', self.conn.name,
+                'attached_gpg_keys').split()
+            if self.jid not in attached_keys:
+                # No key to check the signature against
+                return
             sig_msg = sig_tag.getData()
-            self.keyID = self.conn.gpg.verify(self.status, sig_msg)
+            keyID = self.conn.gpg.get_verified_key(self.status, sig_msg)
+            if keyID is None:
+                # verify in a worker, GPGPresenceVerifiedEvent gives the result
+                conn, jid, resource = self.conn, self.jid, self.resource
+                def _on_verified(keyID):
+                    app.nec.push_incoming_event(GPGPresenceVerifiedEvent(None,
+                        conn=conn, jid=jid, resource=resource, keyID=keyID))
+                self.conn.gpg.verify_async(self.status, sig_msg, _on_verified)
+                return
             self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
                                                                 self.jid,
-                                                                self.keyID)
+                                                                keyID)
 
     def _generate_prio(self):
         self.prio = self.stanza.getPriority()
@@ -890,6 +902,17 @@ PresenceHelperEvent):
             elif self.jid in jid_list or self.jid == our_jid:
                 return True
 
+class GPGPresenceVerifiedEvent(nec.NetworkIncomingEvent):
+    name = 'gpg-presence-verified'
+    base_network_events = []
+
+    def generate(self):
+        if not self.conn or self.conn.connected < 2:
+            return
+        self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
+            self.jid, self.keyID)
+        return True
+
 class ZeroconfPresenceReceivedEvent(nec.NetworkIncomingEvent):
     name = 'presence-received'
     base_network_events = []
@@ -88,10 +88,41 @@ class CommonContact(XMPPEntity):
             return caps_cache.client_supports(self.client_caps, requested_feature)
 
 
+def _counted_attribute(name, convert=None):
+    """
+    Attribute of Contact which, when changed, updates the group index and
+    the counters of the Contacts instance the contact was added to
+
+    :param convert: Called with the assigned value, its result is stored
+    """
+    def getter(self):
+        return self.__dict__[name]
+
+    def setter(self, value):
+        if convert is not None:
+            value = convert(value)
+        self.__dict__[name] = value
+        owner = self.__dict__.get('_owner')
+        if owner is not None:
+            owner.contact_changed(self)
+
+    return property(getter, setter)
+
+
 class Contact(CommonContact):
     """
     Information concerning a contact
+
+    The list assigned to groups is copied. Assign a new list instead of
+    changing it in place, otherwise the group index of Contacts is not
+    updated.
     """
+    show = _counted_attribute('show')
+    name = _counted_attribute('name')
+    groups = _counted_attribute('groups', list)
+    sub = _counted_attribute('sub')
+    ask = _counted_attribute('ask')
+
     def __init__(self, jid, account, name='', groups=None, show='', status='',
     sub='', ask='', resource='', priority=0, keyID='', client_caps=None,
     our_chatstate=None, chatstate=None, idle_time=None, avatar_sha=None):
@@ -129,10 +160,18 @@ class Contact(CommonContact):
         return self.jid.split('@')[0]
 
     def get_shown_groups(self):
+        if not self.is_observer() and self.is_groupchat():
+            return [_('Groupchats')]
+        return self.get_shown_roster_groups()
+
+    def get_shown_roster_groups(self):
+        """
+        Return the shown groups as if the contact was no connected groupchat
+
+        Unlike get_shown_groups() this only depends on the contact itself.
+        """
         if self.is_observer():
             return [_('Observers')]
-        elif self.is_groupchat():
-            return [_('Groupchats')]
         elif self.is_transport():
             return [_('Transports')]
         elif not self.groups:
@@ -364,44 +403,86 @@ class LegacyContactsAPI:
     def get_nb_online_total_contacts(self, accounts=None, groups=None):
         """
         Return the number of online contacts and the total number of contacts
+
+        Uses the counters of Contacts. Only our own jid, metacontacts and
+        groupchats are counted one by one, as their count depends on more
+        than the contact itself.
         """
         if not accounts:
             accounts = self.get_accounts()
         if groups is None:
             groups = []
+        if len(groups) > 1:
+            return self._get_nb_online_total_contacts_slow(accounts, groups)
+
+        group = groups[0] if groups else None
+        nbr_online = 0
+        nbr_total = 0
+        for account in accounts:
+            contacts = self._accounts[account].contacts
+            online, total = contacts.get_nb_online_total(group)
+            for jid in self._get_uncounted_jids(account):
+                counted_online, counted_total = contacts.get_counted(jid,
+                    group)
+                jid_online, jid_total = self._count_jid(account, jid,
+                    accounts, groups)
+                online += jid_online - counted_online
+                total += jid_total - counted_total
+            nbr_online += online
+            nbr_total += total
+        return nbr_online, nbr_total
+
+    def _get_uncounted_jids(self, account):
+        contacts = self._accounts[account].contacts
+        jids = {common.app.get_jid_from_account(account)}
+        jids.update(self._metacontact_manager.get_metacontacts_jids(account))
+        for rooms in common.app.gc_connected.values():
+            jids.update(rooms)
+        return [jid for jid in jids if contacts.get_contacts(jid)]
+
+    def _get_nb_online_total_contacts_slow(self, accounts, groups):
         nbr_online = 0
         nbr_total = 0
         for account in accounts:
-            our_jid = common.app.get_jid_from_account(account)
             for jid in self.get_jid_list(account):
-                if jid == our_jid:
-                    continue
-                if common.app.jid_is_transport(jid) and not \
-                _('Transports') in groups:
-                    # do not count transports
-                    continue
-                if self.has_brother(account, jid, accounts) and not \
-                self.is_big_brother(account, jid, accounts):
-                    # count metacontacts only once
-                    continue
-                contact = self._accounts[account].contacts._contacts[jid][0]
-                if _('Not in roster') in contact.groups:
-                    continue
-                in_groups = False
-                if groups == []:
-                    in_groups = True
-                else:
-                    for group in groups:
-                        if group in contact.get_shown_groups():
-                            in_groups = True
-                            break
-
-                if in_groups:
-                    if contact.show not in ('offline', 'error'):
-                        nbr_online += 1
-                    nbr_total += 1
+                online, total = self._count_jid(account, jid, accounts, groups)
+                nbr_online += online
+                nbr_total += total
         return nbr_online, nbr_total
 
+    def _count_jid(self, account, jid, accounts, groups):
+        """
+        Return how much the jid adds to the number of online contacts and
+        the total number of contacts
+        """
+        if jid == common.app.get_jid_from_account(account):
+            return 0, 0
+        if common.app.jid_is_transport(jid) and not \
+        _('Transports') in groups:
+            # do not count transports
+            return 0, 0
+        if self.has_brother(account, jid, accounts) and not \
+        self.is_big_brother(account, jid, accounts):
+            # count metacontacts only once
+            return 0, 0
+        contact = self._accounts[account].contacts._contacts[jid][0]
+        if _('Not in roster') in contact.groups:
+            return 0, 0
+        in_groups = False
+        if groups == []:
+            in_groups = True
+        else:
+            for group in groups:
+                if group in contact.get_shown_groups():
+                    in_groups = True
+                    break
+
+        if not in_groups:
+            return 0, 0
+        if contact.show not in ('offline', 'error'):
+            return 1, 1
+        return 0, 1
+
     def __getattr__(self, attr_name):
         # Only called if self has no attr_name
         if hasattr(self._metacontact_manager, attr_name):
@@ -454,16 +535,28 @@ class Contacts():
     def __init__(self):
         # list of contacts  {jid1: [C1, C2]}, } one Contact per resource
         self._contacts = {}
+        # jids per group of the first contact {group: {jid1: None, }, }
+        self._groups = {}
+        # what the first contact of a jid adds to the counters
+        # {jid: (groups, shown groups, online, not in roster, transport)}
+        self._counted = {}
+        # online and total contacts per shown group {group: [online, total]}
+        self._group_counters = {}
+        # online and total contacts without transports
+        self._counters = [0, 0]
 
     def add_contact(self, contact):
         if contact.jid not in self._contacts:
             self._contacts[contact.jid] = [contact]
+            contact._owner = self
+            self._update_counters(contact.jid)
             return
         contacts = self._contacts[contact.jid]
         # We had only one that was offline, remove it
         if len(contacts) == 1 and contacts[0].show == 'offline':
             # Do not use self.remove_contact: it deteles
             # self._contacts[account][contact.jid]
+            contacts[0]._owner = None
             contacts.remove(contacts[0])
         # If same JID with same resource already exists, use the new one
         for c in contacts:
@@ -471,21 +564,102 @@ class Contacts():
                 self.remove_contact(c)
                 break
         contacts.append(contact)
+        contact._owner = self
+        self._update_counters(contact.jid)
 
     def remove_contact(self, contact):
         if contact.jid not in self._contacts:
             return
         if contact in self._contacts[contact.jid]:
             self._contacts[contact.jid].remove(contact)
+            contact._owner = None
         if len(self._contacts[contact.jid]) == 0:
             del self._contacts[contact.jid]
+        self._update_counters(contact.jid)
 
     def remove_jid(self, jid):
         """
         Remove all contacts for a given jid
         """
         if jid in self._contacts:
+            for contact in self._contacts[jid]:
+                contact._owner = None
             del self._contacts[jid]
+            self._update_counters(jid)
+
+    def contact_changed(self, contact):
+        """
+        Called when an attribute of a contact changed, that changes its
+        groups or how it is counted
+        """
+        contacts = self._contacts.get(contact.jid)
+        if contacts and contacts[0] is contact:
+            self._update_counters(contact.jid)
+
+    def _update_counters(self, jid):
+        counted = self._counted.pop(jid, None)
+        if counted is not None:
+            self._count(jid, counted, -1)
+        contacts = self._contacts.get(jid)
+        if contacts:
+            contact = contacts[0]
+            # Connected groupchats are counted one by one, as joining or
+            # leaving a room does not change the contact
+            counted = (tuple(set(contact.groups)),
+                       tuple(set(contact.get_shown_roster_groups())),
+                       contact.show not in ('offline', 'error'),
+                       _('Not in roster') in contact.groups,
+                       contact.is_transport())
+            self._counted[jid] = counted
+            self._count(jid, counted, 1)
+
+    def _count(self, jid, counted, sign):
+        groups, shown_groups, online, not_in_roster, transport = counted
+        for group in groups:
+            if sign > 0:
+                self._groups.setdefault(group, {})[jid] = None
+            else:
+                jids = self._groups[group]
+                del jids[jid]
+                if not jids:
+                    del self._groups[group]
+        if not_in_roster:
+            return
+        for group in shown_groups:
+            counters = self._group_counters.setdefault(group, [0, 0])
+            counters[0] += sign * online
+            counters[1] += sign
+        if not transport:
+            self._counters[0] += sign * online
+            self._counters[1] += sign
+
+    def get_nb_online_total(self, group=None):
+        """
+        Return the number of online contacts and the total number of
+        contacts in the shown group, or of all contacts except transports
+
+        Unlike LegacyContactsAPI.get_nb_online_total_contacts() this counts
+        our own jid and all members of metacontacts.
+        """
+        if group is None:
+            return tuple(self._counters)
+        return tuple(self._group_counters.get(group, (0, 0)))
+
+    def get_counted(self, jid, group=None):
+        """
+        Return what the jid adds to get_nb_online_total()
+        """
+        counted = self._counted.get(jid)
+        if counted is None:
+            return 0, 0
+        _groups, shown_groups, online, not_in_roster, transport = counted
+        if not_in_roster:
+            return 0, 0
+        if group is None and transport:
+            return 0, 0
+        if group is not None and group not in shown_groups:
+            return 0, 0
+        return int(online), 1
 
     def get_contacts(self, jid):
         """
@@ -566,10 +740,8 @@ class Contacts():
         Return all contacts in the given group
         """
         group_contacts = []
-        for jid in self._contacts:
-            contacts = self.get_contacts(jid)
-            if group in contacts[0].groups:
-                group_contacts += contacts
+        for jid in self._groups.get(group, ()):
+            group_contacts += self._contacts[jid]
         return group_contacts
 
     def change_contact_jid(self, old_jid, new_jid):
@@ -579,7 +751,9 @@ class Contacts():
         for _contact in self._contacts[old_jid]:
             _contact.jid = new_jid
             self._contacts[new_jid].append(_contact)
-            del self._contacts[old_jid]
+        del self._contacts[old_jid]
+        self._update_counters(old_jid)
+        self._update_counters(new_jid)
 
 
 class GC_Contacts():
@@ -679,6 +853,16 @@ class MetacontactManager():
         #FIXME: can this append ?
         assert False
 
+    def get_metacontacts_jids(self, account):
+        """
+        Return the jids of the account that belong to a metacontact
+        """
+        jids = set()
+        for tag_data in self._metacontacts_tags.get(account, {}).values():
+            for data in tag_data:
+                jids.add(data['jid'])
+        return jids
+
     def iter_metacontacts_families(self, account):
         for tag in self._metacontacts_tags[account]:
             family = self._get_metacontacts_family_from_tag(account, tag)
@@ -24,6 +24,7 @@
 ## along with Gajim. If not, see <http://www.gnu.org/licenses/>.
 ##
 
+import heapq
 import time
 
 class Event:
@@ -179,12 +180,85 @@ class JingleIncomingEvent(Event):
 class Events:
     """
     Information concerning all events
+
+    Besides the events, the numbers of events per account, per jid, per
+    type and per attribute (shown in roster or systray) are kept, as well
+    as heaps of the events ordered by time. Whether an event is shown in
+    roster or systray is read when it is added. An event object can only
+    be queued once.
     """
 
     def __init__(self):
         self._events = {} # list of events {acct: {jid1: [E1, E2]}, }
         self._event_added_listeners = []
         self._event_removed_listeners = []
+        # number of events {(acct, jid, attribute, type_): nb}, acct, jid
+        # and type_ can be None to count all of them
+        self._counts = {}
+        # heaps of [time_, seq, account, jid, event, valid] of all events
+        # and of the events shown in systray
+        self._heaps = {None: [], 'systray': []}
+        self._heap_entries = {} # {id(event): [entry, ]}
+        self._seq = 0
+
+    def _get_attributes(self, event):
+        attributes = [None]
+        if event.show_in_systray:
+            attributes.append('systray')
+        if event.show_in_roster:
+            attributes.append('roster')
+        return attributes
+
+    def _count(self, account, jid, attributes, type_, nb):
+        for key_account, key_jid in ((account, jid), (account, None),
+        (None, None)):
+            for attribute in attributes:
+                for key_type in (type_, None):
+                    key = (key_account, key_jid, attribute, key_type)
+                    count = self._counts.get(key, 0) + nb
+                    if count:
+                        self._counts[key] = count
+                    else:
+                        del self._counts[key]
+
+    def _index_event(self, account, jid, event):
+        attributes = self._get_attributes(event)
+        event._indexed_attributes = attributes
+        self._count(account, jid, attributes, event.type_, 1)
+        entries = []
+        for attribute in (None, 'systray'):
+            if attribute not in attributes:
+                continue
+            self._seq += 1
+            entry = [event.time_, self._seq, account, jid, event, True]
+            heapq.heappush(self._heaps[attribute], entry)
+            entries.append(entry)
+        self._heap_entries[id(event)] = entries
+
+    def _unindex_event(self, account, jid, event):
+        self._count(account, jid, event._indexed_attributes, event.type_, -1)
+        for entry in self._heap_entries.pop(id(event), []):
+            entry[5] = False
+        for attribute, heap in self._heaps.items():
+            # drop the removed entries once they are the majority
+            if len(heap) > 2 * self._counts.get((None, None, attribute,
+            None), 0) + 16:
+                heap[:] = [entry for entry in heap if entry[5]]
+                heapq.heapify(heap)
+
+    def _unindex_account(self, account):
+        for jid, events in self._events[account].items():
+            for event in events:
+                self._unindex_event(account, jid, event)
+
+    def _get_first_from_heap(self, attribute):
+        heap = self._heaps[attribute]
+        while heap and not heap[0][5]:
+            heapq.heappop(heap)
+        if not heap:
+            return None, None, None
+        _time, _seq, account, jid, event, _valid = heap[0]
+        return account, jid, event
 
     def event_added_subscribe(self, listener):
         """
@@ -224,16 +298,25 @@ class Events:
 
     def change_account_name(self, old_name, new_name):
         if old_name in self._events:
+            self._unindex_account(old_name)
+            if new_name in self._events:
+                self._unindex_account(new_name)
             self._events[new_name] = self._events[old_name]
             del self._events[old_name]
+            for jid, events in self._events[new_name].items():
+                for event in events:
+                    self._index_event(new_name, jid, event)
 
     def add_account(self, account):
+        if account in self._events:
+            self._unindex_account(account)
         self._events[account] = {}
 
     def get_accounts(self):
         return self._events.keys()
 
     def remove_account(self, account):
+        self._unindex_account(account)
         del self._events[account]
 
     def add_event(self, account, jid, event):
@@ -247,6 +330,7 @@ class Events:
             self._events[account][jid].append(event)
         event.jid = jid
         event.account = account
+        self._index_event(account, jid, event)
         self.fire_event_added(event)
 
     def remove_events(self, account, jid, event=None, types=None):
@@ -266,6 +350,7 @@ class Events:
                     del self._events[account][jid]
                 else:
                     self._events[account][jid].remove(event)
+                self._unindex_event(account, jid, event)
                 self.fire_event_removed([event])
                 return
             else:
@@ -284,9 +369,13 @@ class Events:
                 self._events[account][jid] = new_list
             else:
                 del self._events[account][jid]
+            for ev in removed_list:
+                self._unindex_event(account, jid, ev)
             self.fire_event_removed(removed_list)
             return
         # no event nor type given, remove them all
+        for ev in self._events[account][jid]:
+            self._unindex_event(account, jid, ev)
         self.fire_event_removed(self._events[account][jid])
         del self._events[account][jid]
 
@@ -295,6 +384,9 @@ class Events:
             return
         if old_jid not in self._events[account]:
             return
+        for event in self._events[account][old_jid]:
+            self._unindex_event(account, old_jid, event)
+            self._index_event(account, new_jid, event)
         if new_jid in self._events[account]:
             self._events[account][new_jid] += self._events[account][old_jid]
         else:
@@ -339,7 +431,7 @@ class Events:
         Return the first event of type type_ if given
         """
         if not account:
-            return self._get_first_event_with_attribute(self._events)
+            return self._get_first_from_heap(None)
         events_list = self.get_events(account, jid, type_)
         # be sure it's bigger than latest event
         first_event_time = time.time() + 1
@@ -356,28 +448,21 @@ class Events:
         """
         if types is None:
             types = []
-        nb = 0
-        if account:
-            accounts = [account]
-        else:
-            accounts = self._events.keys()
-        for acct in accounts:
-            if acct not in self._events:
-                continue
-            if jid:
-                jids = [jid]
+        attribute = attribute or None
+        if jid:
+            if account:
+                scopes = [(account, jid)]
             else:
-                jids = self._events[acct].keys()
-            for j in jids:
-                if j not in self._events[acct]:
-                    continue
-                for event in self._events[acct][j]:
-                    if types and event.type_ not in types:
-                        continue
-                    if not attribute or \
-                    attribute == 'systray' and event.show_in_systray or \
-                    attribute == 'roster' and event.show_in_roster:
-                        nb += 1
+                scopes = [(acct, jid) for acct in self._events]
+        elif account:
+            scopes = [(account, None)]
+        else:
+            scopes = [(None, None)]
+        types = set(types) or [None]
+        nb = 0
+        for acct, jid_ in scopes:
+            for type_ in types:
+                nb += self._counts.get((acct, jid_, attribute, type_), 0)
         return nb
 
     def _get_some_events(self, attribute):
@@ -386,17 +471,16 @@ class Events:
         """
         events = {}
         for account in self._events:
+            if not self._counts.get((account, None, attribute, None)):
+                continue
             events[account] = {}
             for jid in self._events[account]:
+                if not self._counts.get((account, jid, attribute, None)):
+                    continue
                 events[account][jid] = []
                 for event in self._events[account][jid]:
-                    if attribute == 'systray' and event.show_in_systray or \
-                    attribute == 'roster' and event.show_in_roster:
+                    if attribute in event._indexed_attributes:
                         events[account][jid].append(event)
-                if not events[account][jid]:
-                    del events[account][jid]
-            if not events[account]:
-                del events[account]
         return events
 
     def _get_first_event_with_attribute(self, events):
@@ -436,8 +520,7 @@ class Events:
         return self._get_some_events('systray')
 
     def get_first_systray_event(self):
-        events = self.get_systray_events()
-        return self._get_first_event_with_attribute(events)
+        return self._get_first_from_heap('systray')
 
     def get_nb_roster_events(self, account=None, jid=None, types=None):
         """
@@ -25,7 +25,11 @@ Global Events Dispatcher module.
 :license: GPL
 '''
 
+import heapq
+import time
 import traceback
+from collections import deque
+from operator import itemgetter
 
 from nbxmpp import NodeProcessed
 import logging
@@ -55,40 +59,209 @@ OUT_PRECORE = 90
 OUT_CORE = 100
 OUT_POSTCORE = 110
 
+class EventProfiler(object):
+    '''
+    Records how much wall time event dispatching costs
+
+    Statistics are kept per (kind, event name, name) where kind is
+    'handler' (name is the handler), 'generate' (name is the event class
+    whose generate() was called) or 'dispatch' (a whole raise_event()).
+    '''
+
+    def __init__(self, threshold=50, max_samples=1000):
+        '''
+        :param threshold: handlers running longer than threshold
+        milliseconds are logged and counted as slow
+        :param max_samples: how many durations are kept per key to
+        compute percentiles
+        '''
+        self.threshold = threshold / 1000
+        self.max_samples = max_samples
+        self.stats = {}
+
+    def reset(self):
+        self.stats = {}
+
+    def record(self, kind, event_name, name, duration):
+        key = (kind, event_name, name)
+        stat = self.stats.get(key)
+        if stat is None:
+            # count, total, max, slow, samples
+            stat = self.stats[key] = [0, 0.0, 0.0, 0,
+                                      deque(maxlen=self.max_samples)]
+        stat[0] += 1
+        stat[1] += duration
+        if duration > stat[2]:
+            stat[2] = duration
+        stat[4].append(duration)
+        if kind != 'dispatch' and duration > self.threshold:
+            stat[3] += 1
+            log.warning('Slow %s for event %s: %s took %.1f ms', kind,
+                        event_name, name, duration * 1000)
+
+    @staticmethod
+    def _percentile(samples, percent):
+        index = int(round(percent / 100 * (len(samples) - 1)))
+        return samples[index]
+
+    def get_stats(self):
+        '''
+        Return a list of dicts with the statistics, most expensive first
+        Durations are in milliseconds
+        '''
+        result = []
+        for (kind, event_name, name), stat in self.stats.items():
+            count, total, max_, slow, samples = stat
+            samples = sorted(samples)
+            result.append({
+                'kind': kind,
+                'event': event_name,
+                'name': name,
+                'count': count,
+                'total': total * 1000,
+                'mean': total / count * 1000,
+                'p50': self._percentile(samples, 50) * 1000,
+                'p95': self._percentile(samples, 95) * 1000,
+                'max': max_ * 1000,
+                'slow': slow})
+        result.sort(key=itemgetter('total'), reverse=True)
+        return result
+
+    def get_report(self, limit=None):
+        '''
+        Return the statistics as human readable text
+        '''
+        lines = ['%-8s %-32s %-56s %7s %10s %8s %8s %8s %8s %5s' % (
+            'kind', 'event', 'name', 'count', 'total ms', 'mean',
+            'p50', 'p95', 'max', 'slow')]
+        for stat in self.get_stats()[:limit]:
+            lines.append('%(kind)-8s %(event)-32s %(name)-56s %(count)7d '
+                         '%(total)10.1f %(mean)8.2f %(p50)8.2f %(p95)8.2f '
+                         '%(max)8.2f %(slow)5d' % stat)
+        return '\n'.join(lines)
+
+
+def get_handler_name(handler):
+    return getattr(handler, '__qualname__', None) or repr(handler)
+
+
 class GlobalEventsDispatcher(object):
 
     def __init__(self):
         self.handlers = {}
+        self.filtered_handlers = {}
+        '''
+        Keys: names of events
+        Values: dicts mapping (account, jid) filters to lists of
+        (priority, handler), either part of the filter may be None
+        '''
+        self.profiler = None
+
+    def register_event_handler(self, event_name, priority, handler,
+                               account=None, jid=None):
+        '''
+        Register handler for event_name
+
+        If account and/or jid are given the handler is only called for
+        events of that account (obj.conn.name) and that bare or room JID
+        (obj.room_jid, or obj.jid if the event has no room_jid).
+        '''
+        if account is None and jid is None:
+            handlers_list = self.handlers.setdefault(event_name, [])
+        else:
+            filters = self.filtered_handlers.setdefault(event_name, {})
+            handlers_list = filters.setdefault((account, jid), [])
+
+        i = 0
+        for i, h in enumerate(handlers_list):
+            if priority < h[0]:
+                break
+        else:
+            # no event with smaller prio found, put it at the end
+            i = len(handlers_list)
+
+        handlers_list.insert(i, (priority, handler))
+
+    def remove_event_handler(self, event_name, priority, handler,
+                             account=None, jid=None):
+        if account is None and jid is None:
+            handlers_list = self.handlers.get(event_name)
+        else:
+            filters = self.filtered_handlers.get(event_name, {})
+            handlers_list = filters.get((account, jid))
+        if handlers_list is None:
+            return
+        try:
+            handlers_list.remove((priority, handler))
+        except ValueError as error:
+            log.warning('''Function (%s) with priority "%s" never registered
+            as handler of event "%s". Couldn\'t remove. Error: %s'''
+                              %(handler, priority, event_name, error))
+            return
+        if not handlers_list and (account is not None or jid is not None):
+            del self.filtered_handlers[event_name][(account, jid)]
+            if not self.filtered_handlers[event_name]:
+                del self.filtered_handlers[event_name]
+
+    def change_account_name(self, old_name, new_name):
+        for filters in self.filtered_handlers.values():
+            for account, jid in list(filters):
+                if account == old_name:
+                    filters[(new_name, jid)] = filters.pop((old_name, jid))
+
+    @staticmethod
+    def _get_event_key(obj):
+        account = getattr(getattr(obj, 'conn', None), 'name', None)
+        jid = getattr(obj, 'room_jid', None) or getattr(obj, 'jid', None)
+        if jid is not None:
+            jid = str(jid).split('/', 1)[0]
+        return account, jid
+
+    def get_handlers(self, event_name, *args):
+        '''
+        Return the (priority, handler) tuples which have to be called for
+        event_name, ordered by priority
+        '''
+        handlers_list = self.handlers.get(event_name, [])
+        filters = self.filtered_handlers.get(event_name)
+        if not filters or not args:
+            return handlers_list
+
+        account, jid = self._get_event_key(args[0])
+        matching = [handlers_list]
+        for key in ((account, None), (None, jid), (account, jid)):
+            if key in filters:
+                matching.append(filters[key])
+        if len(matching) == 1:
+            return handlers_list
+        return list(heapq.merge(*matching, key=itemgetter(0)))
 
-    def register_event_handler(self, event_name, priority, handler):
-        if event_name in self.handlers:
-            handlers_list = self.handlers[event_name]
-            i = 0
-            for i, h in enumerate(handlers_list):
-                if priority < h[0]:
-                    break
-            else:
-                # no event with smaller prio found, put it at the end
-                i += 1
-
-            handlers_list.insert(i, (priority, handler))
+    def enable_profiling(self, threshold=50):
+        '''
+        Start recording statistics about handlers and event generation,
+        see EventProfiler
+        '''
+        if self.profiler is None:
+            self.profiler = EventProfiler(threshold)
         else:
-            self.handlers[event_name] = [(priority, handler)]
+            self.profiler.threshold = threshold / 1000
 
-    def remove_event_handler(self, event_name, priority, handler):
-        if event_name in self.handlers:
-            try:
-                self.handlers[event_name].remove((priority, handler))
-            except ValueError as error:
-                log.warning('''Function (%s) with priority "%s" never registered
-                as handler of event "%s". Couldn\'t remove. Error: %s'''
-                                  %(handler, priority, event_name, error))
+    def disable_profiling(self):
+        self.profiler = None
 
     def raise_event(self, event_name, *args, **kwargs):
         log.debug('%s Args: %s'%(event_name, str(args)))
-        if event_name in self.handlers:
-            node_processed = False
-            for priority, handler in self.handlers[event_name]:
+        handlers_list = self.get_handlers(event_name, *args)
+        if not handlers_list:
+            return
+        profiler = self.profiler
+        if profiler is not None:
+            dispatch_start = time.perf_counter()
+        node_processed = False
+        try:
+            for priority, handler in handlers_list:
+                if profiler is not None:
+                    start = time.perf_counter()
                 try:
                     if handler(*args, **kwargs):
                         return True
@@ -98,5 +271,14 @@ class GlobalEventsDispatcher(object):
                     log.error('Error while running an event handler: %s',
                               handler)
                     traceback.print_exc()
-            if node_processed:
-                raise NodeProcessed
+                finally:
+                    if profiler is not None:
+                        profiler.record('handler', event_name,
+                                        get_handler_name(handler),
+                                        time.perf_counter() - start)
+        finally:
+            if profiler is not None:
+                profiler.record('dispatch', event_name, '',
+                                time.perf_counter() - dispatch_start)
+        if node_processed:
+            raise NodeProcessed
@@ -23,13 +23,79 @@
 ##
 
 import os
+import time
+import hashlib
 import logging
+import queue
+import threading
+from collections import OrderedDict
+
+from gi.repository import GLib
+
 from gajim.common import app
 
+log = logging.getLogger('gajim.c.gpg')
+
+# Number of threads running gpg requests
+GPG_WORKERS = 2
+# Number of verified (text, signature) pairs to remember
+VERIFY_CACHE_SIZE = 1000
+# Number of decrypted messages to remember
+DECRYPT_CACHE_SIZE = 500
+
+
+class GPGWorkerPool:
+    """
+    A few threads running gpg requests off the main thread
+
+    The threads are started with the first request. The result of each
+    request is given to its callback in the main loop.
+    """
+
+    def __init__(self, size=GPG_WORKERS):
+        self._size = size
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self._size:
+                thread = threading.Thread(target=self._run,
+                    name='gpg-worker-%s' % len(self._threads), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            func, args, callback = self._queue.get()
+            try:
+                result = func(*args)
+            except Exception:
+                log.exception('gpg request %s failed', func.__name__)
+                result = None
+            if callback:
+                GLib.idle_add(self._deliver, callback, result)
+
+    @staticmethod
+    def _deliver(callback, result):
+        callback(result)
+        return False
+
+    def put(self, func, args=(), callback=None):
+        """
+        Run func(*args) in a worker and give the result to callback
+        """
+        self._start()
+        self._queue.put((func, args, callback))
+
+
 if app.HAVE_GPG:
     import gnupg
     gnupg.logger = logging.getLogger('gajim.c.gnupg')
 
+    workers = GPGWorkerPool()
+
     class GnuPG(gnupg.GPG):
         def __init__(self):
             use_agent = app.config.get('use_gpg_agent')
@@ -40,6 +106,39 @@ if app.HAVE_GPG:
             self.decode_errors = 'replace'
             self.passphrase = None
             self.always_trust = [] # list of keyID to always trust
+            # {(str_, sign): keyID} of the last verified signatures
+            self._verified = OrderedDict()
+            # {(str_, sign): [callback, ]} of the verifications in progress
+            self._verifying = {}
+            # {sha256 of the encrypted message: decrypted message}, filled
+            # from the worker threads
+            self._decrypted = OrderedDict()
+            self._decrypted_lock = threading.Lock()
+            # {operation: (count, total time, longest time)}
+            self._timings = {}
+            self._timings_lock = threading.Lock()
+
+        def _timed(self, operation, func, *args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._add_timing(operation, time.monotonic() - start)
+
+        def _add_timing(self, operation, elapsed):
+            with self._timings_lock:
+                count, total, longest = self._timings.get(operation, (0, 0, 0))
+                self._timings[operation] = (count + 1, total + elapsed,
+                    max(longest, elapsed))
+            log.debug('gpg %s took %.3fs', operation, elapsed)
+
+        def get_timings(self):
+            """
+            Return {operation: (count, total time, longest time)} of the gpg
+            calls made so far, times are in seconds
+            """
+            with self._timings_lock:
+                return dict(self._timings)
 
         def encrypt(self, str_, recipients, always_trust=False):
             trust = always_trust
@@ -51,15 +150,17 @@ if app.HAVE_GPG:
                         trust = False
             if not trust:
                 # check that we'll be able to encrypt
-                result = super(GnuPG, self).list_keys(keys=recipients)
+                result = self._timed('list_keys', super(GnuPG, self).list_keys,
+                    keys=recipients)
                 for key in result:
                     if key['trust'] not in ('f', 'u'):
                         if key['keyid'][-8:] not in self.always_trust:
                             return '', 'NOT_TRUSTED ' + key['keyid'][-8:]
                         else:
                             trust = True
-            result = super(GnuPG, self).encrypt(str_.encode('utf8'), recipients,
-                always_trust=trust, passphrase=self.passphrase)
+            result = self._timed('encrypt', super(GnuPG, self).encrypt,
+                str_.encode('utf8'), recipients, always_trust=trust,
+                passphrase=self.passphrase)
 
             if result.ok:
                 error = ''
@@ -69,14 +170,85 @@ if app.HAVE_GPG:
             return self._stripHeaderFooter(str(result)), error
 
         def decrypt(self, str_, keyID):
+            key = hashlib.sha256(str_.encode('utf8')).digest()
+            decrypted = self._get_decrypted(key)
+            if decrypted is not None:
+                return decrypted
             data = self._addHeaderFooter(str_, 'MESSAGE')
-            result = super(GnuPG, self).decrypt(data.encode('utf8'),
-                passphrase=self.passphrase)
+            result = self._timed('decrypt', super(GnuPG, self).decrypt,
+                data.encode('utf8'), passphrase=self.passphrase)
 
+            if result.ok:
+                with self._decrypted_lock:
+                    self._decrypted[key] = str(result)
+                    if len(self._decrypted) > DECRYPT_CACHE_SIZE:
+                        self._decrypted.popitem(last=False)
             return str(result)
 
+        def _get_decrypted(self, key):
+            with self._decrypted_lock:
+                if key not in self._decrypted:
+                    return None
+                self._decrypted.move_to_end(key)
+                return self._decrypted[key]
+
+        def decrypt_async(self, str_, keyID, callback):
+            """
+            Decrypt the message in a worker thread, then call callback with the
+            decrypted message in the main loop
+            """
+            workers.put(self.decrypt, (str_, keyID), callback)
+
+        def decrypt_batch(self, messages, keyID, callback):
+            """
+            Decrypt a list of messages, like a page of the archive, in the
+            worker threads, then call callback with the list of the decrypted
+            messages in the main loop
+
+            The messages are split between the workers and those which were
+            already decrypted do not run gpg. A message which cannot be
+            decrypted gives an empty string.
+            """
+            results = [''] * len(messages)
+            pending = OrderedDict() # {message: [index, ]}
+            for i, str_ in enumerate(messages):
+                decrypted = self._get_decrypted(
+                    hashlib.sha256(str_.encode('utf8')).digest())
+                if decrypted is None:
+                    pending.setdefault(str_, []).append(i)
+                else:
+                    results[i] = decrypted
+            if not pending:
+                GLib.idle_add(GPGWorkerPool._deliver, callback, results)
+                return
+
+            pending_messages = list(pending)
+            chunks = [pending_messages[i::GPG_WORKERS]
+                for i in range(GPG_WORKERS)]
+            chunks = [chunk for chunk in chunks if chunk]
+            remaining = [len(chunks)]
+
+            def _decrypt_chunk(chunk):
+                return [(str_, self.decrypt(str_, keyID)) for str_ in chunk]
+
+            def _on_chunk_decrypted(decrypted):
+                for str_, text in decrypted or []:
+                    for i in pending[str_]:
+                        results[i] = text
+                remaining[0] -= 1
+                if not remaining[0]:
+                    self._add_timing('decrypt_batch', time.monotonic() - start)
+                    callback(results)
+
+            start = time.monotonic()
+            log.debug('Decrypting %s messages, %s were cached',
+                len(pending), len(messages) - sum(map(len, pending.values())))
+            for chunk in chunks:
+                workers.put(_decrypt_chunk, (chunk,), _on_chunk_decrypted)
+
         def sign(self, str_, keyID):
-            result = super(GnuPG, self).sign(str_.encode('utf8'), keyid=keyID, detach=True,
+            result = self._timed('sign', super(GnuPG, self).sign,
+                str_.encode('utf8'), keyid=keyID, detach=True,
                 passphrase=self.passphrase)
 
             if result.fingerprint:
@@ -99,12 +271,50 @@ if app.HAVE_GPG:
                      str_,
                      self._addHeaderFooter(sign, 'SIGNATURE')]
                     )
-                result = super(GnuPG, self).verify(data.encode('utf8'))
+                result = self._timed('verify', super(GnuPG, self).verify,
+                    data.encode('utf8'))
                 if result.valid:
                     return result.key_id
 
             return ''
 
+        def get_verified_key(self, str_, sign):
+            """
+            Return the keyID the signature was made with if it has already been
+            verified, None otherwise
+            """
+            key = (str_, sign)
+            if key not in self._verified:
+                return None
+            self._verified.move_to_end(key)
+            return self._verified[key]
+
+        def verify_async(self, str_, sign, callback):
+            """
+            Verify the signature in a worker thread, then call callback with
+            the keyID in the main loop
+
+            Several requests for the same signature run gpg only once.
+            """
+            key = (str_, sign)
+            if key in self._verifying:
+                self._verifying[key].append(callback)
+                return
+            self._verifying[key] = [callback]
+            workers.put(self.verify, (str_, sign),
+                lambda keyID: self._on_verified(key, keyID))
+
+        def _on_verified(self, key, keyID):
+            if keyID is None:
+                # gpg failed, do not remember it
+                keyID = ''
+            else:
+                self._verified[key] = keyID
+                if len(self._verified) > VERIFY_CACHE_SIZE:
+                    self._verified.popitem(last=False)
+            for callback in self._verifying.pop(key):
+                callback(keyID)
+
         def get_key(self, keyID):
             return super(GnuPG, self).list_keys(keys=[keyID])
 
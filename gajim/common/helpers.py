@@ -40,6 +40,7 @@ import select
 import base64
 import hashlib
 import shlex
+import unicodedata
 from gajim.common import caps_cache
 import socket
 import time
@@ -601,6 +602,14 @@ def sanitize_filename(filename):
 
     return filename
 
+def normalize_search_string(text):
+    """
+    Return text casefolded and without accents, e.g. for matching search
+    strings typed by the user
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
 def reduce_chars_newlines(text, max_chars = 0, max_lines = 0):
     """
     Cut the chars after 'max_chars' on each line and show only the first
@@ -1051,7 +1060,7 @@ is_first_message=True):
     """
     if type_ and (not app.config.get(type_) or not is_first_message):
         return False
-    if app.config.get('autopopupaway'): # always show notification
+    if app.config.get_policy(account).autopopupaway: # always show notification
         return True
     if app.connections[account].connected in (2, 3): # we're online or chat
         return True
@@ -1061,17 +1070,17 @@ def allow_popup_window(account):
     """
     Is it allowed to popup windows?
     """
-    autopopup = app.config.get('autopopup')
-    autopopupaway = app.config.get('autopopupaway')
-    if autopopup and (autopopupaway or \
+    policy = app.config.get_policy(account)
+    if policy.autopopup and (policy.autopopupaway or \
     app.connections[account].connected in (2, 3)): # we're online or chat
         return True
     return False
 
 def allow_sound_notification(account, sound_event):
-    if app.config.get('sounddnd') or app.connections[account].connected != \
-    app.SHOW_LIST.index('dnd') and app.config.get_per('soundevents',
-    sound_event, 'enabled'):
+    policy = app.config.get_policy(account)
+    if policy.sounddnd or app.connections[account].connected != \
+    app.SHOW_LIST.index('dnd') and \
+    sound_event in policy.enabled_sound_events:
         return True
     return False
 
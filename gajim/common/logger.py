@@ -29,12 +29,18 @@ This module allows to access the on-disk database of logs
 """
 
 import os
+import re
+import glob
 import sys
 import time
+import queue
+import threading
 import datetime
-import calendar
 import json
+import zlib
 from collections import namedtuple
+from collections import OrderedDict
+from contextlib import contextmanager
 from gzip import GzipFile
 from io import BytesIO
 from gi.repository import GLib
@@ -49,6 +55,25 @@ LOG_DB_PATH = app.gajimpaths['LOG_DB']
 LOG_DB_FOLDER, LOG_DB_FILE = os.path.split(LOG_DB_PATH)
 CACHE_DB_PATH = app.gajimpaths['CACHE_DB']
 
+# Seconds between writes of the caps last_seen timestamps
+CAPS_TIME_INTERVAL = 300
+# Caps not seen for that many seconds are removed
+CAPS_MAX_AGE = 3 * 30 * 24 * 3600
+# Rows deleted per step when cleaning the caps table
+CAPS_CLEAN_BATCH = 100
+
+# Seconds after startup until the logs database is maintained the first time
+LOG_MAINTENANCE_DELAY = 60
+# Seconds between two maintenance runs
+LOG_MAINTENANCE_INTERVAL = 6 * 3600
+# Yearly archive databases are stored next to the logs database
+LOG_ARCHIVE_PATTERN = re.compile(r'^logs-archive-(\d{4})\.db$')
+# Lines per compressed block of old history
+LOG_BLOCK_LINES = 200
+# Columns of the lines read from compressed blocks
+COLD_LINE_FIELDS = ('contact_name', 'time', 'kind', 'show', 'message',
+                    'subject', 'additional_data', 'log_line_id')
+
 import logging
 log = logging.getLogger('gajim.c.logger')
 
@@ -105,11 +130,778 @@ class SubscriptionConstant(IntEnum):
     FROM = 2
     BOTH = 3
 
+def _make_row_class(fields):
+    """
+    Create the namedtuple class for rows with the given column names
+
+    If the rows have an additional_data column, the JSON stored in it is
+    only decoded when it is read for the first time, by attribute, index,
+    iteration or _asdict(). Comparing and hashing rows uses the JSON.
+    """
+    Row = namedtuple('Row', fields)
+    if 'additional_data' not in fields:
+        return Row
+    index = fields.index('additional_data')
+
+    class LazyRow(Row):
+        @property
+        def additional_data(self):
+            try:
+                return self.__dict__['additional_data']
+            except KeyError:
+                value = tuple.__getitem__(self, index)
+                # Rows made by _replace() hold the decoded value
+                if not isinstance(value, dict):
+                    value = json.loads(value or '{}')
+                self.__dict__['additional_data'] = value
+                return value
+
+        def __getitem__(self, key):
+            if isinstance(key, slice):
+                return tuple(self)[key]
+            if key in (index, index - len(self)):
+                return self.additional_data
+            return tuple.__getitem__(self, key)
+
+        def __iter__(self):
+            values = list(tuple.__iter__(self))
+            values[index] = self.additional_data
+            return iter(values)
+
+    LazyRow.__name__ = 'Row'
+    return LazyRow
+
+class RowClassCache:
+    """
+    Row classes of Logger.namedtuple_factory, by column names
+    """
+    def __init__(self):
+        self._classes = {}
+        self._last = (None, None)
+
+    def get(self, description):
+        # All rows of a query share the same description object
+        last_description, last_class = self._last
+        if description is last_description:
+            return last_class
+        row_class = self.get_by_fields(
+            tuple(col[0] for col in description))
+        self._last = (description, row_class)
+        return row_class
+
+    def get_by_fields(self, fields):
+        try:
+            return self._classes[fields]
+        except KeyError:
+            row_class = self._classes[fields] = _make_row_class(fields)
+            return row_class
+
+_row_classes = RowClassCache()
+
+def compress_block(columns, rows):
+    """
+    Compress lines of the logs table for the logs_blocks table
+
+    :param columns: The column names
+
+    :param rows:    List of rows, in the order of `columns`
+
+    returns the zlib compressed JSON document
+    """
+    data = json.dumps({'columns': list(columns),
+                       'rows': [list(row) for row in rows]},
+                      separators=(',', ':'))
+    return zlib.compress(data.encode('utf-8'), 9)
+
+def decompress_block(data):
+    """
+    Decompress a block of the logs_blocks table
+
+    returns a tuple of the column names and the list of rows
+    """
+    block = json.loads(zlib.decompress(data).decode('utf-8'))
+    return block['columns'], block['rows']
+
+def _get_local_day(timestamp):
+    # Same as strftime('%Y%m%d', time, 'unixepoch', 'localtime') in sqlite
+    return int(time.strftime('%Y%m%d', time.localtime(timestamp)))
+
+def get_archive_years(folder):
+    """
+    Return the years for which an archive database exists in `folder`
+    """
+    years = []
+    for path in glob.glob(os.path.join(folder, 'logs-archive-*.db')):
+        match = LOG_ARCHIVE_PATTERN.match(os.path.basename(path))
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+class RecentIDs:
+    """
+    Bounded set of the stanza-ids we recently saw, per archive
+
+    An archive is identified by the column of the logs table it is stored
+    under (jid_id for groupchats, account_id otherwise) and the jid id.
+    Only the `size` most recently added ids are kept per archive.
+    """
+    def __init__(self, size=1000):
+        self._size = size
+        self._archives = {}
+
+    def add(self, archive, id_):
+        ids = self._archives.setdefault(archive, OrderedDict())
+        ids[id_] = None
+        ids.move_to_end(id_)
+        if len(ids) > self._size:
+            ids.popitem(last=False)
+
+    def contains(self, archive, ids):
+        known = self._archives.get(archive)
+        if not known:
+            return False
+        return any(id_ in known for id_ in ids)
+
+    def clear(self):
+        self._archives.clear()
+
+
+class LogWriter(threading.Thread):
+    """
+    Write-behind queue for the logs database
+
+    Statements are executed in order on a worker thread with its own
+    connection. Everything that is queued within `max_latency` milliseconds
+    (up to `max_batch` statements) is written in one transaction.
+    """
+    def __init__(self, db_path, max_latency=100, max_batch=500):
+        threading.Thread.__init__(self, name='LogWriter', daemon=True)
+        self._db_path = db_path
+        self._max_latency = max(max_latency, 0) / 1000
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+
+    def execute(self, sql, args=(), callback=None):
+        """
+        Queue a statement
+
+        :param sql:         The SQL statement
+
+        :param args:        The statement parameters
+
+        :param callback:    Called in the main loop with the lastrowid of the
+                            statement once it is committed, None on error
+        """
+        self._queue.put((sql, args, callback))
+
+    def flush(self, timeout=None):
+        """
+        Block until all statements queued so far are committed
+        """
+        if not self.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def stop(self):
+        """
+        Commit all queued statements and stop the worker thread
+        """
+        if not self.is_alive():
+            return
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        con = sqlite.connect(self._db_path, timeout=20.0,
+                             isolation_level=None)
+        try:
+            con.execute('PRAGMA journal_mode = WAL')
+            con.execute('PRAGMA synchronous = NORMAL')
+        except sqlite.Error as e:
+            log.warning('Failed to set journal mode of writer: %s', e)
+
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_latency
+            while len(batch) < self._max_batch:
+                if batch[-1] is None or isinstance(batch[-1], threading.Event):
+                    # Stop or flush request, write out what we have now
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                batch.pop()
+                stop = True
+            self._write(con, batch)
+        con.close()
+
+    @staticmethod
+    def _execute(con, statements):
+        results = []
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, args, callback in statements:
+                lastrowid = con.execute(sql, args).lastrowid
+                if callback is not None:
+                    results.append((callback, lastrowid))
+            con.execute('COMMIT')
+        except sqlite.Error:
+            if con.in_transaction:
+                con.execute('ROLLBACK')
+            raise
+        return results
+
+    def _write(self, con, batch):
+        statements = [item for item in batch if isinstance(item, tuple)]
+        results = []
+        if statements:
+            try:
+                results = self._execute(con, statements)
+            except sqlite.Error as e:
+                # Retry one by one so only the failing statements are lost
+                log.warning('Failed to write batch of %s statements: %s',
+                            len(statements), e)
+                results = []
+                for statement in statements:
+                    try:
+                        results.extend(self._execute(con, [statement]))
+                    except sqlite.Error:
+                        log.exception('Failed to write: %s', statement[0])
+                        if statement[2] is not None:
+                            results.append((statement[2], None))
+            else:
+                log.debug('Wrote %s statements', len(statements))
+
+        for callback, lastrowid in results:
+            GLib.idle_add(callback, lastrowid)
+
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+
+class ReadConnectionPool:
+    """
+    Small pool of read-only connections to the logs database
+
+    In WAL mode readers neither block nor get blocked by the writer, so
+    history browsing and search can run while new lines are written.
+    """
+    def __init__(self, db_path, size=3, setup=None):
+        self._db_path = db_path
+        self._setup = setup
+        self._generation = 0
+        self._generations = {}
+        self._connections = queue.LifoQueue()
+        self._all = []
+        for _i in range(size):
+            con = self._connect()
+            self._all.append(con)
+            self._connections.put(con)
+
+    def _connect(self):
+        con = sqlite.connect(self._db_path, timeout=20.0,
+                             check_same_thread=False)
+        con.execute('PRAGMA query_only = ON')
+        if self._setup is not None:
+            self._setup(con)
+        return con
+
+    def refresh(self):
+        """
+        Run the setup function again on all connections
+
+        Connections that are borrowed right now are set up again when
+        they are borrowed the next time.
+        """
+        self._generation += 1
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection
+
+        If all connections are in use (e.g. a caller iterates over a
+        query from idle handlers) a temporary one is opened, so the GUI
+        thread never waits for itself.
+        """
+        try:
+            con = self._connections.get_nowait()
+        except queue.Empty:
+            con = self._connect()
+            try:
+                yield con
+            finally:
+                con.close()
+            return
+        if self._generations.get(con, 0) != self._generation:
+            if self._setup is not None:
+                self._setup(con)
+            self._generations[con] = self._generation
+        try:
+            yield con
+        finally:
+            self._connections.put(con)
+
+    def close(self):
+        for con in self._all:
+            con.close()
+        self._all = []
+        self._generations.clear()
+
+
+class LogMaintenance(threading.Thread):
+    """
+    Background clean up of the logs database
+
+    Removes history according to the retention policies, moves old history
+    into yearly archive databases, compresses old history into blocks of
+    the logs_blocks table and returns free pages to the file system with
+    incremental vacuum. All work is done in small batches, each in its own
+    short transaction, so the LogWriter never waits for long.
+    """
+    def __init__(self, db_path, retention, archive_before, compress_before,
+                 callback, batch=500, pause=0.05):
+        """
+        :param db_path:         Path of the logs database
+
+        :param retention:       List of (account_id, groupchat, before)
+                                tuples, lines older than the unix time
+                                `before` are deleted
+
+        :param archive_before:  Lines older than this unix time are moved
+                                into the archive databases, None disables
+                                archiving
+
+        :param compress_before: Lines older than this unix time are
+                                compressed, None disables compression
+
+        :param callback:        Called in the main loop with the set of
+                                years that archive lines were moved to
+        """
+        threading.Thread.__init__(self, name='LogMaintenance', daemon=True)
+        self._db_path = db_path
+        self._folder = os.path.dirname(db_path)
+        self._retention = retention
+        self._archive_before = archive_before
+        self._compress_before = compress_before
+        self._callback = callback
+        self._batch = batch
+        self._pause = pause
+        self._stop_event = threading.Event()
+        self._archive_columns = {}
+
+    def stop(self):
+        """
+        Stop after the current batch and wait for the thread
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def _wait(self):
+        # returns True if we were asked to stop
+        return self._stop_event.wait(self._pause)
+
+    def run(self):
+        years = set()
+        try:
+            con = sqlite.connect(self._db_path, timeout=20.0,
+                                 isolation_level=None)
+        except sqlite.Error as e:
+            log.warning('Failed to open logs database for maintenance: %s',
+                        e)
+        else:
+            steps = [self._enforce_retention]
+            if self._archive_before is not None:
+                steps.append(lambda con: self._archive(con, years))
+            if self._compress_before is not None:
+                steps.append(self._compress)
+            steps.append(self._vacuum)
+            try:
+                for step in steps:
+                    if self._stop_event.is_set():
+                        break
+                    step(con)
+            except sqlite.Error:
+                log.exception('Logs database maintenance failed')
+            finally:
+                con.close()
+        GLib.idle_add(self._callback, years)
+
+    @staticmethod
+    def _get_jid_ids(con, groupchat=None):
+        if groupchat is None:
+            sql = 'SELECT jid_id FROM jids'
+        elif groupchat:
+            sql = 'SELECT jid_id FROM jids WHERE type = %d' % \
+                JIDConstant.ROOM_TYPE
+        else:
+            sql = 'SELECT jid_id FROM jids WHERE type IS NOT %d' % \
+                JIDConstant.ROOM_TYPE
+        return [row[0] for row in con.execute(sql)]
+
+    def _enforce_retention(self, con):
+        sql = '''DELETE FROM logs WHERE log_line_id IN
+                 (SELECT log_line_id FROM logs
+                  WHERE jid_id = ? AND account_id = ? AND time < ? LIMIT ?)'''
+        deleted = 0
+        for account_id, groupchat, before in self._retention:
+            jid_ids = self._get_jid_ids(con, groupchat)
+            for jid_id in jid_ids:
+                while True:
+                    count = con.execute(
+                        sql, (jid_id, account_id, before, self._batch)).rowcount
+                    deleted += count
+                    if count < self._batch:
+                        break
+                    if self._wait():
+                        return
+                deleted += self._delete_blocks(con, jid_id, account_id, before)
+            # Archived lines expire like the others
+            last_year = time.localtime(before).tm_year
+            for year in get_archive_years(self._folder):
+                if year > last_year:
+                    continue
+                schema = self._attach_archive(con, year)
+                for jid_id in jid_ids:
+                    while True:
+                        count = self._delete_archived(
+                            con, schema, jid_id, account_id, before)
+                        deleted += count
+                        if count < self._batch:
+                            break
+                        if self._wait():
+                            return
+            for jid_id in jid_ids:
+                con.execute(
+                    '''DELETE FROM moved_stanza_ids
+                    WHERE jid_id = ? AND account_id = ? AND time < ?''',
+                    (jid_id, account_id, before))
+        if deleted:
+            log.info('Deleted %s lines because of retention policies',
+                     deleted)
+
+    @staticmethod
+    def _remove_from_days(con, jid_id, days, tables=('main.logs',)):
+        """
+        Remove deleted lines from logs_days, must be called inside a
+        transaction
+
+        Needed for lines that are not deleted from the logs table of the
+        main database, where the delete trigger does it. The first and
+        last line of the days that still have lines are looked up again.
+
+        :param days:    {day: number of deleted lines}, days as YYYYMMDD
+
+        :param tables:  The logs tables that can hold the remaining lines
+        """
+        con.executemany(
+            '''UPDATE main.logs_days SET messages = messages - ?
+            WHERE jid_id = ? AND day = ?''',
+            [(count, jid_id, day) for day, count in days.items()])
+        con.execute('''DELETE FROM main.logs_days
+                       WHERE jid_id = ? AND messages <= 0''', (jid_id,))
+        sql = '''SELECT MIN(log_line_id), MAX(log_line_id), MAX(time) FROM (
+            {lines})'''.format(lines=' UNION ALL '.join(
+                '''SELECT log_line_id, time FROM {table}
+                WHERE jid_id = :jid_id AND kind NOT IN (0, 1)
+                AND time >= :start AND time < :end'''.format(table=table)
+                for table in tables))
+        for day in days:
+            date = datetime.date(day // 10000, day // 100 % 100, day % 100)
+            start = time.mktime(date.timetuple())
+            end = time.mktime((date + datetime.timedelta(days=1)).timetuple())
+            first, last, last_time = con.execute(sql, {
+                'jid_id': jid_id, 'start': start, 'end': end}).fetchone()
+            # Keep the bounds of lines we cannot see, like compressed ones
+            con.execute(
+                '''UPDATE main.logs_days SET
+                first_log_line_id = COALESCE(?, first_log_line_id),
+                last_log_line_id = COALESCE(?, last_log_line_id),
+                last_time = COALESCE(?, last_time)
+                WHERE jid_id = ? AND day = ?''',
+                (first, last, last_time, jid_id, day))
+
+    def _delete_archived(self, con, schema, jid_id, account_id, before):
+        """
+        Delete one batch of archived lines older than `before`
+
+        returns the number of deleted lines
+        """
+        rows = con.execute(
+            '''SELECT log_line_id, time, kind FROM {schema}.logs
+            WHERE jid_id = ? AND account_id = ? AND time < ? LIMIT ?
+            '''.format(schema=schema),
+            (jid_id, account_id, before, self._batch)).fetchall()
+        if not rows:
+            return 0
+        days = {}
+        for _log_line_id, time_, kind in rows:
+            if kind in (KindConstant.STATUS, KindConstant.GCSTATUS):
+                continue
+            day = _get_local_day(time_)
+            days[day] = days.get(day, 0) + 1
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            con.execute(
+                'DELETE FROM {schema}.logs WHERE log_line_id IN ({ids})'.format(
+                    schema=schema,
+                    ids=', '.join(str(row[0]) for row in rows)))
+            self._remove_from_days(con, jid_id, days,
+                                   ('main.logs', '%s.logs' % schema))
+            con.execute('COMMIT')
+        except sqlite.Error:
+            if con.in_transaction:
+                con.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    @classmethod
+    def _delete_blocks(cls, con, jid_id, account_id, before):
+        """
+        Delete the compressed blocks that only hold lines older than
+        `before`
+
+        returns the number of deleted lines
+        """
+        blocks = con.execute(
+            '''SELECT block_id, data FROM logs_blocks
+            WHERE jid_id = ? AND account_id = ? AND end_time < ?''',
+            (jid_id, account_id, before)).fetchall()
+        deleted = 0
+        for block_id, data in blocks:
+            columns, rows = decompress_block(data)
+            time_index = columns.index('time')
+            kind_index = columns.index('kind')
+            days = {}
+            for row in rows:
+                if row[kind_index] in (KindConstant.STATUS,
+                                       KindConstant.GCSTATUS):
+                    continue
+                day = _get_local_day(row[time_index])
+                days[day] = days.get(day, 0) + 1
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                con.execute('DELETE FROM logs_blocks WHERE block_id = ?',
+                            (block_id,))
+                cls._remove_from_days(con, jid_id, days)
+                con.execute('COMMIT')
+            except sqlite.Error:
+                if con.in_transaction:
+                    con.execute('ROLLBACK')
+                raise
+            deleted += len(rows)
+        return deleted
+
+    def _attach_archive(self, con, year):
+        schema = 'archive_%d' % year
+        attached = [row[1] for row in con.execute('PRAGMA database_list')]
+        if schema in attached:
+            return schema
+        path = os.path.join(self._folder, 'logs-archive-%d.db' % year)
+        con.execute('ATTACH DATABASE ? AS %s' % schema, (path,))
+        con.executescript(
+            '''
+            CREATE TABLE IF NOT EXISTS {schema}.logs AS
+                SELECT * FROM main.logs WHERE 0;
+            CREATE UNIQUE INDEX IF NOT EXISTS
+                {schema}.idx_logs_log_line_id ON logs (log_line_id);
+            CREATE INDEX IF NOT EXISTS
+                {schema}.idx_logs_jid_id_time ON logs (jid_id, time DESC);
+            '''.format(schema=schema))
+        main_columns = [row[1] for row in
+                        con.execute('PRAGMA main.table_info(logs)')]
+        archive_columns = {row[1] for row in
+                           con.execute('PRAGMA %s.table_info(logs)' % schema)}
+        self._archive_columns[schema] = ', '.join(
+            column for column in main_columns if column in archive_columns)
+        return schema
+
+    @staticmethod
+    def _delete_moved_lines(con, ids):
+        """
+        Delete lines that were moved out of the logs table, but keep them
+        in logs_days and their stanza-ids in moved_stanza_ids
+
+        The delete trigger removes the lines from logs_days, but the
+        history calendar still has to show the days of lines that were
+        only moved. find_stanza_id() still has to find their stanza-ids.
+        Must be called inside a transaction.
+
+        :param ids:     The log_line_ids, joined with commas
+        """
+        con.execute(
+            '''INSERT INTO main.moved_stanza_ids
+            SELECT stanza_id, jid_id, account_id, time FROM main.logs
+            WHERE log_line_id IN ({ids}) AND stanza_id IS NOT NULL
+            '''.format(ids=ids))
+        days = con.execute(
+            '''SELECT jid_id,
+                CAST(strftime('%Y%m%d', time, 'unixepoch', 'localtime')
+                     AS INTEGER) AS day,
+                COUNT(*), MIN(log_line_id), MAX(log_line_id), MAX(time)
+            FROM main.logs WHERE log_line_id IN ({ids})
+            AND kind NOT IN (0, 1) GROUP BY jid_id, day
+            '''.format(ids=ids)).fetchall()
+        con.execute('DELETE FROM main.logs WHERE log_line_id IN (%s)' % ids)
+        con.executemany(
+            '''INSERT OR IGNORE INTO main.logs_days
+            VALUES (?, ?, 0, ?, ?, ?)''',
+            [(jid_id, day, first, last, last_time)
+             for jid_id, day, _count, first, last, last_time in days])
+        con.executemany(
+            '''UPDATE main.logs_days SET messages = messages + ?,
+                first_log_line_id = MIN(first_log_line_id, ?),
+                last_log_line_id = MAX(last_log_line_id, ?),
+                last_time = MAX(last_time, ?)
+            WHERE jid_id = ? AND day = ?''',
+            [(count, first, last, last_time, jid_id, day)
+             for jid_id, day, count, first, last, last_time in days])
+
+    def _move_to_archive(self, con, schema, ids):
+        ids = ', '.join(str(id_) for id_ in ids)
+        columns = self._archive_columns[schema]
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            con.execute(
+                '''INSERT OR IGNORE INTO {schema}.logs ({columns})
+                SELECT {columns} FROM main.logs WHERE log_line_id IN ({ids})
+                '''.format(schema=schema, columns=columns, ids=ids))
+            self._delete_moved_lines(con, ids)
+            con.execute('COMMIT')
+        except sqlite.Error:
+            if con.in_transaction:
+                con.execute('ROLLBACK')
+            raise
+
+    def _archive(self, con, years):
+        sql = '''SELECT log_line_id,
+                 CAST(strftime('%Y', time, 'unixepoch', 'localtime')
+                      AS INTEGER)
+                 FROM logs WHERE jid_id = ? AND time < ?
+                 AND log_line_id NOT IN (SELECT message_id FROM unread_messages)
+                 LIMIT ?'''
+        moved = 0
+        for jid_id in self._get_jid_ids(con):
+            while True:
+                rows = con.execute(
+                    sql, (jid_id, self._archive_before, self._batch)).fetchall()
+                by_year = {}
+                for log_line_id, year in rows:
+                    by_year.setdefault(year, []).append(log_line_id)
+                for year, ids in by_year.items():
+                    schema = self._attach_archive(con, year)
+                    self._move_to_archive(con, schema, ids)
+                    years.add(year)
+                moved += len(rows)
+                if len(rows) < self._batch:
+                    break
+                if self._wait():
+                    return
+        if moved:
+            log.info('Moved %s lines to the archive', moved)
+
+    def _compress(self, con):
+        """
+        Compress old lines into blocks of LOG_BLOCK_LINES lines of the same
+        jid and account
+
+        Unread lines and the lines of an incomplete block stay in the logs
+        table.
+        """
+        columns = [row[1] for row in
+                   con.execute('PRAGMA main.table_info(logs)')]
+        time_index = columns.index('time')
+        id_index = columns.index('log_line_id')
+        sql = '''SELECT {columns} FROM logs
+                 WHERE jid_id = ? AND account_id IS ? AND time < ?
+                 AND log_line_id NOT IN (SELECT message_id FROM unread_messages)
+                 ORDER BY time, log_line_id LIMIT ?
+                 '''.format(columns=', '.join(columns))
+        lines = size = compressed = 0
+        for jid_id in self._get_jid_ids(con):
+            accounts = [row[0] for row in con.execute(
+                '''SELECT DISTINCT account_id FROM logs
+                WHERE jid_id = ? AND time < ?''',
+                (jid_id, self._compress_before))]
+            for account_id in accounts:
+                while True:
+                    rows = con.execute(sql, (jid_id, account_id,
+                        self._compress_before, LOG_BLOCK_LINES)).fetchall()
+                    if len(rows) < LOG_BLOCK_LINES:
+                        break
+                    data = compress_block(columns, rows)
+                    raw_size = sum(len(str(value)) for row in rows
+                                   for value in row if value is not None)
+                    con.execute('BEGIN IMMEDIATE')
+                    try:
+                        con.execute(
+                            '''INSERT INTO logs_blocks (jid_id, account_id,
+                            start_time, end_time, lines, size, data)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                            (jid_id, account_id, rows[0][time_index],
+                             rows[-1][time_index], len(rows), raw_size,
+                             data))
+                        self._delete_moved_lines(con, ', '.join(
+                            str(row[id_index]) for row in rows))
+                        con.execute('COMMIT')
+                    except sqlite.Error:
+                        if con.in_transaction:
+                            con.execute('ROLLBACK')
+                        raise
+                    lines += len(rows)
+                    size += raw_size
+                    compressed += len(data)
+                    if self._wait():
+                        return
+        if lines:
+            log.info('Compressed %s lines from %s to %s bytes', lines, size,
+                     compressed)
+
+    def _vacuum(self, con):
+        # 2 means INCREMENTAL, the mode can only be changed with a VACUUM
+        if con.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return
+        freed = 0
+        while not self._stop_event.is_set():
+            free = con.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            pages = min(free, self._batch)
+            con.execute('PRAGMA incremental_vacuum(%d)' % pages).fetchall()
+            freed += pages
+            if self._wait():
+                break
+        if freed:
+            log.info('Returned %s free pages of the logs database', freed)
+
+
 class Logger:
     def __init__(self):
         self._jid_ids = {}
+        self._recent_ids = RecentIDs()
         self.con = None
         self.commit_timout_id = None
+        self._fts_enabled = False
+        self._writer = None
+        self._readers = None
+        self._next_log_line_id = None
+        self._caps_times = {}
+        self._caps_times_timeout_id = None
+        self._clean_caps_timeout_id = None
+        self._archives = []
+        self._maintenance = None
+        self._maintenance_timeout_id = None
 
         if not os.path.exists(LOG_DB_PATH):
             # this can happen only the first time (the time we create the db)
@@ -128,18 +920,30 @@ class Logger:
         Usage:
         con.row_factory = namedtuple_factory
         """
-        fields = [col[0] for col in cursor.description]
-        Row = namedtuple("Row", fields)
-        named_row = Row(*row)
-        if 'additional_data' in fields:
-            named_row = named_row._replace(
-                additional_data=json.loads(named_row.additional_data or '{}'))
-        return named_row
+        return _row_classes.get(cursor.description)._make(row)
 
     def dispatch(self, event, error):
         app.ged.raise_event(event, None, str(error))
 
     def close_db(self):
+        if self._clean_caps_timeout_id is not None:
+            GLib.source_remove(self._clean_caps_timeout_id)
+            self._clean_caps_timeout_id = None
+        if self._maintenance_timeout_id is not None:
+            GLib.source_remove(self._maintenance_timeout_id)
+            self._maintenance_timeout_id = None
+        if self._maintenance:
+            self._maintenance.stop()
+        self._maintenance = None
+        if self.con:
+            self._write_caps_times()
+            self.commit()
+        if self._writer:
+            self._writer.stop()
+        self._writer = None
+        if self._readers:
+            self._readers.close()
+        self._readers = None
         if self.con:
             self.con.close()
         self.con = None
@@ -160,14 +964,243 @@ class Logger:
         self.con = sqlite.connect(LOG_DB_FILE, timeout=20.0,
                 isolation_level='IMMEDIATE')
         os.chdir(back)
-        self.con.row_factory = self.namedtuple_factory
+        self._setup_connection(self.con)
+
+        self.cur = self.con.cursor()
+        self.set_journal_mode_wal()
+        self.set_synchronous(True)
+        self._fts_enabled = self._search_index_exists()
+
+        self._next_log_line_id = self._get_last_log_line_id() + 1
+        self._archives = self._find_archives()
+        self._writer = LogWriter(LOG_DB_PATH,
+                                 app.config.get('log_write_max_latency'))
+        self._writer.start()
+        self._readers = ReadConnectionPool(LOG_DB_PATH,
+                                           setup=self._setup_reader)
+
+    def _setup_connection(self, con):
+        con.row_factory = self.namedtuple_factory
 
         # DB functions
-        self.con.create_function("like", 1, self._like)
-        self.con.create_function("get_timeout", 0, self._get_timeout)
+        con.create_function("like", 1, self._like)
+        con.create_function("get_timeout", 0, self._get_timeout)
+
+    def _setup_reader(self, con):
+        self._setup_connection(con)
+        attached = {row.name for row in con.execute('PRAGMA database_list')}
+        for year in self._archives:
+            schema = 'archive_%d' % year
+            if schema in attached:
+                continue
+            path = os.path.join(LOG_DB_FOLDER, 'logs-archive-%d.db' % year)
+            try:
+                con.execute('ATTACH DATABASE ? AS %s' % schema, (path,))
+            except sqlite.OperationalError as e:
+                log.warning('Failed to attach archive %s: %s', year, e)
 
-        self.cur = self.con.cursor()
-        self.set_synchronous(False)
+    @staticmethod
+    def _find_archives():
+        """
+        Return the years for which an archive database exists
+        """
+        return get_archive_years(LOG_DB_FOLDER)
+
+    def _get_logs_tables(self, con, year=None):
+        """
+        Return the logs tables attached to a read connection, the one of
+        the main database first
+
+        :param year:    Only return the archive of this year
+        """
+        attached = {row.name for row in con.execute('PRAGMA database_list')}
+        tables = ['logs']
+        for archive in self._archives:
+            if year is not None and archive != year:
+                continue
+            schema = 'archive_%d' % archive
+            if schema in attached:
+                tables.append('%s.logs' % schema)
+        return tables
+
+    @staticmethod
+    def _get_cold_lines(con, jids, start=None, end=None):
+        """
+        Return the lines of the compressed blocks of the given jids
+
+        :param start:   If given, only return lines from this unix time on
+
+        :param end:     If given, only return lines up to this unix time
+
+        returns a list of namedtuples with the COLD_LINE_FIELDS
+        """
+        sql = '''SELECT data FROM logs_blocks NATURAL JOIN jids
+                 WHERE jid IN ({jids})'''.format(
+                     jids=', '.join('?' * len(jids)))
+        args = tuple(jids)
+        if start is not None:
+            sql += ' AND end_time >= ? AND start_time <= ?'
+            args += (start, end)
+
+        row_class = _row_classes.get_by_fields(COLD_LINE_FIELDS)
+        lines = []
+        for block in con.execute(sql, args):
+            columns, rows = decompress_block(block.data)
+            indexes = [columns.index(field) for field in COLD_LINE_FIELDS]
+            time_index = columns.index('time')
+            for row in rows:
+                if start is not None and not start <= row[time_index] <= end:
+                    continue
+                lines.append(row_class._make([row[i] for i in indexes]))
+        return lines
+
+    def _search_cold_lines(self, con, jids, terms, date_args, fields):
+        """
+        Return the lines of the compressed blocks that contain all `terms`
+        in one of `fields`, ignoring case
+        """
+        terms = [term.lower() for term in terms]
+        found = []
+        for line in self._get_cold_lines(con, jids, *date_args):
+            text = ' '.join(getattr(line, field) or '' for field in fields)
+            text = text.lower()
+            if all(term in text for term in terms):
+                found.append(line)
+        return found
+
+    def get_cold_storage_stats(self):
+        """
+        returns a tuple of the number of compressed blocks and lines, the
+        size of the lines before and after compression
+        """
+        sql = '''SELECT COUNT(*) AS blocks, IFNULL(SUM(lines), 0) AS lines,
+                 IFNULL(SUM(size), 0) AS size,
+                 IFNULL(SUM(LENGTH(data)), 0) AS compressed
+                 FROM logs_blocks'''
+        with self._readers.connection() as con:
+            return tuple(con.execute(sql).fetchone())
+
+    def schedule_maintenance(self):
+        """
+        Maintain the logs database shortly after startup and then regularly
+
+        See LogMaintenance.
+        """
+        if self._maintenance_timeout_id is None:
+            self._maintenance_timeout_id = GLib.timeout_add_seconds(
+                LOG_MAINTENANCE_DELAY, self._on_maintenance_timeout)
+
+    def _on_maintenance_timeout(self):
+        self._maintenance_timeout_id = GLib.timeout_add_seconds(
+            LOG_MAINTENANCE_INTERVAL, self._on_maintenance_timeout)
+        self.run_maintenance()
+        return False
+
+    def _get_retention_policies(self):
+        policies = []
+        now = time.time()
+        for account in app.config.get_per('accounts'):
+            account_id = None
+            for groupchat, option in ((False, 'log_retention_chat'),
+                                      (True, 'log_retention_groupchat')):
+                days = app.config.get_per('accounts', account, option)
+                if days < 0:
+                    continue
+                if account_id is None:
+                    account_id = self.get_account_id(account)
+                policies.append((account_id, groupchat, now - days * 86400))
+        return policies
+
+    def run_maintenance(self):
+        """
+        Apply the retention policies, archive old lines and reclaim free
+        space in a background thread
+
+        returns False if a maintenance is already running
+        """
+        if self._maintenance is not None or self.con is None:
+            return False
+        archive_before = None
+        days = app.config.get('log_archive_after_days')
+        if days >= 0:
+            archive_before = time.time() - days * 86400
+        compress_before = None
+        days = app.config.get('log_compress_after_days')
+        if days >= 0:
+            compress_before = time.time() - days * 86400
+        policies = self._get_retention_policies()
+        # New jids must be visible to the maintenance connection
+        self.flush()
+        self._maintenance = LogMaintenance(
+            LOG_DB_PATH, policies, archive_before, compress_before,
+            self._on_maintenance_finished)
+        self._maintenance.start()
+        return True
+
+    def _on_maintenance_finished(self, years):
+        if self._maintenance is not None:
+            self._maintenance.join()
+        self._maintenance = None
+        if self._readers is not None:
+            blocks, lines, size, compressed = self.get_cold_storage_stats()
+            if blocks:
+                log.info('%s lines in %s compressed blocks, %s bytes saved',
+                         lines, blocks, size - compressed)
+        new_years = set(years) - set(self._archives)
+        if new_years and self._readers is not None:
+            self._archives = sorted(set(self._archives) | new_years)
+            self._readers.refresh()
+        return False
+
+    def _get_last_log_line_id(self):
+        """
+        Return the highest log_line_id that was ever handed out
+
+        log_line_ids for new rows are assigned here instead of by sqlite,
+        so callers know the id before the LogWriter inserted the row.
+        """
+        sql = '''SELECT MAX(
+                 IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'logs'), 0),
+                 IFNULL((SELECT MAX(log_line_id) FROM logs), 0)) AS id'''
+        return self.con.execute(sql).fetchone().id
+
+    def flush(self):
+        """
+        Block until all queued writes are committed to the database
+        """
+        if self.commit_timout_id:
+            # Make new jids visible to the read connections
+            self.commit()
+        if self._writer:
+            self._writer.flush()
+
+    def _search_index_exists(self):
+        """
+        Return True if the full-text search index over the logs table exists
+        """
+        sql = '''SELECT name FROM sqlite_master
+                 WHERE type = 'table' AND name = 'logs_fts' '''
+        try:
+            return self.con.execute(sql).fetchone() is not None
+        except sqlite.Error as e:
+            log.debug('Failed to look for search index: %s', e)
+            return False
+
+    def rebuild_search_index(self):
+        """
+        Rebuild the full-text search index from the content of the logs table
+
+        This is only needed if the index got out of sync with the logs table,
+        e.g. after restoring a backup of the logs table alone.
+
+        returns True if the index was rebuilt
+        """
+        if not self._fts_enabled:
+            return False
+        log.info('Rebuild search index')
+        self.con.execute("INSERT INTO logs_fts (logs_fts) VALUES ('rebuild')")
+        self.commit()
+        return True
 
     def attach_cache_database(self):
         try:
@@ -176,7 +1209,24 @@ class Logger:
         except sqlite.Error as e:
             log.debug("Failed to attach cache database: %s" % str(e))
 
+    def set_journal_mode_wal(self):
+        """
+        Switch the database to write-ahead logging
+
+        The journal mode is persistent, it applies to all connections.
+        """
+        try:
+            mode = self.con.execute('PRAGMA journal_mode = WAL').fetchone()
+            if mode[0].lower() != 'wal':
+                log.warning('Failed to set journal mode to WAL: %s', mode[0])
+        except sqlite.Error as e:
+            log.warning('Failed to set journal mode to WAL: %s', e)
+
     def set_synchronous(self, sync):
+        """
+        With sync, use synchronous = NORMAL. In WAL mode this can lose the
+        last transactions on power loss, but never corrupts the database.
+        """
         try:
             if sync:
                 self.cur.execute("PRAGMA synchronous = NORMAL")
@@ -187,6 +1237,7 @@ class Logger:
 
     def init_vars(self):
         self.open_db()
+        self._recent_ids.clear()
         self.get_jid_ids_from_db()
 
     @staticmethod
@@ -473,9 +1524,8 @@ class Logger:
         """
         Add unread message with id: message_id
         """
-        sql = 'INSERT INTO unread_messages VALUES (%d, %d, 0)' % (message_id,
-                jid_id)
-        self.simple_commit(sql)
+        sql = 'INSERT INTO unread_messages VALUES (?, ?, 0)'
+        self._writer.execute(sql, (message_id, jid_id))
 
     def set_read_messages(self, message_ids):
         """
@@ -483,55 +1533,54 @@ class Logger:
         """
         ids = ','.join([str(i) for i in message_ids])
         sql = 'DELETE FROM unread_messages WHERE message_id IN (%s)' % ids
-        self.simple_commit(sql)
+        self._writer.execute(sql)
 
     def set_shown_unread_msgs(self, msg_log_id):
         """
         Mark unread message as shown un GUI
         """
-        sql = 'UPDATE unread_messages SET shown = 1 where message_id = %s' % \
-                msg_log_id
-        self.simple_commit(sql)
+        sql = 'UPDATE unread_messages SET shown = 1 where message_id = ?'
+        self._writer.execute(sql, (msg_log_id,))
 
     def reset_shown_unread_messages(self):
         """
         Set shown field to False in unread_messages table
         """
         sql = 'UPDATE unread_messages SET shown = 0'
-        self.simple_commit(sql)
+        self._writer.execute(sql)
 
     def get_unread_msgs(self):
         """
         Get all unread messages
+
+        Rows are yielded while the query runs, grouped by jid and ordered
+        by time within a jid. Each row has the log_line_id, message, time,
+        subject, jid, additional_data and shown columns. Unread entries
+        whose log line does not exist anymore are removed.
         """
-        all_messages = []
-        try:
-            self.cur.execute(
-                    'SELECT message_id, shown from unread_messages')
-            unread_results = self.cur.fetchall()
-        except Exception:
-            unread_results = []
-        for message in unread_results:
-            msg_log_id = message.message_id
-            shown = message.shown
-            # here we get infos for that message, and related jid from jids table
-            # do NOT change order of SELECTed things, unless you change function(s)
-            # that called this function
-            self.cur.execute('''
-                    SELECT logs.log_line_id, logs.message, logs.time, logs.subject,
-                    jids.jid, logs.additional_data
-                    FROM logs, jids
-                    WHERE logs.log_line_id = %d AND logs.jid_id = jids.jid_id
-                    ''' % msg_log_id
-                    )
-            results = self.cur.fetchone()
-            if len(results) == 0:
-                # Log line is no more in logs table. remove it from unread_messages
-                self.set_read_messages([msg_log_id])
-                continue
+        self.flush()
+        self._writer.execute('''
+            DELETE FROM unread_messages WHERE NOT EXISTS (
+                SELECT 1 FROM logs
+                WHERE logs.log_line_id = unread_messages.message_id)
+            ''')
 
-            all_messages.append((results, shown))
-        return all_messages
+        sql = '''
+            SELECT logs.log_line_id, logs.message, logs.time, logs.subject,
+                   jids.jid, logs.additional_data, unread_messages.shown
+            FROM unread_messages
+            JOIN logs ON logs.log_line_id = unread_messages.message_id
+            JOIN jids ON jids.jid_id = logs.jid_id
+            ORDER BY jids.jid, logs.time
+            '''
+        with self._readers.connection() as con:
+            try:
+                cursor = con.execute(sql)
+            except sqlite.Error as error:
+                log.warning('Could not read unread messages: %s', error)
+                return
+            for row in cursor:
+                yield row
 
     def get_last_conversation_lines(self, account, jid, pending):
         """
@@ -557,6 +1606,9 @@ class Logger:
         if restore <= 0:
             return []
 
+        # `pending` counts messages that may still be queued for writing
+        self.flush()
+
         kinds = map(str, [KindConstant.SINGLE_MSG_RECV,
                           KindConstant.SINGLE_MSG_SENT,
                           KindConstant.CHAT_MSG_RECV,
@@ -574,8 +1626,9 @@ class Logger:
                        kinds=', '.join(kinds))
 
         try:
-            messages = self.con.execute(
-                sql, tuple(jids) + (restore, pending)).fetchall()
+            with self._readers.connection() as con:
+                messages = con.execute(
+                    sql, tuple(jids) + (restore, pending)).fetchall()
         except sqlite.DatabaseError:
             self.dispatch('DB_ERROR',
                           exceptions.DatabaseMalformed(LOG_DB_PATH))
@@ -613,19 +1666,76 @@ class Logger:
         delta = datetime.timedelta(
             hours=23, minutes=59, seconds=59, microseconds=999999)
 
-        sql = '''
+        select = '''
             SELECT contact_name, time, kind, show, message, subject,
                    additional_data, log_line_id
-            FROM logs NATURAL JOIN jids WHERE jid IN ({jids})
+            FROM {logs} NATURAL JOIN jids WHERE jid IN ({jids})
             AND time BETWEEN ? AND ?
-            ORDER BY time, log_line_id
-            '''.format(jids=', '.join('?' * len(jids)))
+            '''
+        args = tuple(jids) + (date.timestamp(), (date + delta).timestamp())
+
+        with self._readers.connection() as con:
+            # Archives are split by local year, like date
+            tables = self._get_logs_tables(con, date.year)
+            sql = ' UNION ALL '.join(
+                select.format(logs=table, jids=', '.join('?' * len(jids)))
+                for table in tables) + ' ORDER BY time, log_line_id'
+            lines = con.execute(sql, args * len(tables)).fetchall()
+            cold_lines = self._get_cold_lines(con, jids, *args[-2:])
+        if cold_lines:
+            lines = sorted(lines + cold_lines, key=self._line_order)
+        return lines
+
+    @staticmethod
+    def _line_order(line):
+        return line.time, line.log_line_id
+
+    @staticmethod
+    def get_search_terms(text):
+        """
+        Split a search string into the words and phrases it searches for
 
-        return self.con.execute(sql, tuple(jids) +
-                                      (date.timestamp(),
-                                      (date + delta).timestamp())).fetchall()
+        See build_search_query() for the syntax.
+        """
+        terms = []
+        for match in re.finditer(r'"([^"]*)"|(\S+)', text):
+            phrase, word = match.groups()
+            term = phrase.strip() if phrase is not None else \
+                word.replace('"', '').rstrip('*')
+            if term:
+                terms.append(term)
+        return terms
+
+    @staticmethod
+    def build_search_query(text):
+        """
+        Convert a search string into a FTS5 query
 
-    def search_log(self, account, jid, query, date=None):
+        Words are searched for individually, a trailing `*` searches for
+        all words starting with the prefix and text in double quotes is
+        searched for as a phrase, e.g.: `hello wor* "good morning"`
+
+        :param text:    The search string
+
+        returns the FTS5 query string, empty if there is nothing to search for
+        """
+        terms = []
+        for match in re.finditer(r'"([^"]*)"|(\S+)', text):
+            phrase, word = match.groups()
+            if phrase is not None:
+                phrase = phrase.strip()
+                if phrase:
+                    terms.append('"%s"' % phrase)
+                continue
+
+            prefix = word.endswith('*')
+            word = word.replace('"', '').rstrip('*')
+            if not word:
+                continue
+            terms.append('"%s"%s' % (word, '*' if prefix else ''))
+        return ' '.join(terms)
+
+    def search_log(self, account, jid, query, date=None, ranked=False):
         """
         Search the conversation log for messages containing the `query` string.
 
@@ -633,6 +1743,11 @@ class Logger:
         `account` and `jid` or be restriced to a single day by
         specifying `date`.
 
+        If the full-text search index is available `query` may use the
+        syntax described in build_search_query(). Archived and compressed
+        lines are not in the index, they are searched for the words and
+        phrases of `query`, see get_search_terms().
+
         :param account: The account
 
         :param jid:     The jid for which we request the conversation
@@ -642,29 +1757,90 @@ class Logger:
         :param date:    datetime.datetime instance
                         example: datetime.datetime(year, month, day)
 
+        :param ranked:  Order the results by relevance instead of time
+
         returns a list of namedtuples
         """
         jids = self._get_family_jids(account, jid)
 
+        between = ''
+        date_args = ()
         if date:
             delta = datetime.timedelta(
                 hours=23, minutes=59, seconds=59, microseconds=999999)
 
-            between = '''
-                AND time BETWEEN {start} AND {end}
-                '''.format(start=date.timestamp(),
-                           end=(date + delta).timestamp())
+            between = 'AND logs.time BETWEEN ? AND ?'
+            date_args = (date.timestamp(), (date + delta).timestamp())
+
+        if self._fts_enabled:
+            fts_query = self.build_search_query(query)
+            if not fts_query:
+                return []
+
+            sql = '''
+            SELECT logs.contact_name, logs.time, logs.kind, logs.show,
+                   logs.message, logs.subject, logs.additional_data,
+                   logs.log_line_id
+            FROM logs_fts
+            JOIN logs ON logs.log_line_id = logs_fts.rowid
+            JOIN jids ON jids.jid_id = logs.jid_id
+            WHERE logs_fts MATCH ? AND jids.jid IN ({jids}) {date_search}
+            ORDER BY {order}
+            '''.format(jids=', '.join('?' * len(jids)),
+                       date_search=between,
+                       order='logs_fts.rank' if ranked else
+                             'logs.time, logs.log_line_id')
 
-        sql = '''
+            terms = self.get_search_terms(query)
+            try:
+                with self._readers.connection() as con:
+                    results = con.execute(
+                        sql, (fts_query,) + tuple(jids) + date_args).fetchall()
+                    archived = self._search_logs_like(
+                        con, self._get_logs_tables(con)[1:], jids, terms,
+                        between, date_args)
+                    archived += self._search_cold_lines(
+                        con, jids, terms, date_args, ('message', 'subject'))
+            except sqlite.OperationalError as e:
+                log.warning('Full-text search failed, falling back to '
+                            'LIKE search: %s', e)
+            else:
+                if ranked:
+                    return results + archived
+                return sorted(archived + results, key=self._line_order)
+
+        with self._readers.connection() as con:
+            results = self._search_logs_like(
+                con, self._get_logs_tables(con), jids, [query], between,
+                date_args)
+            cold_lines = self._search_cold_lines(
+                con, jids, [query], date_args, ('message',))
+        if cold_lines:
+            results = sorted(results + cold_lines, key=self._line_order)
+        return results
+
+    @staticmethod
+    def _search_logs_like(con, tables, jids, terms, between, date_args):
+        """
+        Return the lines of the logs `tables` whose message contains all
+        `terms`
+        """
+        if not tables:
+            return []
+        select = '''
         SELECT contact_name, time, kind, show, message, subject,
                additional_data, log_line_id
-        FROM logs NATURAL JOIN jids WHERE jid IN ({jids})
-        AND message LIKE like(?) {date_search}
-        ORDER BY time, log_line_id
-        '''.format(jids=', '.join('?' * len(jids)),
-                   date_search=between if date else '')
-
-        return self.con.execute(sql, tuple(jids) + (query,)).fetchall()
+        FROM {logs} AS logs NATURAL JOIN jids WHERE jid IN ({jids})
+        AND {like} {date_search}
+        '''
+        sql = ' UNION ALL '.join(
+            select.format(logs=table, jids=', '.join('?' * len(jids)),
+                          like=' AND '.join(
+                              ['message LIKE like(?)'] * len(terms)),
+                          date_search=between)
+            for table in tables) + ' ORDER BY time, log_line_id'
+        args = tuple(jids) + tuple(terms) + date_args
+        return con.execute(sql, args * len(tables)).fetchall()
 
     def get_days_with_logs(self, account, jid, year, month):
         """
@@ -679,32 +1855,55 @@ class Logger:
 
         :param month:   The month
 
-        returns a list of namedtuples
+        returns a list of namedtuples with the day and the number of
+        messages of that day
         """
         jids = self._get_family_jids(account, jid)
 
-        kinds = map(str, [KindConstant.STATUS,
-                          KindConstant.GCSTATUS])
+        # logs_days.day is the local date as YYYYMMDD
+        first_day = year * 10000 + month * 100
+        sql = """
+            SELECT day % 100 AS day, SUM(messages) AS messages
+            FROM logs_days NATURAL JOIN jids WHERE jid IN ({jids})
+            AND day BETWEEN ? AND ?
+            GROUP BY day ORDER BY day
+            """.format(jids=', '.join('?' * len(jids)))
 
-        # Calculate the start and end datetime of the month
-        date = datetime.datetime(year, month, 1)
-        days = calendar.monthrange(year, month)[1] - 1
-        delta = datetime.timedelta(
-            days=days, hours=23, minutes=59, seconds=59, microseconds=999999)
+        with self._readers.connection() as con:
+            return con.execute(sql, tuple(jids) +
+                               (first_day + 1, first_day + 31)).fetchall()
+
+    def get_adjacent_day_with_logs(self, account, jid, date, forward=True):
+        """
+        Get the next or previous day where we received messages for a jid
+
+        :param account: The account
+
+        :param jid:     The jid
+
+        :param date:    A datetime.date, the day to start from
 
+        :param forward: True for the next day, False for the previous day
+
+        returns a datetime.date or None
+        """
+        jids = self._get_family_jids(account, jid)
+
+        day = date.year * 10000 + date.month * 100 + date.day
         sql = """
-            SELECT DISTINCT 
-            CAST(strftime('%d', time, 'unixepoch', 'localtime') AS INTEGER)
-            AS day FROM logs NATURAL JOIN jids WHERE jid IN ({jids})
-            AND time BETWEEN ? AND ?
-            AND kind NOT IN ({kinds})
-            ORDER BY time
+            SELECT day FROM logs_days NATURAL JOIN jids
+            WHERE jid IN ({jids}) AND day {op} ?
+            ORDER BY day {order} LIMIT 1
             """.format(jids=', '.join('?' * len(jids)),
-                       kinds=', '.join(kinds))
+                       op='>' if forward else '<',
+                       order='ASC' if forward else 'DESC')
 
-        return self.con.execute(sql, tuple(jids) +
-                                      (date.timestamp(),
-                                      (date + delta).timestamp())).fetchall()
+        with self._readers.connection() as con:
+            row = con.execute(sql, tuple(jids) + (day,)).fetchone()
+        if row is None:
+            return None
+        return datetime.date(row.day // 10000, row.day // 100 % 100,
+                             row.day % 100)
 
     def get_last_date_that_has_logs(self, account, jid):
         """
@@ -718,19 +1917,15 @@ class Logger:
         """
         jids = self._get_family_jids(account, jid)
 
-        kinds = map(str, [KindConstant.STATUS,
-                          KindConstant.GCSTATUS])
-
         sql = '''
-            SELECT MAX(time) as time FROM logs
+            SELECT MAX(last_time) as time FROM logs_days
             NATURAL JOIN jids WHERE jid IN ({jids})
-            AND kind NOT IN ({kinds})
-            '''.format(jids=', '.join('?' * len(jids)),
-                       kinds=', '.join(kinds))
+            '''.format(jids=', '.join('?' * len(jids)))
 
         # fetchone() returns always at least one Row with all
         # attributes set to None because of the MAX() function
-        return self.con.execute(sql, tuple(jids)).fetchone().time
+        with self._readers.connection() as con:
+            return con.execute(sql, tuple(jids)).fetchone().time
 
     def get_room_last_message_time(self, account, jid):
         """
@@ -814,59 +2009,60 @@ class Logger:
     # When retrieving, we need to convert it back to a string to decompress it.
     # (2)
     # GzipFile needs a file-like object, StringIO emulates file for plain strings
-    def iter_caps_data(self):
+    def get_caps_entry(self, hash_method, hash_):
         """
-        Iterate over caps cache data stored in the database
+        Load the caps cache entry for a hash method and hash
 
-        The iterator values are pairs of (node, ver, ext, identities, features):
-        identities == {'category':'foo', 'type':'bar', 'name':'boo'},
-        features being a list of feature namespaces.
+        returns a tuple (identities, features) or None if there is no valid
+        entry: identities being a list of dicts with the keys 'category',
+        'type', 'xml:lang' and 'name', features being a list of feature
+        namespaces.
         """
-        # get data from table
         # the data field contains binary object (gzipped data), this is a hack
         # to get that data without trying to convert it to unicode
+        sql = '''SELECT data FROM caps_cache
+                 WHERE hash_method = ? AND hash = ? LIMIT 1'''
         try:
-            self.cur.execute('SELECT hash_method, hash, data FROM caps_cache;')
+            row = self.con.execute(sql, (hash_method, hash_)).fetchone()
         except sqlite.OperationalError:
             # might happen when there's no caps_cache table yet
             # -- there's no data to read anyway then
-            return
+            return None
+        if row is None:
+            return None
 
-        # list of corrupted entries that will be removed
-        to_be_removed = []
-        for row in self.cur:
-            # for each row: unpack the data field
-            # (format: (category, type, name, category, type, name, ...
-            #   ..., 'FEAT', feature1, feature2, ...).join(' '))
-            # NOTE: if there's a need to do more gzip, put that to a function
-            try:
-                data = GzipFile(fileobj=BytesIO(row.data)).read().decode('utf-8').split('\0')
-            except IOError:
-                # This data is corrupted. It probably contains non-ascii chars
-                to_be_removed.append((row.hash_method, row.hash))
-                continue
-            i = 0
-            identities = list()
-            features = list()
-            while i < (len(data) - 3) and data[i] != 'FEAT':
-                category = data[i]
-                type_ = data[i + 1]
-                lang = data[i + 2]
-                name = data[i + 3]
-                identities.append({'category': category, 'type': type_,
-                        'xml:lang': lang, 'name': name})
-                i += 4
-            i+=1
-            while i < len(data):
-                features.append(data[i])
-                i += 1
-
-            # yield the row
-            yield row.hash_method, row.hash, identities, features
-        for hash_method, hash_ in to_be_removed:
-            sql = '''DELETE FROM caps_cache WHERE hash_method = "%s" AND
-                    hash = "%s"''' % (hash_method, hash_)
-            self.simple_commit(sql)
+        # unpack the data field
+        # (format: (category, type, name, category, type, name, ...
+        #   ..., 'FEAT', feature1, feature2, ...).join(' '))
+        # NOTE: if there's a need to do more gzip, put that to a function
+        try:
+            data = GzipFile(fileobj=BytesIO(row.data)).read().decode(
+                'utf-8').split('\0')
+        except IOError:
+            # This data is corrupted. It probably contains non-ascii chars
+            sql = '''DELETE FROM caps_cache
+                     WHERE hash_method = ? AND hash = ?'''
+            self.con.execute(sql, (hash_method, hash_))
+            self._timeout_commit()
+            return None
+
+        i = 0
+        identities = list()
+        features = list()
+        while i < (len(data) - 3) and data[i] != 'FEAT':
+            category = data[i]
+            type_ = data[i + 1]
+            lang = data[i + 2]
+            name = data[i + 3]
+            identities.append({'category': category, 'type': type_,
+                    'xml:lang': lang, 'name': name})
+            i += 4
+        i+=1
+        while i < len(data):
+            features.append(data[i])
+            i += 1
+
+        return identities, features
 
     def add_caps_entry(self, hash_method, hash_, identities, features):
         data = []
@@ -893,23 +2089,79 @@ class Logger:
         self._timeout_commit()
 
     def update_caps_time(self, method, hash_):
-        sql = '''UPDATE caps_cache SET last_seen = %d
-                WHERE hash_method = "%s" and hash = "%s"''' % \
-                (int(time.time()), method, hash_)
-        self.simple_commit(sql)
+        """
+        Remember that a caps hash was seen
+
+        The timestamps are written to the db together every
+        CAPS_TIME_INTERVAL seconds and when the db is closed.
+        """
+        self._caps_times[(method, hash_)] = int(time.time())
+        if self._caps_times_timeout_id is None:
+            self._caps_times_timeout_id = GLib.timeout_add_seconds(
+                CAPS_TIME_INTERVAL, self._on_caps_times_timeout)
+
+    def _on_caps_times_timeout(self):
+        self._caps_times_timeout_id = None
+        self._write_caps_times()
+        return False
+
+    def _write_caps_times(self):
+        if self._caps_times_timeout_id is not None:
+            GLib.source_remove(self._caps_times_timeout_id)
+            self._caps_times_timeout_id = None
+        if not self._caps_times:
+            return
+
+        rows = [(last_seen, method, hash_) for (method, hash_), last_seen
+                in self._caps_times.items()]
+        self._caps_times = {}
+        sql = '''UPDATE caps_cache SET last_seen = ?
+                 WHERE hash_method = ? AND hash = ?'''
+        try:
+            self.con.executemany(sql, rows)
+        except sqlite.OperationalError as e:
+            log.warning('Failed to update caps last_seen: %s', e)
+            return
+        log.debug('Updated last_seen of %s caps', len(rows))
+        self._timeout_commit()
 
     def clean_caps_table(self):
         """
         Remove caps which was not seen for 3 months
+
+        The rows are deleted in small batches from the main loop.
         """
-        sql = '''DELETE FROM caps_cache WHERE last_seen < %d''' % \
-                int(time.time() - 3*30*24*3600)
-        self.simple_commit(sql)
+        if self._clean_caps_timeout_id is None:
+            self._clean_caps_timeout_id = GLib.timeout_add(
+                100, self._clean_caps_step)
+
+    def _clean_caps_step(self):
+        sql = '''DELETE FROM caps_cache WHERE rowid IN
+                 (SELECT rowid FROM caps_cache WHERE last_seen < ? LIMIT ?)'''
+        try:
+            deleted = self.con.execute(
+                sql, (int(time.time()) - CAPS_MAX_AGE,
+                      CAPS_CLEAN_BATCH)).rowcount
+        except sqlite.OperationalError as e:
+            log.warning('Failed to clean caps table: %s', e)
+            deleted = 0
+        if deleted > 0:
+            self._timeout_commit()
+        elif self.con.in_transaction and not self.commit_timout_id:
+            # The DELETE began a transaction even if it removed nothing,
+            # it holds the write lock of the logs database until commit
+            self.commit()
+        if deleted < CAPS_CLEAN_BATCH:
+            self._clean_caps_timeout_id = None
+            return False
+        return True
 
     def replace_roster(self, account_name, roster_version, roster):
         """
         Replace current roster in DB by a new one
 
+        Only the differences to the stored roster are written.
+
         accout_name is the name of the account to change.
         roster_version is the version of the new roster.
         roster is the new version.
@@ -920,19 +2172,70 @@ class Logger:
         app.config.set_per('accounts', account_name, 'roster_version', '')
 
         account_jid = app.get_jid_from_account(account_name)
-        # Execute get_jid_id() because this ensures on new accounts that the
-        # jid_id will be created
-        self.get_jid_id(account_jid, type_=JIDConstant.NORMAL_TYPE)
-
-        # Delete old roster
-        self.remove_roster(account_jid)
-
-        # Fill roster tables with the new roster
-        for jid in roster:
-            self.add_or_update_contact(account_jid, jid, roster[jid]['name'],
-                roster[jid]['subscription'], roster[jid]['ask'],
-                roster[jid]['groups'], commit=False)
+        # get_jid_id() ensures on new accounts that the jid_id will be created
+        account_jid_id = self.get_jid_id(account_jid,
+                                         type_=JIDConstant.NORMAL_TYPE)
+        old_entries = self._get_roster_entries(account_jid_id)
+
+        new_entries = {}
+        for jid, item in roster.items():
+            if item['subscription'] == 'remove':
+                continue
+            jid_id = self.get_jid_id(jid, type_=JIDConstant.NORMAL_TYPE)
+            new_entries[jid_id] = {
+                'name': item['name'] or '',
+                'subscription':
+                    self.convert_human_subscription_values_to_db_api_values(
+                        item['subscription']),
+                'ask': bool(item['ask']),
+                'groups': set(item['groups'])}
+
+        # Only write what differs from the roster we have stored
+        removed = []
+        inserted = []
+        updated = []
+        added_groups = []
+        removed_groups = []
+        for jid_id in old_entries.keys() - new_entries.keys():
+            removed.append((account_jid_id, jid_id))
+        for jid_id, entry in new_entries.items():
+            values = (entry['name'], entry['subscription'], entry['ask'])
+            old_entry = old_entries.get(jid_id)
+            if old_entry is None:
+                inserted.append((account_jid_id, jid_id) + values)
+                old_groups = set()
+            else:
+                if values != (old_entry['name'], old_entry['subscription'],
+                              bool(old_entry['ask'])):
+                    updated.append(values + (account_jid_id, jid_id))
+                old_groups = old_entry['groups']
+            for group in entry['groups'] - old_groups:
+                added_groups.append((account_jid_id, jid_id, group))
+            for group in old_groups - entry['groups']:
+                removed_groups.append((account_jid_id, jid_id, group))
+
+        self.con.executemany(
+            'DELETE FROM roster_entry WHERE account_jid_id=? AND jid_id=?',
+            removed)
+        self.con.executemany(
+            'DELETE FROM roster_group WHERE account_jid_id=? AND jid_id=?',
+            removed)
+        self.con.executemany('''
+            INSERT INTO roster_entry
+            (account_jid_id, jid_id, name, subscription, ask)
+            VALUES(?, ?, ?, ?, ?)''', inserted)
+        self.con.executemany('''
+            UPDATE roster_entry SET name=?, subscription=?, ask=?
+            WHERE account_jid_id=? AND jid_id=?''', updated)
+        self.con.executemany('''
+            DELETE FROM roster_group
+            WHERE account_jid_id=? AND jid_id=? AND group_name=?''',
+            removed_groups)
+        self.con.executemany('INSERT INTO roster_group VALUES(?, ?, ?)',
+                             added_groups)
         self._timeout_commit()
+        log.info('Roster of %s: %d added, %d updated, %d removed',
+                 account_name, len(inserted), len(updated), len(removed))
 
         # At this point, we are sure the replacement works properly so we can
         # set the new roster_version value.
@@ -994,6 +2297,36 @@ class Logger:
         if commit:
             self._timeout_commit()
 
+    def _get_roster_entries(self, account_jid_id):
+        """
+        Return the stored roster of an account as dict by jid_id
+
+        Entries are dicts with the jid, name, subscription, ask, avatar_sha
+        and groups (a set) of the contact.
+        """
+        entries = {}
+        rows = self.con.execute('''
+            SELECT j.jid, re.jid_id, re.name, re.subscription, re.ask,
+                   re.avatar_sha, rg.group_name
+            FROM roster_entry re
+            JOIN jids j ON j.jid_id = re.jid_id
+            LEFT JOIN roster_group rg ON rg.account_jid_id = re.account_jid_id
+                                     AND rg.jid_id = re.jid_id
+            WHERE re.account_jid_id=?''', (account_jid_id,))
+        for row in rows:
+            entry = entries.get(row.jid_id)
+            if entry is None:
+                entry = entries[row.jid_id] = {
+                    'jid': row.jid,
+                    'name': row.name,
+                    'subscription': row.subscription,
+                    'ask': row.ask,
+                    'avatar_sha': row.avatar_sha,
+                    'groups': set()}
+            if row.group_name is not None:
+                entry['groups'].add(row.group_name)
+        return entries
+
     def get_roster(self, account_jid):
         """
         Return the accound_jid roster in NonBlockingRoster format
@@ -1001,42 +2334,16 @@ class Logger:
         data = {}
         account_jid_id = self.get_jid_id(account_jid, type_=JIDConstant.NORMAL_TYPE)
 
-        # First we fill data with roster_entry informations
-        self.cur.execute('''
-                SELECT j.jid, re.jid_id, re.name, re.subscription, re.ask, re.avatar_sha
-                FROM roster_entry re, jids j
-                WHERE re.account_jid_id=? AND j.jid_id=re.jid_id''', (account_jid_id,))
-        for row in self.cur:
-            #jid, jid_id, name, subscription, ask
-            jid = row.jid
-            name = row.name
-            data[jid] = {}
-            data[jid]['avatar_sha'] = row.avatar_sha
-            if name:
-                data[jid]['name'] = name
-            else:
-                data[jid]['name'] = None
-            data[jid]['subscription'] = \
+        for entry in self._get_roster_entries(account_jid_id).values():
+            data[entry['jid']] = {
+                'avatar_sha': entry['avatar_sha'],
+                'name': entry['name'] or None,
+                'subscription':
                     self.convert_db_api_values_to_human_subscription_values(
-                    row.subscription)
-            data[jid]['groups'] = []
-            data[jid]['resources'] = {}
-            if row.ask:
-                data[jid]['ask'] = 'subscribe'
-            else:
-                data[jid]['ask'] = None
-            data[jid]['id'] = row.jid_id
-
-        # Then we add group for roster entries
-        for jid in data:
-            self.cur.execute('''
-                    SELECT group_name FROM roster_group
-                    WHERE account_jid_id=? AND jid_id=?''',
-                    (account_jid_id, data[jid]['id']))
-            for row in self.cur:
-                group_name = row.group_name
-                data[jid]['groups'].append(group_name)
-            del data[jid]['id']
+                        entry['subscription']),
+                'groups': sorted(entry['groups']),
+                'resources': {},
+                'ask': 'subscribe' if entry['ask'] else None}
 
         return data
 
@@ -1091,7 +2398,8 @@ class Logger:
     def find_stanza_id(self, archive_jid, stanza_id, origin_id=None,
                        groupchat=False):
         """
-        Checks if a stanza-id is already in the `logs` table
+        Checks if a stanza-id is already in the `logs` table, or was in it
+        before the line was archived or compressed
 
         :param archive_jid: The jid of the archive the stanza-id belongs to
 
@@ -1118,15 +2426,28 @@ class Logger:
         else:
             column = 'account_id'
 
+        archive = (column, archive_id)
+        if self._recent_ids.contains(archive, ids):
+            log.info('Found duplicated message, stanza-id: %s, origin-id: %s',
+                     stanza_id, origin_id)
+            return True
+
+        # Archived and compressed lines left their stanza-id behind
         sql = '''
               SELECT stanza_id FROM logs
-              WHERE stanza_id IN ({values}) AND {archive} = ? LIMIT 1
+              WHERE stanza_id IN ({values}) AND {archive} = ?
+              UNION ALL
+              SELECT stanza_id FROM moved_stanza_ids
+              WHERE stanza_id IN ({values}) AND {archive} = ?
+              LIMIT 1
               '''.format(values=', '.join('?' * len(ids)),
                          archive=column)
 
-        result = self.con.execute(sql, tuple(ids) + (archive_id,)).fetchone()
+        result = self.con.execute(
+            sql, (tuple(ids) + (archive_id,)) * 2).fetchone()
 
         if result is not None:
+            self._recent_ids.add(archive, result.stanza_id)
             log.info('Found duplicated message, stanza-id: %s, origin-id: %s',
                      stanza_id, origin_id)
             return True
@@ -1146,21 +2467,29 @@ class Logger:
         return self.get_jid_id(jid, kind, type_)
 
     def insert_into_logs(self, account, jid, time_, kind,
-                         unread=True, **kwargs):
+                         unread=True, callback=None, **kwargs):
         """
         Insert a new message into the `logs` table
 
-        :param jid:     The jid as string
+        The row is written asynchronously by the LogWriter, its log_line_id
+        is assigned here and returned right away.
+
+        :param jid:         The jid as string
 
-        :param time_:   The timestamp in UTC epoch
+        :param time_:       The timestamp in UTC epoch
 
-        :param kind:    A KindConstant
+        :param kind:        A KindConstant
 
-        :param unread:  If True the message is added to the`unread_messages`
-                        table. Only if kind == CHAT_MSG_RECV
+        :param unread:      If True the message is added to the`unread_messages`
+                            table. Only if kind == CHAT_MSG_RECV
 
-        :param kwargs:  Every additional named argument must correspond to
-                        a field in the `logs` table
+        :param callback:    Called with the log_line_id once the row is
+                            committed, or with None if writing it failed
+
+        :param kwargs:      Every additional named argument must correspond
+                            to a field in the `logs` table
+
+        returns the log_line_id of the new row
         """
         jid_id = self.get_jid_id(jid, kind=kind)
         account_id = self.get_account_id(account)
@@ -1171,26 +2500,36 @@ class Logger:
             else:
                 kwargs['additional_data'] = json.dumps(kwargs["additional_data"])
 
+        log_line_id = self._next_log_line_id
+        self._next_log_line_id += 1
+
         sql = '''
-              INSERT INTO logs (account_id, jid_id, time, kind, {columns})
-              VALUES (?, ?, ?, ?, {values})
+              INSERT INTO logs (log_line_id, account_id, jid_id, time, kind,
+                                {columns})
+              VALUES (?, ?, ?, ?, ?, {values})
               '''.format(columns=', '.join(kwargs.keys()),
                          values=', '.join('?' * len(kwargs)))
 
-        lastrowid = self.con.execute(
-            sql, (account_id, jid_id, time_, kind) + tuple(kwargs.values())).lastrowid
+        self._writer.execute(
+            sql,
+            (log_line_id, account_id, jid_id, time_, kind) +
+            tuple(kwargs.values()),
+            callback)
 
         log.info('Insert into DB: jid: %s, time: %s, kind: %s, stanza_id: %s',
                  jid, time_, kind, kwargs.get('stanza_id', None))
 
-        if unread and kind == KindConstant.CHAT_MSG_RECV:
-            sql = '''INSERT INTO unread_messages (message_id, jid_id)
-                     VALUES (?, (SELECT jid_id FROM jids WHERE jid = ?))'''
-            self.con.execute(sql, (lastrowid, jid))
+        stanza_id = kwargs.get('stanza_id', None)
+        if stanza_id is not None:
+            # find_stanza_id() looks up groupchat ids by jid_id and all
+            # others by account_id, remember the id for both
+            self._recent_ids.add(('jid_id', jid_id), stanza_id)
+            self._recent_ids.add(('account_id', account_id), stanza_id)
 
-        self._timeout_commit()
+        if unread and kind == KindConstant.CHAT_MSG_RECV:
+            self.insert_unread_events(log_line_id, jid_id)
 
-        return lastrowid
+        return log_line_id
 
     def set_avatar_sha(self, account_jid, jid, sha=None):
         """
@@ -25,6 +25,8 @@ Network Events Controller.
 :license: GPL
 '''
 
+import time
+
 #from plugins.helpers import log
 from gajim.common import app
 
@@ -70,13 +72,26 @@ class NetworkEventsController(object):
                 self.outgoing_events_generators[base_event_name].remove(
                     event_class)
 
+    @staticmethod
+    def _generate(event_object):
+        profiler = app.ged.profiler
+        if profiler is None:
+            return event_object.generate()
+        start = time.perf_counter()
+        try:
+            return event_object.generate()
+        finally:
+            profiler.record('generate', event_object.name,
+                            type(event_object).__name__,
+                            time.perf_counter() - start)
+
     def push_incoming_event(self, event_object):
-        if event_object.generate():
+        if self._generate(event_object):
             if not app.ged.raise_event(event_object.name, event_object):
                 self._generate_events_based_on_incoming_event(event_object)
 
     def push_outgoing_event(self, event_object):
-        if event_object.generate():
+        if self._generate(event_object):
             if not app.ged.raise_event(event_object.name, event_object):
                 self._generate_events_based_on_outgoing_event(event_object)
 
@@ -95,7 +110,7 @@ class NetworkEventsController(object):
             base_event_name]:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
-                if new_event_object.generate():
+                if self._generate(new_event_object):
                     if not app.ged.raise_event(new_event_object.name,
                     new_event_object):
                         self._generate_events_based_on_incoming_event(
@@ -116,7 +131,7 @@ class NetworkEventsController(object):
             base_event_name]:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
-                if new_event_object.generate():
+                if self._generate(new_event_object):
                     if not app.ged.raise_event(new_event_object.name,
                     new_event_object):
                         self._generate_events_based_on_outgoing_event(
@@ -29,7 +29,11 @@
 import os
 import sys
 import re
+import json
+import queue
+import threading
 from time import time
+from collections import OrderedDict
 from gajim.common import app
 from gajim.common import helpers
 from gajim.common import caps_cache
@@ -40,13 +44,65 @@ from gajim.common import logger
 import logging
 log = logging.getLogger('gajim.c.optparser')
 
+# Number of journal entries after which the config file is rewritten
+JOURNAL_COMPACT_ENTRIES = 1000
+
+CONFIG_LINE = re.compile(r"(?P<optname>[^.=]+)(?:(?:\.(?P<key>.+))?\.(?P<subname>[^.=]+))?\s=\s(?P<value>.*)")
+
+class ConfigWriter(threading.Thread):
+    """
+    Run the writes of the config file and its journal one after the other,
+    off the main thread
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='config-writer', daemon=True)
+        self._queue = queue.Queue()
+
+    def run(self):
+        while True:
+            func, args, callback = self._queue.get()
+            try:
+                result = func(*args)
+            except Exception as e:
+                log.exception('Config write %s failed', func.__name__)
+                result = str(e)
+            if callback:
+                callback(result)
+
+    def put(self, func, args, callback=None):
+        """
+        Run func(*args) after the previous writes and give the result to
+        callback, in the writer thread
+        """
+        self._queue.put((func, args, callback))
+
+    def run_sync(self, func, args):
+        """
+        Run func(*args) after the previous writes and return its result
+        """
+        done = threading.Event()
+        results = []
+        def _on_done(result):
+            results.append(result)
+            done.set()
+        self.put(func, args, _on_done)
+        done.wait()
+        return results[0]
+
 class OptionsParser:
     def __init__(self, filename):
         self.__filename = os.path.realpath(filename)
+        # changes saved since the config file was written
+        self.__journal = self.__filename + '-journal'
+        self.__journal_entries = 0
+        self.__writer = None
         self.old_values = {}    # values that are saved in the file and maybe
                                                         # no longer valid
 
     def read(self):
+        # the default values are not changes to save
+        app.config.pop_changes()
         try:
             fd = open(self.__filename)
         except Exception:
@@ -54,15 +110,16 @@ class OptionsParser:
                 #we talk about a file
                 print(_('Error: cannot open %s for reading') % self.__filename,
                     file=sys.stderr)
-            return False
+            was_read = self.read_journal()
+            app.config.pop_changes()
+            return was_read
 
         new_version = app.config.get('version')
         new_version = new_version.split('+', 1)[0]
         seen = set()
-        regex = re.compile(r"(?P<optname>[^.=]+)(?:(?:\.(?P<key>.+))?\.(?P<subname>[^.=]+))?\s=\s(?P<value>.*)")
 
         for line in fd:
-            match = regex.match(line)
+            match = CONFIG_LINE.match(line)
             if match is None:
                 log.warn('Invalid configuration line, ignoring it: %s', line)
                 continue
@@ -81,6 +138,10 @@ class OptionsParser:
                 self.old_values[optname][key][subname] = value
                 app.config.set_per(optname, key, subname, value)
 
+        self.read_journal()
+        # Everything read is already saved
+        app.config.pop_changes()
+
         old_version = app.config.get('version')
         if '+' in old_version:
             old_version = old_version.split('+', 1)[0]
@@ -93,7 +154,7 @@ class OptionsParser:
         fd.close()
         return True
 
-    def write_line(self, fd, opt, parents, value):
+    def write_line(self, lines, opt, parents, value):
         if value is None:
             return
         # convert to utf8 before writing to file if needed
@@ -105,9 +166,195 @@ class OptionsParser:
             for p in parents:
                 s += p + '.'
         s += opt
-        fd.write(s + ' = ' + value + '\n')
+        lines.append(s + ' = ' + value + '\n')
+
+    def read_journal(self):
+        """
+        Apply the changes saved in the journal since the config file was
+        written
+
+        Return True if there was a journal.
+        """
+        try:
+            fd = open(self.__journal)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            log.error('Cannot read %s: %s', self.__journal, e)
+            return False
+        with fd:
+            for line in fd:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # Gajim stopped while writing that line
+                    log.warning('Invalid journal line, ignoring the rest: %s',
+                        line)
+                    break
+                self.apply_change(change)
+                self.__journal_entries += 1
+        return True
+
+    @staticmethod
+    def apply_change(change):
+        """
+        Apply a change returned by Config.pop_changes()
+        """
+        action, optname = change[:2]
+        if action == 'set':
+            app.config.set(optname, change[2])
+        elif action == 'per':
+            key, values = change[2:]
+            if app.config.get_per(optname, key) is not None:
+                app.config.del_per(optname, key)
+            app.config.add_per(optname, key)
+            for subname, value in values.items():
+                app.config.set_per(optname, key, subname, value)
+        elif action == 'set_per':
+            app.config.set_per(optname, *change[2:])
+        elif action == 'del_per':
+            key, subname = change[2:]
+            if app.config.get_per(optname, key) is not None:
+                app.config.del_per(optname, key, subname)
+
+    def _get_writer(self):
+        if self.__writer is None:
+            self.__writer = ConfigWriter()
+            self.__writer.start()
+        return self.__writer
+
+    def _get_lines(self):
+        lines = []
+        app.config.foreach(self.write_line, lines)
+        return lines
+
+    def write_changes(self):
+        """
+        Save the options changed since the last save in the background
+
+        They are appended to the journal, the config file is rewritten once
+        the journal is long enough.
+        """
+        changes = app.config.pop_changes()
+        if not changes:
+            return
+        data = ''.join(json.dumps(change) + '\n' for change in changes)
+        self._get_writer().put(self._append_journal, (data,),
+            self._on_written)
+        self.__journal_entries += len(changes)
+        if self.__journal_entries > JOURNAL_COMPACT_ENTRIES:
+            self.__journal_entries = 0
+            self._get_writer().put(self._compact, (), self._on_written)
+
+    @staticmethod
+    def _on_written(err_str):
+        if err_str is not None:
+            log.error('Could not save the configuration: %s', err_str)
+
+    def _append_journal(self, data):
+        try:
+            fd = os.open(self.__journal, os.O_CREAT|os.O_WRONLY|os.O_APPEND,
+                0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError) as e:
+            return str(e)
+
+    def _compact(self):
+        """
+        Rewrite the config file with the changes of the journal applied
+
+        Only the files are read, so app.config is not walked. The journal
+        is removed once the new file is written, and kept if that fails.
+        """
+        options = OrderedDict() # {optname: line}
+        groups = OrderedDict() # {(optname, key): {subname: line}}
+        try:
+            fd = open(self.__filename)
+        except FileNotFoundError:
+            # Nothing to apply the journal to until write() was called
+            return
+        except (IOError, OSError) as e:
+            return str(e)
+        with fd:
+            for line in fd:
+                match = CONFIG_LINE.match(line)
+                if match is None:
+                    continue
+                optname, key, subname, _value = match.groups()
+                if key is None:
+                    options[optname] = line
+                else:
+                    groups.setdefault((optname, key), OrderedDict())[
+                        subname] = line
+        try:
+            fd = open(self.__journal)
+        except FileNotFoundError:
+            return
+        except (IOError, OSError) as e:
+            return str(e)
+        with fd:
+            for line in fd:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # read_journal() ignores the rest as well
+                    break
+                self._apply_change_to_lines(options, groups, change)
+        lines = list(options.values())
+        for group in groups.values():
+            lines.extend(group.values())
+        return self._write_file(lines)
+
+    def _apply_change_to_lines(self, options, groups, change):
+        """
+        Apply a change returned by Config.pop_changes() to the lines of the
+        config file, as they are split by _compact()
+        """
+        action, optname = change[:2]
+        if action == 'set':
+            lines = []
+            self.write_line(lines, optname, None, change[2])
+            if lines:
+                options[optname] = lines[0]
+            else:
+                options.pop(optname, None)
+        elif action == 'per':
+            key, values = change[2:]
+            group = groups[(optname, key)] = OrderedDict()
+            for subname, value in values.items():
+                lines = []
+                self.write_line(lines, subname, [optname, key], value)
+                if lines:
+                    group[subname] = lines[0]
+        elif action == 'set_per':
+            key, subname, value = change[2:]
+            group = groups.setdefault((optname, key), OrderedDict())
+            lines = []
+            self.write_line(lines, subname, [optname, key], value)
+            if lines:
+                group[subname] = lines[0]
+            else:
+                group.pop(subname, None)
+        elif action == 'del_per':
+            key, subname = change[2:]
+            if subname is None:
+                groups.pop((optname, key), None)
+            elif (optname, key) in groups:
+                groups[(optname, key)].pop(subname, None)
 
     def write(self):
+        """
+        Rewrite the whole config file, once the pending saves are done
+        """
+        app.config.pop_changes()
+        self.__journal_entries = 0
+        return self._get_writer().run_sync(self._write_file,
+            (self._get_lines(),))
+
+    def _write_file(self, lines):
         (base_dir, filename) = os.path.split(self.__filename)
         self.__tempfile = os.path.join(base_dir, '.' + filename)
         try:
@@ -116,12 +363,12 @@ class OptionsParser:
         except IOError as e:
             return str(e)
         try:
-            app.config.foreach(self.write_line, f)
-        except IOError as e:
+            with f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError) as e:
             return str(e)
-        f.flush()
-        os.fsync(f.fileno())
-        f.close()
         if os.path.exists(self.__filename):
             if os.name == 'nt':
                 # win32 needs this
@@ -133,6 +380,12 @@ class OptionsParser:
             os.rename(self.__tempfile, self.__filename)
         except IOError as e:
             return str(e)
+        try:
+            os.remove(self.__journal)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return str(e)
 
     def update_config(self, old_version, new_version):
         old_version_list = old_version.split('.') # convert '0.x.y' to (0, x, y)
@@ -247,6 +500,22 @@ class OptionsParser:
             self.update_config_to_016111()
         if old < [0, 16, 11, 2] and new >= [0, 16, 11, 2]:
             self.update_config_to_016112()
+        if old < [0, 16, 11, 3] and new >= [0, 16, 11, 3]:
+            self.update_config_to_016113()
+        if old < [0, 16, 11, 4] and new >= [0, 16, 11, 4]:
+            self.update_config_to_016114()
+        if old < [0, 16, 11, 5] and new >= [0, 16, 11, 5]:
+            self.update_config_to_016115()
+        if old < [0, 16, 11, 6] and new >= [0, 16, 11, 6]:
+            self.update_config_to_016116()
+        if old < [0, 16, 11, 7] and new >= [0, 16, 11, 7]:
+            self.update_config_to_016117()
+        if old < [0, 16, 11, 8] and new >= [0, 16, 11, 8]:
+            self.update_config_to_016118()
+        if old < [0, 16, 11, 9] and new >= [0, 16, 11, 9]:
+            self.update_config_to_016119()
+        if old < [0, 16, 11, 10] and new >= [0, 16, 11, 10]:
+            self.update_config_to_0161110()
 
         app.logger.init_vars()
         app.logger.attach_cache_database()
@@ -913,3 +1182,222 @@ class OptionsParser:
             '''
         )
         app.config.set('version', '0.16.11.2')
+
+    def update_config_to_016113(self):
+        self.call_sql(logger.LOG_DB_PATH,
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+                message, subject, content='logs', content_rowid='log_line_id'
+                );
+            CREATE TRIGGER IF NOT EXISTS logs_fts_insert AFTER INSERT ON logs
+            BEGIN
+                INSERT INTO logs_fts (rowid, message, subject)
+                VALUES (new.log_line_id, new.message, new.subject);
+            END;
+            CREATE TRIGGER IF NOT EXISTS logs_fts_delete AFTER DELETE ON logs
+            BEGIN
+                INSERT INTO logs_fts (logs_fts, rowid, message, subject)
+                VALUES ('delete', old.log_line_id, old.message, old.subject);
+            END;
+            CREATE TRIGGER IF NOT EXISTS logs_fts_update
+            AFTER UPDATE OF message, subject ON logs
+            BEGIN
+                INSERT INTO logs_fts (logs_fts, rowid, message, subject)
+                VALUES ('delete', old.log_line_id, old.message, old.subject);
+                INSERT INTO logs_fts (rowid, message, subject)
+                VALUES (new.log_line_id, new.message, new.subject);
+            END;
+            INSERT INTO logs_fts (logs_fts) VALUES ('rebuild');
+            '''
+        )
+        app.config.set('version', '0.16.11.3')
+
+    def update_config_to_016114(self):
+        self.call_sql(logger.LOG_DB_PATH,
+            '''
+            CREATE INDEX IF NOT EXISTS
+            idx_logs_stanza_id ON logs (stanza_id, jid_id, account_id);
+            '''
+        )
+        app.config.set('version', '0.16.11.4')
+
+    def update_config_to_016115(self):
+        self.call_sql(logger.CACHE_DB_PATH,
+            '''
+            CREATE INDEX IF NOT EXISTS
+            idx_caps_cache_hash ON caps_cache (hash_method, hash);
+            '''
+        )
+        app.config.set('version', '0.16.11.5')
+
+    def update_config_to_016116(self):
+        self.call_sql(logger.LOG_DB_PATH,
+            '''
+            CREATE TABLE IF NOT EXISTS logs_days(
+                jid_id INTEGER,
+                day INTEGER,
+                messages INTEGER,
+                first_log_line_id INTEGER,
+                last_log_line_id INTEGER,
+                last_time INTEGER,
+                PRIMARY KEY (jid_id, day)
+                );
+            CREATE TRIGGER IF NOT EXISTS logs_days_insert AFTER INSERT ON logs
+            WHEN new.kind NOT IN (0, 1)
+            BEGIN
+                INSERT OR IGNORE INTO logs_days VALUES (new.jid_id,
+                    CAST(strftime('%Y%m%d', new.time, 'unixepoch',
+                                  'localtime') AS INTEGER),
+                    0, new.log_line_id, new.log_line_id, new.time);
+                UPDATE logs_days SET messages = messages + 1,
+                    first_log_line_id = MIN(first_log_line_id,
+                                            new.log_line_id),
+                    last_log_line_id = MAX(last_log_line_id, new.log_line_id),
+                    last_time = MAX(last_time, new.time)
+                WHERE jid_id = new.jid_id AND day =
+                    CAST(strftime('%Y%m%d', new.time, 'unixepoch',
+                                  'localtime') AS INTEGER);
+            END;
+            CREATE TRIGGER IF NOT EXISTS logs_days_delete AFTER DELETE ON logs
+            WHEN old.kind NOT IN (0, 1)
+            BEGIN
+                UPDATE logs_days SET messages = messages - 1
+                WHERE jid_id = old.jid_id AND day =
+                    CAST(strftime('%Y%m%d', old.time, 'unixepoch',
+                                  'localtime') AS INTEGER);
+                DELETE FROM logs_days
+                WHERE jid_id = old.jid_id AND messages <= 0;
+            END;
+            DELETE FROM logs_days;
+            INSERT INTO logs_days
+                SELECT jid_id,
+                    CAST(strftime('%Y%m%d', time, 'unixepoch', 'localtime')
+                         AS INTEGER) AS day,
+                    COUNT(*), MIN(log_line_id), MAX(log_line_id), MAX(time)
+                FROM logs WHERE kind NOT IN (0, 1)
+                GROUP BY jid_id, day;
+            '''
+        )
+        app.config.set('version', '0.16.11.6')
+
+    def update_config_to_016117(self):
+        # Existing databases keep their auto_vacuum mode, changing it needs
+        # a full VACUUM that would block the start. The history manager
+        # switches to INCREMENTAL when it cleans up the database.
+        app.config.set('version', '0.16.11.7')
+
+    def update_config_to_016118(self):
+        self.call_sql(logger.LOG_DB_PATH,
+            '''
+            CREATE TABLE IF NOT EXISTS logs_blocks(
+                block_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                jid_id INTEGER,
+                account_id INTEGER,
+                start_time INTEGER,
+                end_time INTEGER,
+                lines INTEGER,
+                size INTEGER,
+                data BLOB
+                );
+            CREATE INDEX IF NOT EXISTS
+            idx_logs_blocks_jid_id_time ON logs_blocks (jid_id, end_time);
+            '''
+        )
+        app.config.set('version', '0.16.11.8')
+
+    def update_config_to_016119(self):
+        # When the first or last line of a day is deleted, the remaining
+        # lines of that day are looked up
+        self.call_sql(logger.LOG_DB_PATH,
+            '''
+            DROP TRIGGER IF EXISTS logs_days_delete;
+            CREATE TRIGGER logs_days_delete AFTER DELETE ON logs
+            WHEN old.kind NOT IN (0, 1)
+            BEGIN
+                UPDATE logs_days SET messages = messages - 1
+                WHERE jid_id = old.jid_id AND day =
+                    CAST(strftime('%Y%m%d', old.time, 'unixepoch',
+                                  'localtime') AS INTEGER);
+                DELETE FROM logs_days
+                WHERE jid_id = old.jid_id AND messages <= 0;
+                UPDATE logs_days SET
+                    first_log_line_id = COALESCE(
+                        (SELECT MIN(log_line_id) FROM logs
+                        WHERE jid_id = old.jid_id AND kind NOT IN (0, 1)
+                        AND time >= CAST(strftime('%s', old.time, 'unixepoch',
+                            'localtime', 'start of day', 'utc') AS INTEGER)
+                        AND time < CAST(strftime('%s', old.time, 'unixepoch',
+                            'localtime', 'start of day', '+1 day', 'utc')
+                            AS INTEGER)),
+                        first_log_line_id),
+                    last_log_line_id = COALESCE(
+                        (SELECT MAX(log_line_id) FROM logs
+                        WHERE jid_id = old.jid_id AND kind NOT IN (0, 1)
+                        AND time >= CAST(strftime('%s', old.time, 'unixepoch',
+                            'localtime', 'start of day', 'utc') AS INTEGER)
+                        AND time < CAST(strftime('%s', old.time, 'unixepoch',
+                            'localtime', 'start of day', '+1 day', 'utc')
+                            AS INTEGER)),
+                        last_log_line_id),
+                    last_time = COALESCE(
+                        (SELECT MAX(time) FROM logs
+                        WHERE jid_id = old.jid_id AND kind NOT IN (0, 1)
+                        AND time >= CAST(strftime('%s', old.time, 'unixepoch',
+                            'localtime', 'start of day', 'utc') AS INTEGER)
+                        AND time < CAST(strftime('%s', old.time, 'unixepoch',
+                            'localtime', 'start of day', '+1 day', 'utc')
+                            AS INTEGER)),
+                        last_time)
+                WHERE jid_id = old.jid_id AND day =
+                    CAST(strftime('%Y%m%d', old.time, 'unixepoch',
+                                  'localtime') AS INTEGER)
+                AND (old.log_line_id IN (first_log_line_id, last_log_line_id)
+                     OR old.time >= last_time);
+            END;
+            '''
+        )
+        app.config.set('version', '0.16.11.9')
+
+    def update_config_to_0161110(self):
+        self.call_sql(logger.LOG_DB_PATH,
+            '''
+            CREATE TABLE IF NOT EXISTS moved_stanza_ids(
+                stanza_id TEXT,
+                jid_id INTEGER,
+                account_id INTEGER,
+                time INTEGER
+                );
+            CREATE INDEX IF NOT EXISTS idx_moved_stanza_ids_stanza_id
+            ON moved_stanza_ids (stanza_id, jid_id, account_id);
+            CREATE INDEX IF NOT EXISTS idx_moved_stanza_ids_jid_id_time
+            ON moved_stanza_ids (jid_id, time);
+            '''
+        )
+        # Collect the stanza-ids of the lines that were already archived
+        # or compressed
+        con = sqlite.connect(logger.LOG_DB_PATH)
+        sql = '''INSERT INTO moved_stanza_ids (stanza_id, jid_id,
+                 account_id, time) VALUES (?, ?, ?, ?)'''
+        fields = ('stanza_id', 'jid_id', 'account_id', 'time')
+        try:
+            con.execute('DELETE FROM moved_stanza_ids')
+            con.commit()
+            for year in logger.get_archive_years(logger.LOG_DB_FOLDER):
+                con.execute('ATTACH DATABASE ? AS archive', (os.path.join(
+                    logger.LOG_DB_FOLDER, 'logs-archive-%d.db' % year),))
+                con.execute(
+                    '''INSERT INTO moved_stanza_ids
+                    SELECT stanza_id, jid_id, account_id, time
+                    FROM archive.logs WHERE stanza_id IS NOT NULL''')
+                con.commit()
+                con.execute('DETACH DATABASE archive')
+            for data, in con.execute('SELECT data FROM logs_blocks'):
+                columns, rows = logger.decompress_block(data)
+                indexes = [columns.index(field) for field in fields]
+                con.executemany(sql, [[row[i] for i in indexes]
+                    for row in rows if row[indexes[0]] is not None])
+            con.commit()
+        except sqlite.Error:
+            log.exception('Error')
+        con.close()
+        app.config.set('version', '0.16.11.10')
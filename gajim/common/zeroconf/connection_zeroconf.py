@@ -54,6 +54,8 @@ log = logging.getLogger('gajim.c.connection_zeroconf')
 
 class ConnectionZeroconf(CommonConnection, ConnectionHandlersZeroconf):
     def __init__(self, name):
+        # needed before the handlers are registered for this account
+        self.name = name
         ConnectionHandlersZeroconf.__init__(self)
         # system username
         self.username = None
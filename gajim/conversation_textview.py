@@ -188,6 +188,9 @@ class ConversationTextview(GObject.GObject):
         self.line = 0
         self.message_list = []
         self.corrected_text_list = {}
+        # if False, printing a line does not scroll to the end, used when
+        # printing many lines at once
+        self.autoscroll = True
         self.fc = FuzzyClock()
 
         # no need to inherit TextView, use it as atrribute is safer
@@ -1215,7 +1218,7 @@ class ConversationTextview(GObject.GObject):
         new_mark = buffer_.create_mark(
             str(self.line), temp_iter, left_gravity=False)
 
-        if not index:
+        if index is None:
             # New Message
             self.message_list.append((tim, new_mark, msg_stanza_id))
         elif corrected:
@@ -1230,7 +1233,7 @@ class ConversationTextview(GObject.GObject):
         elif kind == 'outgoing':
             self.last_sent_message_id = (msg_stanza_id, new_mark)
 
-        if not insert_mark:
+        if not insert_mark and self.autoscroll:
             if self.at_the_end() or kind == 'outgoing':
                 # we are at the end or we are sending something
                 GLib.idle_add(self.scroll_to_end_iter)
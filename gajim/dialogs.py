@@ -3349,6 +3349,11 @@ class XMLConsoleWindow(Gtk.Window):
         button.connect('clicked', self.on_filter_options)
         self.actionbar.pack_start(button)
 
+        button = gtkgui_helpers.get_image_button(
+            'utilities-system-monitor-symbolic', 'Event Statistics')
+        button.connect('clicked', self.on_event_stats)
+        self.actionbar.pack_start(button)
+
         button = gtkgui_helpers.get_image_button(
             'document-edit-symbolic', 'XML Input', toggle=True)
         button.connect('toggled', self.on_input)
@@ -3473,6 +3478,18 @@ class XMLConsoleWindow(Gtk.Window):
     def on_clear(self, *args):
         buffer_ = self.textview.get_buffer().set_text('')
 
+    def on_event_stats(self, *args):
+        if app.ged.profiler is None:
+            report = 'Event profiling is not running, enable the ' \
+                '"event_profiling" option or use gajim-remote event_profiling'
+        else:
+            report = app.ged.profiler.get_report()
+        buffer_ = self.textview.get_buffer()
+        text = '<!-- Event statistics {time} -->\n{report}\n\n'.format(
+            time=time.strftime('%c'), report=report)
+        buffer_.insert(buffer_.get_end_iter(), text)
+        GLib.idle_add(gtkgui_helpers.scroll_to_end, self.scrolled)
+
     def on_destroy(self, *args):
         del app.interface.instances[self.account]['xml_console']
         app.ged.remove_event_handler('stanza-received', ged.GUI1,
@@ -17,6 +17,7 @@
 
 import os
 import sys
+import time
 import logging
 import importlib.util as imp
 from collections import OrderedDict
@@ -28,38 +29,59 @@ MODIFIER_MAX_CHILDREN_PER_LINE = 6
 MAX_CHILDREN_PER_LINE = 10
 MIN_HEIGHT = 200
 
-pixbufs = dict()
-codepoints = dict()
+pixbufs = dict() # {pixbuf: codepoint} of the pixbufs cut from the atlas
+codepoints = dict() # {codepoint: index in the atlas}
+sub_pixbuf = None
 popover_instance = None
+popover_args = None
 
 log = logging.getLogger('gajim.emoticons')
 
 class SubPixbuf:
+    """
+    The emoticons of an image theme, cut from the atlas on first use
+    """
 
     height = 24
     width = 24
     columns = 20
 
     def __init__(self, path):
-        self.cur_column = 0
-        self.src_x = 0
-        self.src_y = 0
         self.atlas = GdkPixbuf.Pixbuf.new_from_file(path)
-
-    def get_pixbuf(self):
-        self.src_x = self.cur_column * self.width
-
-        subpixbuf = self.atlas.new_subpixbuf(self.src_x, self.src_y, self.width, self.height)
-
-        if self.cur_column == self.columns - 1:
-            self.src_y += self.width
-            self.cur_column = 0
-        else:
-            self.cur_column += 1
-
-        return subpixbuf
+        self.count = 0
+        self._pixbufs = {} # {index: pixbuf}
+        self._codepoints = {} # {index: codepoint}
+
+    def add(self, codepoint_=None):
+        """
+        Return the index of the next emoticon of the atlas
+
+        :param codepoint_: the text to use for that emoticon when it is
+        sent, None for category images
+        """
+        index = self.count
+        self.count += 1
+        if codepoint_ is not None:
+            self._codepoints[index] = codepoint_
+        return index
+
+    def get_pixbuf(self, index):
+        pixbuf = self._pixbufs.get(index)
+        if pixbuf is None:
+            row, column = divmod(index, self.columns)
+            pixbuf = self.atlas.new_subpixbuf(column * self.width,
+                row * self.height, self.width, self.height)
+            self._pixbufs[index] = pixbuf
+            if index in self._codepoints:
+                pixbufs[pixbuf] = self._codepoints[index]
+        return pixbuf
 
 def load(path, ascii_emoticons):
+    global sub_pixbuf
+    start = time.monotonic()
+    pixbufs.clear()
+    codepoints.clear()
+    sub_pixbuf = None
     module_name = 'emoticons_theme.py'
     theme_path = os.path.join(path, module_name)
     if sys.platform == 'win32' and not os.path.exists(theme_path):
@@ -85,7 +107,7 @@ def load(path, ascii_emoticons):
         return False
 
     def add_emoticon(codepoint_, sub, mod_list=None):
-        pix = sub.get_pixbuf()
+        alternates = []
         for alternate in codepoint_:
             if not ascii_emoticons:
                 try:
@@ -93,13 +115,14 @@ def load(path, ascii_emoticons):
                     continue
                 except UnicodeEncodeError:
                     pass
-            codepoints[alternate] = pix
-            if pix not in pixbufs:
-                pixbufs[pix] = alternate
+            alternates.append(alternate)
+        index = sub.add(alternates[0] if alternates else None)
+        for alternate in alternates:
+            codepoints[alternate] = index
         if mod_list is not None:
-            mod_list.append(pix)
+            mod_list.append(index)
         else:
-            pixbuf_list.append(pix)
+            pixbuf_list.append(index)
 
     popover_dict = OrderedDict()
     try:
@@ -112,7 +135,7 @@ def load(path, ascii_emoticons):
             for filename, codepoint_ in theme.emoticons[category]:
                 if codepoint_ is None:
                     # Category image
-                    pixbuf_list.append(sub.get_pixbuf())
+                    pixbuf_list.append(sub.add())
                     continue
                 if not filename:
                     # We have an emoticon with a modifier
@@ -129,22 +152,39 @@ def load(path, ascii_emoticons):
         log.exception('Error while loading emoticon theme')
         return
 
+    sub_pixbuf = sub
     set_popover(popover_dict, True)
+    log.info('Emoticons theme loaded in %.1fms',
+        (time.monotonic() - start) * 1000)
 
     return True
 
 def set_popover(popover_dict, use_image):
-    global popover_instance
-    popover_instance = EmoticonPopover(popover_dict, use_image)
+    """
+    Set what the popover will show, it is built the first time it is needed
+
+    :param popover_dict: {category: [category image, emoticon or list of
+    emoticons with modifiers, ]}, emoticons are indexes in the atlas with
+    images, texts otherwise
+    """
+    global popover_instance, popover_args
+    popover_instance = None
+    popover_args = (popover_dict, use_image)
 
 def get_popover():
+    global popover_instance
+    if popover_instance is None and popover_args is not None:
+        popover_instance = EmoticonPopover(*popover_args)
     return popover_instance
 
 def get_pixbuf(codepoint_):
-    try:
-        return codepoints[codepoint_]
-    except KeyError:
+    if sub_pixbuf is None:
+        # Emoticons are disabled or shown with a font
         return None
+    index = codepoints.get(codepoint_)
+    if index is None:
+        return None
+    return sub_pixbuf.get_pixbuf(index)
 
 def get_codepoint(pixbuf_):
     try:
@@ -181,9 +221,11 @@ class EmoticonPopover(Gtk.Popover):
         self.text_widget = None
         self.use_image = use_image
 
-        notebook = Gtk.Notebook()
-        self.add(notebook)
+        self.notebook = Gtk.Notebook()
+        self.add(self.notebook)
         self.handler_id = self.connect('key_press_event', self.on_key_press)
+        # {flowbox: emoticons} of the categories not shown yet
+        self._unpopulated = {}
 
         for category in emoji_dict:
             scrolled_window = Gtk.ScrolledWindow()
@@ -198,24 +240,46 @@ class EmoticonPopover(Gtk.Popover):
             # Use first entry as a label for the notebook page
             if self.use_image:
                 cat_image = Gtk.Image()
-                cat_image.set_from_pixbuf(emoji_dict[category][0])
-                notebook.append_page(scrolled_window, cat_image)
+                cat_image.set_from_pixbuf(
+                    sub_pixbuf.get_pixbuf(emoji_dict[category][0]))
+                self.notebook.append_page(scrolled_window, cat_image)
             else:
-                notebook.append_page(scrolled_window, Gtk.Label(label=emoji_dict[category][0]))
+                self.notebook.append_page(scrolled_window, Gtk.Label(label=emoji_dict[category][0]))
 
-            # Populate the category with emojis
-            for pix in emoji_dict[category][1:]:
-                if isinstance(pix, list):
-                    widget = self.add_emoticon_modifier(pix)
-                else:
-                    if self.use_image:
-                        widget = Gtk.Image()
-                        widget.set_from_pixbuf(pix)
-                    else:
-                        widget = Gtk.Label(label=pix)
-                flowbox.add(widget)
+            # The category is populated with emojis when it is shown
+            self._unpopulated[flowbox] = emoji_dict[category][1:]
 
-        notebook.show_all()
+        self.notebook.show_all()
+        self.notebook.connect('switch-page', self.on_switch_page)
+        self.connect('show', self.on_show)
+
+    def _get_widget(self, pix):
+        if self.use_image:
+            widget = Gtk.Image()
+            widget.set_from_pixbuf(sub_pixbuf.get_pixbuf(pix))
+        else:
+            widget = Gtk.Label(label=pix)
+        return widget
+
+    def populate(self, page):
+        flowbox = page.get_child().get_child()
+        if flowbox not in self._unpopulated:
+            return
+        for pix in self._unpopulated.pop(flowbox):
+            if isinstance(pix, list):
+                widget = self.add_emoticon_modifier(pix)
+            else:
+                widget = self._get_widget(pix)
+            flowbox.add(widget)
+        flowbox.show_all()
+
+    def on_show(self, popover):
+        page = self.notebook.get_nth_page(self.notebook.get_current_page())
+        if page is not None:
+            self.populate(page)
+
+    def on_switch_page(self, notebook, page, page_num):
+        self.populate(page)
 
     def add_emoticon_modifier(self, pixbuf_list):
         button = Gtk.MenuButton()
@@ -223,7 +287,8 @@ class EmoticonPopover(Gtk.Popover):
 
         if self.use_image:
             # We use the first item of the list as image for the button
-            button.get_child().set_from_pixbuf(pixbuf_list[0])
+            button.get_child().set_from_pixbuf(
+                sub_pixbuf.get_pixbuf(pixbuf_list[0]))
         else:
             button.remove(button.get_child())
             label = Gtk.Label(label=pixbuf_list[0])
@@ -243,12 +308,7 @@ class EmoticonPopover(Gtk.Popover):
         popover.add(flowbox)
 
         for pix in pixbuf_list[1:]:
-            if self.use_image:
-                widget = Gtk.Image()
-                widget.set_from_pixbuf(pix)
-            else:
-                widget = Gtk.Label(label=pix)
-            flowbox.add(widget)
+            flowbox.add(self._get_widget(pix))
 
         flowbox.show_all()
         button.set_popover(popover)
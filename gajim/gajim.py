@@ -241,9 +241,10 @@ class GajimApplication(Gtk.Application):
         if hasattr(self.interface, 'roster') and self.interface.roster:
             self.interface.roster.prepare_quit()
 
-        # Commit any outstanding SQL transactions
+        # Commit any outstanding SQL transactions and queued writes
         from gajim.common import app
         app.logger.commit()
+        app.logger.close_db()
 
     def _handle_local_options(self, application,
                               options: GLib.VariantDict) -> int:
@@ -294,6 +294,16 @@ class GajimRemote:
                                                 'room'), False)
                                 ]
                         ],
+                'event_profiling': [
+                                _('Starts, stops or resets recording how long event handlers take'),
+                                [
+                                        ('action', _('"start", "stop" or "reset"'), True)
+                                ]
+                        ],
+                'event_stats': [
+                                _('Shows how long event handlers took since event profiling was started'),
+                                [ ]
+                        ],
                 'check_gajim_running': [
                                 _('Check if Gajim is running'),
                                 []
@@ -370,6 +380,15 @@ class GajimRemote:
                     print(result)
             elif self.command == 'contact_info':
                 print(self.print_info(0, res, True))
+            elif self.command == 'event_profiling':
+                if not res:
+                    send_error(_('Unknown action or event profiling is not '
+                        'running'))
+            elif self.command == 'event_stats':
+                if res:
+                    print(res)
+                else:
+                    print(_('Event profiling is not running'))
             elif res:
                 print(res)
 
@@ -30,6 +30,7 @@
 import os
 import time
 import locale
+from collections import deque
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -48,6 +49,7 @@ from gajim import cell_renderer_image
 from gajim import dataforms_widget
 from gajim.common.const import AvatarSize
 from gajim.common.caps_cache import muc_caps_cache
+from gajim.common.config import get_words_regex
 import nbxmpp
 
 from enum import IntEnum, unique
@@ -70,6 +72,9 @@ from gajim.common.connection_handlers_events import GcMessageOutgoingEvent
 import logging
 log = logging.getLogger('gajim.groupchat_control')
 
+# How many history messages are printed per idle call
+HISTORY_CHUNK_SIZE = 25
+
 @unique
 class Column(IntEnum):
     IMG = 0 # image to show state (online, new message etc)
@@ -150,7 +155,8 @@ class PrivateChatControl(ChatControl):
         app.ged.register_event_handler('caps-received', ged.GUI1,
             self._nec_caps_received_pm)
         app.ged.register_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            account=self.account, jid=self.gc_contact.room_jid)
 
     def get_our_nick(self):
         return self.room_ctrl.nick
@@ -162,7 +168,8 @@ class PrivateChatControl(ChatControl):
         app.ged.remove_event_handler('caps-received', ged.GUI1,
             self._nec_caps_received_pm)
         app.ged.remove_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            account=self.account, jid=self.gc_contact.room_jid)
 
     def _nec_caps_received_pm(self, obj):
         if obj.conn.name != self.account or \
@@ -353,6 +360,14 @@ class GroupchatControl(ChatControlBase):
 
         # sorted list of nicks who mentioned us (last at the end)
         self.attention_list = []
+
+        # History messages received on join, printed from an idle handler.
+        # Only the newest muc_history_eager_lines are kept in _history_queue,
+        # older ones wait in _history_backlog until the user scrolls up.
+        self._history_queue = deque()
+        self._history_backlog = []
+        self._history_source_id = None
+        self._history_scroll = False
         self.room_creation = int(time.time()) # Use int to reduce mem usage
         self.nick_hits = []
         self.last_key_tabs = False
@@ -476,23 +491,27 @@ class GroupchatControl(ChatControlBase):
         self.control_menu = gui_menu_builder.get_groupchat_menu(self.control_id)
 
         app.ged.register_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            account=self.account, jid=self.room_jid)
         app.ged.register_event_handler('gc-message-received', ged.GUI1,
-            self._nec_gc_message_received)
+            self._nec_gc_message_received,
+            account=self.account, jid=self.room_jid)
         app.ged.register_event_handler('mam-decrypted-message-received',
             ged.GUI1, self._nec_mam_decrypted_message_received)
         app.ged.register_event_handler('vcard-published', ged.GUI1,
-            self._nec_vcard_published)
+            self._nec_vcard_published, account=self.account)
         app.ged.register_event_handler('update-gc-avatar', ged.GUI1,
             self._nec_update_avatar)
         app.ged.register_event_handler('gc-subject-received', ged.GUI1,
-            self._nec_gc_subject_received)
+            self._nec_gc_subject_received,
+            account=self.account, jid=self.room_jid)
         app.ged.register_event_handler('gc-config-changed-received', ged.GUI1,
-            self._nec_gc_config_changed_received)
+            self._nec_gc_config_changed_received,
+            account=self.account, jid=self.room_jid)
         app.ged.register_event_handler('signed-in', ged.GUI1,
-            self._nec_signed_in)
+            self._nec_signed_in, account=self.account)
         app.ged.register_event_handler('decrypted-message-received', ged.GUI2,
-            self._nec_decrypted_message_received)
+            self._nec_decrypted_message_received, account=self.account)
         app.gc_connected[self.account][self.room_jid] = False
         # disable win, we are not connected yet
         ChatControlBase.got_disconnected(self)
@@ -1120,7 +1139,7 @@ class GroupchatControl(ChatControlBase):
             if obj.has_timestamp:
                 # don't print xhtml if it's an old message.
                 # Like that xhtml messages are grayed too.
-                self.print_old_conversation(
+                self.queue_old_conversation(
                     obj.msgtxt, contact=obj.nick,
                     tim=obj.timestamp, xhtml=None, encrypted=obj.encrypted,
                     displaymarking=obj.displaymarking, msg_stanza_id=obj.id_,
@@ -1187,6 +1206,76 @@ class GroupchatControl(ChatControlBase):
             role_iter = self.model.iter_next(role_iter)
         return None
 
+    def queue_old_conversation(self, text, **kwargs):
+        """
+        Print a history line later from an idle handler
+
+        The textview orders lines by timestamp, so lines printed
+        meanwhile still end up after the history.
+        """
+        self._history_queue.append((text, kwargs))
+        eager_lines = app.config.get('muc_history_eager_lines')
+        if eager_lines >= 0 and len(self._history_queue) > eager_lines:
+            self._history_backlog.append(self._history_queue.popleft())
+        if self._history_source_id is None:
+            self._history_scroll = self.conv_textview.at_the_end()
+            self._history_source_id = GLib.idle_add(self._print_history_chunk)
+
+    def _print_old_conversation_lines(self, lines):
+        self.conv_textview.autoscroll = False
+        try:
+            for text, kwargs in lines:
+                self.print_old_conversation(text, **kwargs)
+        finally:
+            self.conv_textview.autoscroll = True
+
+    def _print_history_chunk(self):
+        if self._history_queue:
+            count = min(HISTORY_CHUNK_SIZE, len(self._history_queue))
+            self._print_old_conversation_lines(
+                [self._history_queue.popleft() for _i in range(count)])
+            # With a backlog, come back once the textview updated its size
+            if self._history_queue or self._history_backlog:
+                return True
+        elif self._history_backlog and self._backlog_needed():
+            # Scrolling up prints the backlog, but value-changed does not
+            # come when the view is not filled or already at the top
+            self._print_history_backlog_chunk()
+            return True
+        self._history_source_id = None
+        if self._history_scroll:
+            GLib.idle_add(self.conv_textview.scroll_to_end_iter)
+        return False
+
+    def _print_history_backlog_chunk(self):
+        """
+        Print the newest lines of the history we did not print on join
+        """
+        lines = self._history_backlog[-HISTORY_CHUNK_SIZE:]
+        del self._history_backlog[-HISTORY_CHUNK_SIZE:]
+        self._print_old_conversation_lines(lines)
+
+    def _backlog_needed(self):
+        """
+        Return True if the history backlog has to be printed without
+        waiting for the user to scroll up
+        """
+        adjustment = self.conv_scrolledwindow.get_vadjustment()
+        if adjustment.get_upper() <= adjustment.get_page_size():
+            # The view is not filled, value-changed will not come
+            return True
+        # We scroll to the end after the history otherwise
+        return not self._history_scroll and \
+            adjustment.get_value() <= adjustment.get_lower()
+
+    def on_conversation_vadjustment_value_changed(self, adjustment):
+        ChatControlBase.on_conversation_vadjustment_value_changed(self,
+            adjustment)
+        # can be called from ChatControlBase.__init__
+        if getattr(self, '_history_backlog', None) and \
+        adjustment.get_value() <= adjustment.get_lower():
+            self._print_history_backlog_chunk()
+
     def print_old_conversation(self, text, contact='', tim=None, xhtml = None,
     displaymarking=None, msg_stanza_id=None, encrypted=None, additional_data=None):
         if additional_data is None:
@@ -1344,28 +1433,13 @@ class GroupchatControl(ChatControlBase):
         Check text to see whether any of the words in (muc_highlight_words and
         nick) appear
         """
-        special_words = app.config.get('muc_highlight_words').split(';')
-        special_words.append(self.nick)
         con = app.connections[self.account]
-        special_words.append(con.get_own_jid().getStripped())
-        # Strip empties: ''.split(';') == [''] and would highlight everything.
-        # Also lowercase everything for case insensitive compare.
-        special_words = [word.lower() for word in special_words if word]
-        text = text.lower()
-
-        for special_word in special_words:
-            found_here = text.find(special_word)
-            while(found_here > -1):
-                end_here = found_here + len(special_word)
-                if (found_here == 0 or not text[found_here - 1].isalpha()) and \
-                (end_here == len(text) or not text[end_here].isalpha()):
-                    # It is beginning of text or char before is not alpha AND
-                    # it is end of text or char after is not alpha
-                    return True
-                # continue searching
-                start = found_here + 1
-                found_here = text.find(special_word, start)
-        return False
+        special_words = app.config.get_policy(self.account).highlight_words + (
+            self.nick.lower(), con.get_own_jid().getStripped().lower())
+        # The regex is cached as long as the words do not change. Empty words
+        # are ignored, they would highlight everything.
+        regex = get_words_regex(special_words)
+        return bool(regex and regex.search(text.lower()))
 
     def set_subject(self, subject):
         self.subject = subject
@@ -2132,22 +2206,32 @@ class GroupchatControl(ChatControlBase):
         # Preventing autorejoin from being activated
         self.autorejoin = False
 
+        if self._history_source_id is not None:
+            GLib.source_remove(self._history_source_id)
+            self._history_source_id = None
+        self._history_queue.clear()
+        self._history_backlog = []
+
         app.ged.remove_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            account=self.account, jid=self.room_jid)
         app.ged.remove_event_handler('gc-message-received', ged.GUI1,
-            self._nec_gc_message_received)
+            self._nec_gc_message_received,
+            account=self.account, jid=self.room_jid)
         app.ged.remove_event_handler('vcard-published', ged.GUI1,
-            self._nec_vcard_published)
+            self._nec_vcard_published, account=self.account)
         app.ged.remove_event_handler('update-gc-avatar', ged.GUI1,
             self._nec_update_avatar)
         app.ged.remove_event_handler('gc-subject-received', ged.GUI1,
-            self._nec_gc_subject_received)
+            self._nec_gc_subject_received,
+            account=self.account, jid=self.room_jid)
         app.ged.remove_event_handler('gc-config-changed-received', ged.GUI1,
-            self._nec_gc_config_changed_received)
+            self._nec_gc_config_changed_received,
+            account=self.account, jid=self.room_jid)
         app.ged.remove_event_handler('signed-in', ged.GUI1,
-            self._nec_signed_in)
+            self._nec_signed_in, account=self.account)
         app.ged.remove_event_handler('decrypted-message-received', ged.GUI2,
-            self._nec_decrypted_message_received)
+            self._nec_decrypted_message_received, account=self.account)
 
         if self.room_jid in app.gc_connected[self.account] and \
         app.gc_connected[self.account][self.room_jid]:
@@ -1843,7 +1843,36 @@ class Interface:
         if app.config.get('ascii_formatting'):
             basic_pattern += formatting
         self.basic_pattern = basic_pattern
+        self._basic_pattern_re = None
+
+        # The emoticons pattern is built when it is used first, themes have
+        # thousands of emoticons
+        self._emoticons_pattern = None
+        self._emot_and_basic_re = None
+
+        # at least one character in 3 parts (before @, after @, after .)
+        self.sth_at_sth_dot_sth = r'\S+@\S+\.\S*[^\s)?]'
+
+        # Invalid XML chars
+        self.invalid_XML_chars = '[\x00-\x08]|[\x0b-\x0c]|[\x0e-\x1f]|'\
+            '[\ud800-\udfff]|[\ufffe-\uffff]'
+
+    @property
+    def emot_only(self):
+        # needed for xhtml display
+        if self._emoticons_pattern is None:
+            self._emoticons_pattern = self._make_emoticons_pattern()
+        return self._emoticons_pattern
+
+    @property
+    def emot_and_basic(self):
+        # because emoticons match later (in the string) they need to be after
+        # basic matches that may occur earlier
+        return self.basic_pattern + self.emot_only
 
+    @staticmethod
+    def _make_emoticons_pattern():
+        start = time.monotonic()
         emoticons_pattern = ''
         if app.config.get('emoticons_theme'):
             # When an emoticon is bordered by an alpha-numeric character it is
@@ -1874,20 +1903,9 @@ class Interface:
                 emoticons_pattern_prematch[:-1] + '))' + '(?:' + \
                 emoticons_pattern[:-1] + ')' + r'(?:(?![\w]' + \
                 emoticons_pattern_postmatch[:-1] + '))'
-
-        # because emoticons match later (in the string) they need to be after
-        # basic matches that may occur earlier
-        self.emot_and_basic = basic_pattern + emoticons_pattern
-
-        # needed for xhtml display
-        self.emot_only = emoticons_pattern
-
-        # at least one character in 3 parts (before @, after @, after .)
-        self.sth_at_sth_dot_sth = r'\S+@\S+\.\S*[^\s)?]'
-
-        # Invalid XML chars
-        self.invalid_XML_chars = '[\x00-\x08]|[\x0b-\x0c]|[\x0e-\x1f]|'\
-            '[\ud800-\udfff]|[\ufffe-\uffff]'
+            log.info('Emoticons pattern built in %.1fms',
+                (time.monotonic() - start) * 1000)
+        return emoticons_pattern
 
     def init_emoticons(self):
         emot_theme = app.config.get('emoticons_theme')
@@ -2331,6 +2349,10 @@ class Interface:
             raise
         return True # renew timeout (loop for ever)
 
+    @staticmethod
+    def save_config_changes():
+        parser.write_changes()
+
     @staticmethod
     def save_config():
         err_str = parser.write()
@@ -2669,9 +2691,8 @@ class Interface:
         self.link_pattern_re = None
         self.invalid_XML_chars = None
         self.basic_pattern = None
-        self.emot_and_basic = None
         self.sth_at_sth_dot_sth = None
-        self.emot_only = None
+        self._emoticons_pattern = None
 
         cfg_was_read = parser.read()
 
@@ -2760,6 +2781,9 @@ class Interface:
         # Creating Network Events Controller
         from gajim.common import nec
         app.nec = nec.NetworkEventsController()
+        if app.config.get('event_profiling'):
+            app.ged.enable_profiling(
+                app.config.get('event_profiling_threshold'))
         app.notification = notify.Notification()
 
         self.create_core_handlers_list()
@@ -2888,6 +2912,9 @@ class Interface:
         # get transports type from DB
         app.transport_type = app.logger.get_transports_type()
 
+        # retention policies, archiving and incremental vacuum
+        app.logger.schedule_maintenance()
+
         if app.config.get('soundplayer') == '':
             # only on first time Gajim starts
             commands = ('paplay', 'aplay', 'play', 'ossplay')
@@ -43,10 +43,11 @@ from gajim.common import i18n
 
 def parseOpts():
     config_path = None
+    rebuild_index = False
 
     try:
-        shortargs = 'hc:'
-        longargs = 'help config-path='
+        shortargs = 'hc:r'
+        longargs = 'help config-path= rebuild-search-index'
         opts = getopt.getopt(sys.argv[1:], shortargs, longargs.split())[0]
     except getopt.error as msg:
         print(str(msg))
@@ -59,13 +60,17 @@ def parseOpts():
                 _('Options:') + \
                 '\n  -h, --help         ' + \
                     _('Show this help message and exit') + \
-                '\n  -c, --config-path  ' + _('Choose folder for logfile') + '\n')
+                '\n  -c, --config-path  ' + _('Choose folder for logfile') + \
+                '\n  -r, --rebuild-search-index  ' + \
+                    _('Rebuild the search index of the logfile and exit') + '\n')
             sys.exit()
         elif o in ('-c', '--config-path'):
             config_path = a
-    return config_path
+        elif o in ('-r', '--rebuild-search-index'):
+            rebuild_index = True
+    return config_path, rebuild_index
 
-config_path = parseOpts()
+config_path, rebuild_index = parseOpts()
 del parseOpts
 
 import gajim.common.configpaths
@@ -73,7 +78,9 @@ gajim.common.configpaths.gajimpaths.init(config_path)
 del config_path
 from gajim.common import app
 from gajim import gtkgui_helpers
-from gajim.common.logger import LOG_DB_PATH, JIDConstant, KindConstant
+from gajim.common.logger import LOG_DB_PATH, LOG_DB_FOLDER
+from gajim.common.logger import JIDConstant, KindConstant
+from gajim.common.logger import Logger, decompress_block, get_archive_years
 from gajim.common import helpers
 from gajim import dialogs
 
@@ -90,6 +97,25 @@ class Column(IntEnum):
 import sqlite3 as sqlite
 
 
+def rebuild_search_index():
+    """
+    Rebuild the full-text search index from the content of the logs table
+    """
+    if not os.path.exists(LOG_DB_PATH):
+        print('%s does not exist.' % LOG_DB_PATH, file=sys.stderr)
+        return False
+    con = sqlite.connect(LOG_DB_PATH, timeout=20.0)
+    try:
+        con.execute("INSERT INTO logs_fts (logs_fts) VALUES ('rebuild')")
+        con.commit()
+    except sqlite.OperationalError as e:
+        print('Failed to rebuild search index: %s' % str(e), file=sys.stderr)
+        return False
+    finally:
+        con.close()
+    return True
+
+
 class HistoryManager:
     def __init__(self):
         pixs = []
@@ -123,6 +149,25 @@ class HistoryManager:
         self.con = sqlite.connect(LOG_DB_PATH, timeout=20.0,
                 isolation_level='IMMEDIATE')
         self.cur = self.con.cursor()
+        self.cur.execute('''SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name = 'logs_fts' ''')
+        self.fts_enabled = self.cur.fetchone() is not None
+        self.cur.execute('''SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name = 'logs_blocks' ''')
+        self.blocks_enabled = self.cur.fetchone() is not None
+        self.cur.execute('''SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name = 'logs_days' ''')
+        self.days_enabled = self.cur.fetchone() is not None
+        self.cur.execute('''SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name = 'moved_stanza_ids' ''')
+        self.moved_ids_enabled = self.cur.fetchone() is not None
+        # lines moved into the yearly archives are deleted with the others
+        self.archives = []
+        for year in get_archive_years(LOG_DB_FOLDER):
+            schema = 'archive_%d' % year
+            path = os.path.join(LOG_DB_FOLDER, 'logs-archive-%d.db' % year)
+            self.cur.execute('ATTACH DATABASE ? AS %s' % schema, (path,))
+            self.archives.append(schema)
 
         self._init_jids_listview()
         self._init_logs_listview()
@@ -230,6 +275,8 @@ class HistoryManager:
             return
 
         def on_yes(clicked):
+            # Gajim gives free pages back with incremental vacuum from now on
+            self.cur.execute('PRAGMA auto_vacuum = INCREMENTAL')
             self.cur.execute('VACUUM')
             self.con.commit()
             Gtk.main_quit()
@@ -251,8 +298,13 @@ class HistoryManager:
 
     def _fill_jids_listview(self):
         # get those jids that have at least one entry in logs
-        self.cur.execute('SELECT jid, jid_id FROM jids WHERE jid_id IN ('
-                'SELECT distinct logs.jid_id FROM logs) ORDER BY jid')
+        if self.blocks_enabled:
+            self.cur.execute('SELECT jid, jid_id FROM jids WHERE jid_id IN ('
+                    'SELECT logs.jid_id FROM logs UNION '
+                    'SELECT logs_blocks.jid_id FROM logs_blocks) ORDER BY jid')
+        else:
+            self.cur.execute('SELECT jid, jid_id FROM jids WHERE jid_id IN ('
+                    'SELECT distinct logs.jid_id FROM logs) ORDER BY jid')
         # list of tuples: [('aaa@bbb',), ('cc@dd',)]
         rows = self.cur.fetchall()
         for row in rows:
@@ -409,13 +461,27 @@ class HistoryManager:
         Ask db and fill listview with results that match text
         """
         self.search_results_liststore.clear()
-        like_sql = '%' + text + '%'
-        self.cur.execute('''
-                SELECT log_line_id, jid_id, time, message, subject, contact_name
-                FROM logs
-                WHERE message LIKE ? OR subject LIKE ?
-                ORDER BY time
-                ''', (like_sql, like_sql))
+        if self.fts_enabled:
+            fts_query = Logger.build_search_query(text)
+            if not fts_query:
+                return
+            self.cur.execute('''
+                    SELECT logs.log_line_id, logs.jid_id, logs.time,
+                    logs.message, logs.subject, logs.contact_name
+                    FROM logs_fts
+                    JOIN logs ON logs.log_line_id = logs_fts.rowid
+                    WHERE logs_fts MATCH ?
+                    ORDER BY logs_fts.rank
+                    ''', (fts_query,))
+        else:
+            like_sql = '%' + text + '%'
+            self.cur.execute('''
+                    SELECT log_line_id, jid_id, time, message, subject,
+                    contact_name
+                    FROM logs
+                    WHERE message LIKE ? OR subject LIKE ?
+                    ORDER BY time
+                    ''', (like_sql, like_sql))
 
         results = self.cur.fetchall()
         for row in results:
@@ -499,6 +565,7 @@ class HistoryManager:
         for path in list_of_paths:  # make them treerowrefs (it's needed)
             list_of_rowrefs.append(Gtk.TreeRowReference.new(liststore, path))
 
+        file_ = open(path_to_file, 'w')
         for rowref in list_of_rowrefs:
             path = rowref.get_path()
             if path is None:
@@ -509,12 +576,34 @@ class HistoryManager:
                     WHERE jid_id = ?
                     ORDER BY time
                     ''', (jid_id,))
-
-        # FIXME: we may have two contacts selected to export. fix that
-        # AT THIS TIME FIRST EXECUTE IS LOST! WTH!!!!!
-        results = self.cur.fetchall()
-        #print results[0]
-        file_ = open(path_to_file, 'w')
+            results = self.cur.fetchall()
+            cold_results = self._get_compressed_lines(jid_id)
+            if cold_results:
+                results = sorted(results + cold_results,
+                                 key=lambda row: row[0])
+            self._write_logs(file_, jid_id, results)
+        file_.close()
+
+    def _get_compressed_lines(self, jid_id):
+        """
+        Return time, kind, message and contact_name of the lines in the
+        compressed blocks of `jid_id`
+        """
+        if not self.blocks_enabled:
+            return []
+        self.cur.execute('''
+                SELECT data FROM logs_blocks WHERE jid_id = ?
+                ''', (jid_id,))
+        lines = []
+        for data, in self.cur.fetchall():
+            columns, rows = decompress_block(data)
+            indexes = [columns.index(name) for name in
+                       ('time', 'kind', 'message', 'contact_name')]
+            for row in rows:
+                lines.append(tuple(row[i] for i in indexes))
+        return lines
+
+    def _write_logs(self, file_, jid_id, results):
         for row in results:
             # in store: time, kind, message, contact_name FROM logs
             # in text: JID or You or nickname (if it's gc_msg), time, message
@@ -561,6 +650,27 @@ class HistoryManager:
                         DELETE FROM logs
                         WHERE jid_id = ?
                         ''', (jid_id,))
+                if self.blocks_enabled:
+                    self.cur.execute('''
+                            DELETE FROM logs_blocks
+                            WHERE jid_id = ?
+                            ''', (jid_id,))
+                if self.moved_ids_enabled:
+                    self.cur.execute('''
+                            DELETE FROM moved_stanza_ids
+                            WHERE jid_id = ?
+                            ''', (jid_id,))
+                for schema in self.archives:
+                    self.cur.execute('''
+                            DELETE FROM %s.logs
+                            WHERE jid_id = ?
+                            ''' % schema, (jid_id,))
+                if self.days_enabled:
+                    # also holds the days of archived and compressed lines
+                    self.cur.execute('''
+                            DELETE FROM logs_days
+                            WHERE jid_id = ?
+                            ''', (jid_id,))
 
                 # now delete "jid, jid_id" row from jids table
                 self.cur.execute('''
@@ -669,6 +779,8 @@ class HistoryManager:
         self.logs_listview.scroll_to_cell(path)
 
 if __name__ == '__main__':
+    if rebuild_index:
+        sys.exit(0 if rebuild_search_index() else 1)
     signal.signal(signal.SIGINT, signal.SIG_DFL)  # ^C exits the application
     HistoryManager()
     Gtk.main()
@@ -41,6 +41,7 @@ from gajim import dialogs
 from gajim.common import app
 from gajim.common import helpers
 from gajim.common import exceptions
+from gajim.common import i18n
 
 from gajim.common.logger import ShowConstant, KindConstant
 
@@ -71,6 +72,11 @@ class HistoryWindow:
         self.window = xml.get_object('history_window')
         self.window.set_application(app.app)
         self.calendar = xml.get_object('calendar')
+        # number of messages per day of the shown month, the details are
+        # shown as tooltips
+        self._day_messages = {}
+        self.calendar.set_property('show-details', False)
+        self.calendar.set_detail_func(self._calendar_detail)
         scrolledwindow = xml.get_object('scrolledwindow')
         self.history_textview = conversation_textview.ConversationTextview(
             account, used_in_history_window = True)
@@ -262,6 +268,24 @@ class HistoryWindow:
         if event.keyval == Gdk.KEY_Escape:
             self.save_state()
             self.window.destroy()
+        elif event.state & Gdk.ModifierType.CONTROL_MASK and \
+        event.keyval in (Gdk.KEY_Page_Up, Gdk.KEY_Page_Down):
+            # jump to the previous / next day with logs
+            self._select_adjacent_day(event.keyval == Gdk.KEY_Page_Down)
+            return True
+
+    def _select_adjacent_day(self, forward):
+        if not self.jid:
+            return
+        year, month, day = self.calendar.get_date()
+        month = gtkgui_helpers.make_gtk_month_python_month(month)
+        date = app.logger.get_adjacent_day_with_logs(
+            self.account, self.jid, datetime.date(year, month, day), forward)
+        if date is None:
+            return
+        gtk_month = gtkgui_helpers.make_python_month_gtk_month(date.month)
+        self.calendar.select_month(gtk_month, date.year)
+        self.calendar.select_day(date.day)
 
     def on_close_button_clicked(self, widget):
         self.save_state()
@@ -376,8 +400,19 @@ class HistoryWindow:
             dialogs.ErrorDialog(_('Disk Error'), str(e))
             return
 
+        self._day_messages = {}
         for date in log_days:
             widget.mark_day(date.day)
+            self._day_messages[date.day] = date.messages
+
+    def _calendar_detail(self, calendar_, year, month, day):
+        # Shown as tooltip of the day
+        messages = self._day_messages.get(day)
+        if not messages or \
+        (year, month) != self.calendar.get_date()[:2]:
+            return None
+        return i18n.ngettext('%d message', '%d messages', messages,
+                             messages, messages)
 
     def _get_string_show_from_constant_int(self, show):
         if show == ShowConstant.ONLINE:
@@ -556,7 +591,8 @@ class HistoryWindow:
 
             show_status = self.show_status_checkbutton.get_active()
 
-            results = app.logger.search_log(account, jid, text, date)
+            results = app.logger.search_log(account, jid, text, date,
+                                             ranked=True)
             #FIXME:
             # add "subject:  | message: " in message column if kind is single
             # also do we need show at all? (we do not search on subject)
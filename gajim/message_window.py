@@ -1143,7 +1143,7 @@ class MessageWindowMgr(GObject.GObject):
 
     def _on_window_delete(self, win, event):
         self.save_state(self._gtk_win_to_msg_win(win))
-        app.interface.save_config()
+        app.interface.save_config_changes()
         return False
 
     def _on_window_destroy(self, win):
@@ -1217,7 +1217,7 @@ class MessageWindowMgr(GObject.GObject):
                 w.window.hide()
                 w.window.destroy()
 
-        app.interface.save_config()
+        app.interface.save_config_changes()
 
     def save_state(self, msg_win, width_adjust=0):
         # Save window size and position
@@ -860,6 +860,27 @@ class SignalObject(dbus.service.Object):
             for acc in app.contacts.get_accounts():
                 app.connections[acc].send_stanza(str(xml))
 
+    @dbus.service.method(INTERFACE, in_signature='s', out_signature='b')
+    def event_profiling(self, action):
+        if action == 'start':
+            app.ged.enable_profiling(
+                app.config.get('event_profiling_threshold'))
+        elif action == 'stop':
+            app.ged.disable_profiling()
+        elif action == 'reset':
+            if app.ged.profiler is None:
+                return DBUS_BOOLEAN(False)
+            app.ged.profiler.reset()
+        else:
+            return DBUS_BOOLEAN(False)
+        return DBUS_BOOLEAN(True)
+
+    @dbus.service.method(INTERFACE, in_signature='', out_signature='s')
+    def event_stats(self):
+        if app.ged.profiler is None:
+            return DBUS_STRING('')
+        return DBUS_STRING(app.ged.profiler.get_report())
+
     @dbus.service.method(INTERFACE, in_signature='ss', out_signature='')
     def change_avatar(self, picture, account):
         filesize = os.path.getsize(picture)
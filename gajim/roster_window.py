@@ -43,6 +43,7 @@ import os
 import time
 import locale
 import hashlib
+import logging
 
 from enum import IntEnum, unique
 
@@ -70,6 +71,11 @@ from gajim.common import dbus_support
 from gajim.message_window import MessageWindowMgr
 from nbxmpp.protocol import NS_FILE, NS_ROSTERX, NS_CONFERENCE
 
+log = logging.getLogger('gajim.roster')
+
+# Milliseconds between two redraws of contacts that changed, about a frame
+CONTACT_REDRAW_INTERVAL = 16
+
 
 @unique
 class Column(IntEnum):
@@ -90,6 +96,111 @@ empty_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1)
 empty_pixbuf.fill(0xffffff00)
 
 
+class RosterFilterIndex:
+    """
+    Contacts of the roster that match the search string of the filter entry
+
+    Contacts are searched by their shown name, jid and groups, casefolded
+    and without accents. These search keys are cached per contact and
+    computed again when the name or the groups of the contact changed.
+    """
+    def __init__(self):
+        # { (account, jid): ((shown name, groups), key) }
+        self._keys = {}
+        self._query = None
+        # (account, jid) of matching contacts
+        self._matches = set()
+        # (account, group) of groups with matching contacts
+        self._groups = set()
+
+    def _get_key(self, account, contact):
+        source = (contact.get_shown_name(), tuple(contact.get_shown_groups()))
+        cached = self._keys.get((account, contact.jid))
+        if cached is not None and cached[0] == source:
+            return cached[1], False
+        key = helpers.normalize_search_string(
+            '\n'.join((source[0], contact.jid) + source[1]))
+        self._keys[(account, contact.jid)] = (source, key)
+        return key, True
+
+    def _add_match(self, account, contact):
+        self._matches.add((account, contact.jid))
+        for group in contact.get_shown_groups():
+            self._groups.add((account, group))
+
+    def update(self, query):
+        """
+        Search all contacts for `query`
+
+        If `query` extends the previous query, only the contacts that
+        matched the previous query are searched again.
+        """
+        query = helpers.normalize_search_string(query)
+        accounts = app.contacts.get_accounts()
+        if self._query is not None and query.startswith(self._query):
+            candidates = [(account, jid) for account, jid in self._matches
+                          if account in accounts]
+        else:
+            candidates = [(account, jid) for account in accounts
+                          for jid in app.contacts.get_jid_list(account)]
+            # Forget contacts that are not in the roster anymore
+            keys = self._keys
+            self._keys = {item: keys[item] for item in candidates
+                          if item in keys}
+
+        self._query = query
+        self._matches = set()
+        self._groups = set()
+        for account, jid in candidates:
+            contact = app.contacts.get_first_contact_from_jid(account, jid)
+            if contact and query in self._get_key(account, contact)[0]:
+                self._add_match(account, contact)
+
+        # Transports with pending events are always shown
+        transports = _('Transports')
+        for account, events in app.events.get_roster_events().items():
+            if account not in accounts:
+                continue
+            for jid in events:
+                jid = app.get_jid_without_resource(jid)
+                contact = app.contacts.get_first_contact_from_jid(account,
+                                                                  jid)
+                if contact and transports in contact.get_shown_groups():
+                    self._groups.add((account, transports))
+
+    def contact_matches(self, account, contact):
+        """
+        Return True if the contact matches the current query
+
+        Contacts that were added or renamed since the last update() are
+        searched now.
+        """
+        if self._query is None:
+            return True
+        key, changed = self._get_key(account, contact)
+        if not changed:
+            return (account, contact.jid) in self._matches
+        if self._query in key:
+            self._add_match(account, contact)
+            return True
+        self._matches.discard((account, contact.jid))
+        return False
+
+    def __contains__(self, item):
+        """
+        item is an (account, jid) tuple
+        """
+        return item in self._matches
+
+    def group_has_matches(self, accounts, group):
+        return any((account, group) in self._groups for account in accounts)
+
+    def clear(self):
+        self._query = None
+        self._matches = set()
+        self._groups = set()
+
+
 class RosterWindow:
     """
     Class for main window of the GTK+ interface
@@ -917,9 +1028,11 @@ class RosterWindow:
 
                 self.remove_contact(jid, acc, force=True)
 
-                contact.groups.remove(old_name)
-                if new_name not in contact.groups:
-                    contact.groups.append(new_name)
+                groups = [group for group in contact.groups
+                          if group != old_name]
+                if new_name not in groups:
+                    groups.append(new_name)
+                contact.groups = groups
 
                 changed_contacts.append({'jid': jid, 'name': contact.name,
                     'groups':contact.groups})
@@ -950,10 +1063,9 @@ class RosterWindow:
         """
         self.remove_contact(jid, account, force=True)
         for contact in app.contacts.get_contacts(account, jid):
-            for group in groups:
-                if group not in contact.groups:
-                    # we might be dropped from meta to group
-                    contact.groups.append(group)
+            # we might be dropped from meta to group
+            contact.groups = contact.groups + [group for group in groups
+                if group not in contact.groups]
             if update:
                 app.connections[account].update_contact(jid, contact.name,
                         contact.groups)
@@ -978,10 +1090,9 @@ class RosterWindow:
         """
         self.remove_contact(jid, account, force=True)
         for contact in app.contacts.get_contacts(account, jid):
-            for group in groups:
-                if group in contact.groups:
-                    # Needed when we remove from "General" or "Observers"
-                    contact.groups.remove(group)
+            # Needed when we remove from "General" or "Observers"
+            contact.groups = [group for group in contact.groups
+                if group not in groups]
             if update:
                 app.connections[account].update_contact(jid, contact.name,
                         contact.groups)
@@ -1434,6 +1545,74 @@ class RosterWindow:
             self.draw_group(group, account)
             self._adjust_group_expand_collapse_state(group, account)
 
+    def queue_draw_contact_context(self, jid, account, avatar=False):
+        """
+        Like adjust_and_draw_contact_context(), but draw later together
+        with all other contacts that changed until then
+
+        Each contact is drawn once per batch, however often it changed.
+        Metacontact families are still rearranged right away.
+
+        :param avatar:  Also draw the avatar of the contact
+        """
+        family = app.contacts.get_metacontacts_family(account, jid)
+        if family and app.contacts.get_first_contact_from_jid(account, jid):
+            # There might be a new big brother
+            self._recalibrate_metacontact_family(family, account)
+        key = (account, jid)
+        if key in self._contacts_to_draw:
+            self.contact_redraws_saved += 1
+            self._contacts_to_draw[key] |= avatar
+            return
+        self._contacts_to_draw[key] = avatar
+        if self._draw_contacts_timeout_id is None:
+            self._draw_contacts_timeout_id = GLib.timeout_add(
+                CONTACT_REDRAW_INTERVAL, self._draw_queued_contacts)
+
+    def _draw_queued_contacts(self):
+        self._draw_contacts_timeout_id = None
+        contacts = self._contacts_to_draw
+        self._contacts_to_draw = {}
+        self._draw_contacts_context(contacts)
+        log.debug('Drew %s contacts, %s redraws saved so far',
+                  len(contacts), self.contact_redraws_saved)
+        return False
+
+    def _draw_contacts_context(self, contacts, recalibrate=False):
+        """
+        Draw contacts like adjust_and_draw_contact_context(), but adjust
+        every group and account only once
+
+        :param contacts:    Dict of (account, jid) to True if the avatar
+                            has to be drawn as well
+
+        :param recalibrate: Rearrange the metacontact families
+        """
+        groups = set()
+        accounts = set()
+        for (account, jid), avatar in contacts.items():
+            if account not in app.contacts.get_accounts():
+                continue
+            contact = app.contacts.get_first_contact_from_jid(account, jid)
+            if not contact:
+                continue
+            if recalibrate:
+                family = app.contacts.get_metacontacts_family(account, jid)
+                if family:
+                    self._recalibrate_metacontact_family(family, account)
+            self.draw_contact(jid, account)
+            if avatar:
+                self.draw_avatar(jid, account)
+            accounts.add(account)
+            for group in contact.get_shown_groups():
+                groups.add((group, account))
+
+        for group, account in groups:
+            self.draw_group(group, account)
+            self._adjust_group_expand_collapse_state(group, account)
+        for account in accounts:
+            self.draw_account(account)
+
     def _idle_draw_jids_of_account(self, jids, account):
         """
         Draw given contacts and their avatars in a lazy fashion
@@ -1615,9 +1794,15 @@ class RosterWindow:
         if self.filtering:
             return
         self.filtering = True
+        contacts = self._contacts_to_draw
+        self._contacts_to_draw = {}
+        if self._draw_contacts_timeout_id is not None:
+            GLib.source_remove(self._draw_contacts_timeout_id)
+            self._draw_contacts_timeout_id = None
         for account in app.connections:
             for jid in app.contacts.get_jid_list(account):
-                self.adjust_and_draw_contact_context(jid, account)
+                contacts.setdefault((account, jid), False)
+        self._draw_contacts_context(contacts, recalibrate=True)
         self.filtering = False
 
     def contact_has_pending_roster_events(self, contact, account):
@@ -1636,7 +1821,7 @@ class RosterWindow:
 
     def contact_is_visible(self, contact, account):
         if self.rfilter_enabled:
-            return self.rfilter_string in contact.get_shown_name().lower()
+            return self.rfilter_index.contact_matches(account, contact)
         if self.contact_has_pending_roster_events(contact, account):
             return True
         if app.config.get('showoffline'):
@@ -1687,32 +1872,20 @@ class RosterWindow:
                     accounts = app.contacts.get_accounts()
                 else:
                     accounts = [account]
-                for _acc in accounts:
-                    for contact in app.contacts.iter_contacts(_acc):
-                        if group in contact.get_shown_groups():
-                            if self.rfilter_string in \
-                            contact.get_shown_name().lower():
-                                return True
-                        elif self.contact_has_pending_roster_events(contact,
-                        _acc):
-                            return True
-                    # No transport has been found
-                    return False
+                return self.rfilter_index.group_has_matches(accounts, group)
 
         if type_ == 'contact':
             if model.iter_has_child(titer):
                 iter_c = model.iter_children(titer)
                 while iter_c:
-                    if self.rfilter_string in model[iter_c][Column.NAME].lower():
+                    if (model[iter_c][Column.ACCOUNT],
+                    model[iter_c][Column.JID]) in self.rfilter_index:
                         return True
                     iter_c = model.iter_next(iter_c)
-            return self.rfilter_string in model[titer][Column.NAME].lower()
+            return (account, jid) in self.rfilter_index
 
-        if type_ == 'agent':
-            return self.rfilter_string in model[titer][Column.NAME].lower()
-
-        if type_ == 'groupchat':
-            return self.rfilter_string in model[titer][Column.NAME].lower()
+        if type_ in ('agent', 'groupchat'):
+            return (account, jid) in self.rfilter_index
 
         return visible
 
@@ -1826,29 +1999,44 @@ class RosterWindow:
         """
         Read from db the unread messages, and fire them up, and if we find very
         old unread messages, delete them from unread table
+
+        The messages are handled one by one from an idle handler.
         """
-        results = app.logger.get_unread_msgs()
-        for result, shown in results:
-            jid = result.jid
-            additional_data = result.additional_data
-            if app.contacts.get_first_contact_from_jid(account, jid) and not \
-            shown:
-                # We have this jid in our contacts list
-                # XXX unread messages should probably have their session saved
-                # with them
-                session = app.connections[account].make_new_session(jid)
-
-                tim = float(result.time)
-                session.roster_message(jid, result.message, tim, msg_type='chat',
-                    msg_log_id=result.log_line_id, additional_data=additional_data)
-                app.logger.set_shown_unread_msgs(result.log_line_id)
-
-            elif (time.time() - result.time) > 2592000:
-                # ok, here we see that we have a message in unread messages
-                # table that is older than a month. It is probably from someone
-                # not in our roster for accounts we usually launch, so we will
-                # delete this id from unread message tables.
-                app.logger.set_read_messages([result.log_line_id])
+        def _fire_up_all(account):
+            jid = session = None
+            for result in app.logger.get_unread_msgs():
+                if account not in app.connections:
+                    # account got removed meanwhile
+                    break
+                if app.contacts.get_first_contact_from_jid(account,
+                result.jid) and not result.shown:
+                    # We have this jid in our contacts list
+                    # XXX unread messages should probably have their session
+                    # saved with them
+                    if result.jid != jid:
+                        # rows are grouped by jid
+                        jid = result.jid
+                        session = app.connections[account].make_new_session(
+                            jid)
+
+                    tim = float(result.time)
+                    session.roster_message(jid, result.message, tim,
+                        msg_type='chat', msg_log_id=result.log_line_id,
+                        additional_data=result.additional_data)
+                    app.logger.set_shown_unread_msgs(result.log_line_id)
+
+                elif (time.time() - result.time) > 2592000:
+                    # ok, here we see that we have a message in unread
+                    # messages table that is older than a month. It is
+                    # probably from someone not in our roster for accounts we
+                    # usually launch, so we will delete this id from unread
+                    # message tables.
+                    app.logger.set_read_messages([result.log_line_id])
+                yield True
+            yield False
+
+        task = _fire_up_all(account)
+        GLib.idle_add(next, task)
 
     def fill_contacts_and_groups_dicts(self, array, account):
         """
@@ -2223,7 +2411,7 @@ class RosterWindow:
             self.delete_pep(contact.jid, account)
 
         # Redraw everything and select the sender
-        self.adjust_and_draw_contact_context(contact.jid, account)
+        self.queue_draw_contact_context(contact.jid, account)
 
 
     def on_status_changed(self, account, show):
@@ -2554,13 +2742,12 @@ class RosterWindow:
                         jid, account)
 
         if obj.need_redraw:
-            self.draw_contact(jid, account)
+            self.queue_draw_contact_context(jid, account)
 
         if app.jid_is_transport(jid) and jid in jid_list:
             # It must be an agent
             # Update existing iter and group counting
-            self.draw_contact(jid, account)
-            self.draw_group(_('Transports'), account)
+            self.queue_draw_contact_context(jid, account)
 
         if obj.contact:
             self.chg_contact_status(obj.contact, obj.show, obj.status, account)
@@ -2665,7 +2852,7 @@ class RosterWindow:
 
     def _nec_update_avatar(self, obj):
         app.log('avatar').debug('Draw roster avatar: %s', obj.jid)
-        self.draw_avatar(obj.jid, obj.account)
+        self.queue_draw_contact_context(obj.jid, obj.account, avatar=True)
 
     def _nec_gc_subject_received(self, obj):
         contact = app.contacts.get_contact_with_highest_priority(
@@ -4073,12 +4260,15 @@ class RosterWindow:
         self.rfilter_string = widget.get_text().lower()
         if self.rfilter_string == '':
             self.disable_rfilter()
+        else:
+            self.rfilter_index.update(self.rfilter_string)
         self.refilter_shown_roster_items()
         # select first row
         self.tree.get_selection().unselect_all()
         def _func(model, path, iter_, param):
-            if model[iter_][Column.TYPE] == 'contact' and self.rfilter_string in \
-            model[iter_][Column.NAME].lower():
+            if model[iter_][Column.TYPE] == 'contact' and (
+            model[iter_][Column.ACCOUNT], model[iter_][Column.JID]) in \
+            self.rfilter_index:
                 col = self.tree.get_column(0)
                 self.tree.set_cursor_on_cell(path, col, None, False)
                 return True
@@ -4123,6 +4313,7 @@ class RosterWindow:
 
     def disable_rfilter(self):
         self.rfilter_enabled = False
+        self.rfilter_index.clear()
         self.rfilter_entry.set_text('')
         self.rfilter_entry.set_visible(False)
         self.rfilter_entry.set_editable(False)
@@ -4216,7 +4407,7 @@ class RosterWindow:
 
             old_family = app.contacts.get_metacontacts_family(account_source,
                     c_source.jid)
-            old_groups = c_source.groups
+            old_groups = c_source.groups[:]
 
             # Remove old source contact(s)
             if was_big_brother:
@@ -5746,6 +5937,11 @@ class RosterWindow:
         self.groups_to_draw = {}
         # accounts to draw next time we draw accounts.
         self.accounts_to_draw = []
+        # contacts to draw next time we draw contacts
+        # { (account, jid): draw avatar }
+        self._contacts_to_draw = {}
+        self._draw_contacts_timeout_id = None
+        self.contact_redraws_saved = 0
 
         # uf_show, img, show, sensitive
         liststore = Gtk.ListStore(str, Gtk.Image, str, bool)
@@ -5959,6 +6155,7 @@ class RosterWindow:
         self.rfilter_entry = self.xml.get_object('rfilter_entry')
         self.rfilter_string = ''
         self.rfilter_enabled = False
+        self.rfilter_index = RosterFilterIndex()
         self.rfilter_entry.connect('key-press-event',
             self.on_rfilter_entry_key_press_event)
 
@@ -1,6 +1,8 @@
 import sys
 import os
 import getopt
+import timeit
+import unittest
 
 use_x = True
 shortargs = 'hnv:'
@@ -56,3 +58,18 @@ def setup_env():
         gtkgui_helpers.GUI_DIR = gajim_root + '/gajim/data/gui'
         from gajim.gajim import GajimApplication
         app.app = GajimApplication()
+
+def benchmark(test):
+    """
+    Decorator for tests that only measure and log timings
+
+    They are skipped unless the GAJIM_BENCHMARK environment variable is set.
+    """
+    return unittest.skipUnless(os.environ.get('GAJIM_BENCHMARK'),
+        'set GAJIM_BENCHMARK to run benchmarks')(test)
+
+def best_time(func, number=1):
+    """
+    Return the best time of three runs of `number` calls of func
+    """
+    return min(timeit.repeat(func, number=number, repeat=3))
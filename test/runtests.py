@@ -5,6 +5,9 @@
 Runs Gajim's Test Suite
 
 Unit tests tests will be run on each commit.
+
+Benchmarks only run if the GAJIM_BENCHMARK environment variable is set,
+their timings are logged at INFO level.
 '''
 
 import sys
@@ -37,8 +40,18 @@ for o, a in opts:
 # new test modules need to be added manually
 modules = ( 'unit.test_protocol_caps',
             'unit.test_caps_cache',
+            'unit.test_caps_benchmark',
+            'unit.test_logger_benchmark',
             'unit.test_contacts',
             'unit.test_account',
+            'unit.test_ged',
+            'unit.test_events',
+            'unit.test_optparser',
+            'unit.test_config',
+            'unit.test_gpg',
+            'unit.test_logger',
+            'unit.test_logs_days',
+            'unit.test_emoticons_font',
           )
 
 if use_x:
@@ -47,6 +60,7 @@ if use_x:
                  'integration.test_roster',
                  'integration.test_resolver',
                  'unit.test_gui_interface',
+                 'unit.test_emoticons',
                )
 
 nb_errors = 0
@@ -0,0 +1,83 @@
+'''
+Microbenchmark for feature lookups in the capabilities cache
+
+Checks that CacheItem.supports() gives the same results as the list
+membership test that was used before features were stored as bitsets.
+With GAJIM_BENCHMARK set, it also logs how long both take.
+'''
+import logging
+import random
+import unittest
+
+import lib
+lib.setup_env()
+
+from nbxmpp import NS_MUC, NS_PING, NS_XHTML_IM, NS_CHATSTATES, NS_RECEIPTS
+from gajim.common import caps_cache as caps
+
+from mock import Mock
+
+log = logging.getLogger('gajim.test.caps_benchmark')
+
+ROUNDS = 20000
+
+
+class TestFeatureLookupBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        # A client advertising a typical number of features, the
+        # interesting ones at the end of the list
+        self.features = ['urn:example:feature:%d' % i for i in range(40)]
+        self.features += [NS_CHATSTATES, NS_RECEIPTS, NS_XHTML_IM]
+        self.lookups = [NS_CHATSTATES, NS_RECEIPTS, NS_XHTML_IM, NS_MUC,
+                        NS_PING]
+
+        self.cc = caps.CapsCache(Mock())
+        self.item = self.cc[('sha-1', 'benchmark')]
+        self.item.features = self.features
+
+    def test_same_result(self):
+        for feature in self.lookups:
+            self.assertEqual(feature in self.features,
+                             self.item.supports(feature))
+
+    def test_same_result_random_features(self):
+        rand = random.Random(0)
+        namespaces = ['urn:example:random:%d' % i for i in range(100)]
+        namespaces += self.lookups
+        items = []
+        for i in range(50):
+            features = set(rand.sample(namespaces, rand.randint(0, 30)))
+            item = self.cc[('sha-1', 'random%d' % i)]
+            item.features = features
+            items.append((item, features))
+        unknown = ['urn:example:never-seen:%d' % i for i in range(5)]
+        for item, features in items:
+            self.assertEqual(set(item.features), features)
+            self.assertEqual(item.has_features(), bool(features))
+            for feature in namespaces + unknown:
+                self.assertEqual(item.supports(feature), feature in features,
+                                 feature)
+
+    @lib.benchmark
+    def test_benchmark(self):
+        features = list(self.features)
+        item = self.item
+        lookups = self.lookups
+
+        def list_path():
+            for feature in lookups:
+                feature in features
+
+        def bitset_path():
+            for feature in lookups:
+                item.supports(feature)
+
+        list_time = lib.best_time(list_path, number=ROUNDS)
+        bitset_time = lib.best_time(bitset_path, number=ROUNDS)
+        log.info('feature lookups (%d): list %.4fs, bitset %.4fs',
+                 ROUNDS * len(lookups), list_time, bitset_time)
+
+
+if __name__ == '__main__':
+    unittest.main()
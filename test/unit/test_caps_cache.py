@@ -26,20 +26,22 @@ class CommonCapsTest(unittest.TestCase):
         self.identities = [self.identity]
         self.features = [NS_MUC, NS_XHTML_IM] # NS_MUC not supported!
 
-        # Simulate a filled db
-        db_caps_cache = [
-                        (self.caps_method, self.caps_hash, self.identities, self.features),
-                        ('old', self.node + '#' + self.caps_hash, self.identities, self.features)]
-        self.logger = Mock(returnValues={"iter_caps_data":db_caps_cache})
+        # Simulate a filled db, every lookup finds the entry
+        db_caps_entry = (self.identities, self.features)
+        self.logger = Mock(returnValues={"get_caps_entry":db_caps_entry})
 
         self.cc = caps.CapsCache(self.logger)
         caps.capscache = self.cc
 
+        # Simulate an empty db
+        self.empty_cc = caps.CapsCache(Mock())
+
 
 class TestCapsCache(CommonCapsTest):
 
     def test_set_retrieve(self):
         ''' Test basic set / retrieve cycle '''
+        self.cc = self.empty_cc
 
         self.cc[self.client_caps].identities = self.identities
         self.cc[self.client_caps].features = self.features
@@ -57,21 +59,51 @@ class TestCapsCache(CommonCapsTest):
 
     def test_set_and_store(self):
         ''' Test client_caps update gets logged into db '''
+        logger = Mock()
+        self.cc = caps.CapsCache(logger)
 
         item = self.cc[self.client_caps]
         item.set_and_store(self.identities, self.features)
 
-        self.logger.mockCheckCall(0, "add_caps_entry", self.caps_method,
+        logger.mockCheckCall(0, "get_caps_entry", self.caps_method,
+                        self.caps_hash)
+        logger.mockCheckCall(1, "add_caps_entry", self.caps_method,
                         self.caps_hash, self.identities, self.features)
 
-    def test_initialize_from_db(self):
-        ''' Read cashed dummy data from db '''
-        self.assertEqual(self.cc[self.client_caps].status, caps.NEW)
-        self.cc.initialize_from_db()
+    def test_lazy_load_from_db(self):
+        ''' Read cashed dummy data from db on first lookup '''
+        self.assertEqual(0, len(self.logger.mockGetAllCalls()))
+        self.assertEqual(self.cc[self.client_caps].status, caps.CACHED)
+        self.logger.mockCheckCall(0, "get_caps_entry", self.caps_method,
+                        self.caps_hash)
+
+        # The second lookup is served from memory
         self.assertEqual(self.cc[self.client_caps].status, caps.CACHED)
+        self.assertEqual(1, len(self.logger.mockGetAllCalls()))
+
+    def test_unknown_in_db(self):
+        ''' Entries missing in the db are new '''
+        self.assertEqual(self.empty_cc[self.client_caps].status, caps.NEW)
+
+    def test_lru_bound(self):
+        ''' Only a bounded number of db backed entries stays in memory '''
+        self.cc = caps.CapsCache(self.logger, max_items=2)
+        for i in range(5):
+            self.assertEqual(self.cc[('sha-1', str(i))].status, caps.CACHED)
+        self.assertEqual(5, len(self.logger.mockGetAllCalls()))
+
+        # most recently used entries are still in memory
+        self.cc[('sha-1', '4')]
+        self.cc[('sha-1', '3')]
+        self.assertEqual(5, len(self.logger.mockGetAllCalls()))
+
+        # evicted entries are reloaded from the db
+        self.cc[('sha-1', '0')]
+        self.assertEqual(6, len(self.logger.mockGetAllCalls()))
 
     def test_preload_triggering_query(self):
         ''' Make sure that preload issues a disco '''
+        self.cc = self.empty_cc
         connection = Mock()
         client_caps = caps.ClientCaps(self.caps_hash, self.node, self.caps_method)
 
@@ -85,7 +117,6 @@ class TestCapsCache(CommonCapsTest):
         connection = Mock()
         client_caps = caps.ClientCaps(self.caps_hash, self.node, self.caps_method)
 
-        self.cc.initialize_from_db()
         self.cc.query_client_of_jid_if_unknown(connection, "test@gajim.org",
                         client_caps)
 
@@ -113,13 +144,14 @@ class TestClientCaps(CommonCapsTest):
                         "http://gajim.org#m3P2WeXPMGVH2tZPe7yITnfY0Dw=")
 
     def test_client_supports(self):
+        caps.capscache = self.empty_cc
         self.assertTrue(caps.client_supports(self.client_caps, NS_PING),
                         msg="Assume supported, if we don't have caps")
 
         self.assertFalse(caps.client_supports(self.client_caps, NS_XHTML_IM),
                 msg="Must not assume blacklisted feature is supported on default")
 
-        self.cc.initialize_from_db()
+        caps.capscache = self.cc
 
         self.assertFalse(caps.client_supports(self.client_caps, NS_PING),
                         msg="Must return false on unsupported feature")
@@ -0,0 +1,102 @@
+'''
+Test for the AccountPolicy cache of Config
+'''
+import random
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common.config import Config, get_words_regex
+
+
+def old_highlight(words, text):
+    # GroupchatControl.needs_visual_notification before the compiled regex
+    words = [word.lower() for word in words if word]
+    text = text.lower()
+    for word in words:
+        found_here = text.find(word)
+        while found_here > -1:
+            end_here = found_here + len(word)
+            if (found_here == 0 or not text[found_here - 1].isalpha()) and \
+            (end_here == len(text) or not text[end_here].isalpha()):
+                return True
+            found_here = text.find(word, found_here + 1)
+    return False
+
+
+class TestAccountPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Config()
+        self.config.add_per('accounts', 'acc1')
+
+    def test_should_log(self):
+        self.assertTrue(self.config.should_log('acc1', 'a@x'))
+        self.config.set_per('accounts', 'acc1', 'no_log_for', 'a@x b@x')
+        self.assertFalse(self.config.should_log('acc1', 'a@x'))
+        self.assertTrue(self.config.should_log('acc1', 'c@x'))
+        self.config.set_per('accounts', 'acc1', 'no_log_for', 'acc1')
+        self.assertFalse(self.config.should_log('acc1', 'c@x'))
+
+    def test_policy_is_cached(self):
+        policy = self.config.get_policy('acc1')
+        self.assertIs(self.config.get_policy('acc1'), policy)
+        # options the policy is not made of keep it
+        self.config.set_per('accounts', 'acc1', 'roster_version', '42')
+        self.config.set('roster_width', 300)
+        self.assertIs(self.config.get_policy('acc1'), policy)
+
+    def test_invalidation(self):
+        policy = self.config.get_policy('acc1')
+        self.config.set('muc_highlight_words', 'Foo;bar')
+        policy = self.config.get_policy('acc1')
+        self.assertEqual(policy.highlight_words, ('foo', 'bar'))
+
+        self.assertIn('first_message_received', policy.enabled_sound_events)
+        self.config.set_per('soundevents', 'first_message_received',
+            'enabled', False)
+        policy = self.config.get_policy('acc1')
+        self.assertNotIn('first_message_received',
+            policy.enabled_sound_events)
+        # like get_per(), events without an entry are not enabled
+        self.assertNotIn('plugin_event', policy.enabled_sound_events)
+        self.config.add_per('soundevents', 'plugin_event')
+        self.config.set_per('soundevents', 'plugin_event', 'enabled', True)
+        policy = self.config.get_policy('acc1')
+        self.assertIn('plugin_event', policy.enabled_sound_events)
+
+        self.config.set('autopopupaway', True)
+        self.assertTrue(self.config.get_policy('acc1').autopopupaway)
+
+        self.config.del_per('accounts', 'acc1')
+        self.config.add_per('accounts', 'acc1')
+        self.assertIsNot(self.config.get_policy('acc1'), policy)
+
+    def test_change_listener(self):
+        changes = []
+        listener = lambda *change: changes.append(change)
+        self.config.subscribe_changes(listener)
+        self.config.set('roster_width', 300)
+        self.config.set_per('accounts', 'acc1', 'no_log_for', 'a@x')
+        self.config.del_per('accounts', 'acc1')
+        self.config.unsubscribe_changes(listener)
+        self.config.set('roster_width', 200)
+        self.assertEqual(changes, [('roster_width', None, None),
+            ('accounts', 'acc1', 'no_log_for'), ('accounts', 'acc1', None)])
+
+    def test_highlight_regex(self):
+        rand = random.Random(0)
+        alphabet = 'abcAB .,:@1_-é'
+        for _i in range(2000):
+            words = tuple(''.join(rand.choice(alphabet) for _j in range(
+                rand.randint(0, 3))) for _k in range(rand.randint(0, 3)))
+            text = ''.join(rand.choice(alphabet) for _j in range(
+                rand.randint(0, 20)))
+            regex = get_words_regex(tuple(word.lower() for word in words))
+            found = bool(regex and regex.search(text.lower()))
+            self.assertEqual(found, old_highlight(words, text), (words, text))
+
+
+if __name__ == '__main__':
+    unittest.main()
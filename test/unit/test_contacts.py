@@ -10,6 +10,7 @@ from gajim.common.contacts import CommonContact, Contact, GC_Contact, LegacyCont
 from nbxmpp import NS_MUC
 
 from gajim.common import caps_cache
+from gajim.common import app
 
 class TestCommonContact(unittest.TestCase):
 
@@ -125,5 +126,126 @@ class TestContacts(unittest.TestCase):
         self.assertEqual(0, len(self.contacts.get_contacts_from_group(account, '')))
 
 
+class TestContactCounters(unittest.TestCase):
+    '''
+    The group index and the online counters must give the same results as
+    scanning all contacts
+    '''
+
+    def setUp(self):
+        self.contacts = LegacyContactsAPI()
+        self.accounts = ['acc1', 'acc2']
+        for account in self.accounts:
+            app.config.add_per('accounts', account)
+            app.config.set_per('accounts', account, 'name', 'me')
+            app.config.set_per('accounts', account, 'hostname', account)
+            self.contacts.add_account(account)
+        self.gc_connected = app.gc_connected
+        app.gc_connected = {'acc1': {'room@conf.acc1': True}}
+
+    def tearDown(self):
+        for account in self.accounts:
+            app.config.del_per('accounts', account)
+        app.gc_connected = self.gc_connected
+
+    def _add(self, account, jid, show='online', groups=None, resource='',
+    **kwargs):
+        contact = self.contacts.create_contact(jid=jid, account=account,
+            show=show, groups=groups or [], resource=resource, **kwargs)
+        self.contacts.add_contact(account, contact)
+        return contact
+
+    def assert_counters(self):
+        groups = set()
+        for account in self.accounts:
+            for contact in self.contacts.iter_contacts(account):
+                groups.update(contact.get_shown_groups())
+                groups.update(contact.groups)
+        queries = [None, []] + [[group] for group in groups]
+        for accounts in ([], ['acc1'], ['acc2']):
+            for query in queries:
+                slow = self.contacts._get_nb_online_total_contacts_slow(
+                    accounts or self.contacts.get_accounts(), query or [])
+                fast = self.contacts.get_nb_online_total_contacts(
+                    accounts=accounts, groups=query)
+                self.assertEqual(slow, fast, msg='%s %s' % (accounts, query))
+        for account in self.accounts:
+            for group in groups:
+                slow = [c for jid in self.contacts.get_jid_list(account)
+                        for c in self.contacts.get_contacts(account, jid)
+                        if group in self.contacts.get_contacts(
+                            account, jid)[0].groups]
+                fast = self.contacts.get_contacts_from_group(account, group)
+                self.assertCountEqual(slow, fast)
+
+    def test_counters(self):
+        self._add('acc1', 'a@x', groups=['Friends', 'Work'], sub='both')
+        self._add('acc1', 'b@x', show='offline', groups=['Friends'],
+            sub='both')
+        self._add('acc1', 'c@x', show='away', sub='both')
+        self._add('acc1', 'transport.x', sub='both')
+        self._add('acc1', 'me@acc1', groups=['self_contact'], sub='both')
+        self._add('acc1', 'room@conf.acc1', groups=['Friends'])
+        self._add('acc1', 'stranger@x', groups=['Not in roster'])
+        self._add('acc1', 'observer@x', sub='from')
+        self._add('acc2', 'a@x', groups=['Friends'], sub='both')
+        self._add('acc2', 'd@x', show='dnd', groups=['Work'], sub='to')
+        self.assert_counters()
+
+        # resources
+        self._add('acc1', 'b@x', show='online', groups=['Friends'],
+            resource='home', sub='both')
+        self._add('acc1', 'a@x', show='xa', groups=['Friends', 'Work'],
+            resource='phone', sub='both')
+        self.assert_counters()
+
+        # status, groups and subscription changes
+        contact = self.contacts.get_first_contact_from_jid('acc1', 'c@x')
+        contact.show = 'offline'
+        contact.groups = ['Work']
+        self.assert_counters()
+        contact = self.contacts.get_first_contact_from_jid('acc1',
+            'observer@x')
+        contact.sub = 'both'
+        self.assert_counters()
+
+        # metacontacts
+        self.contacts.define_metacontacts('acc1', {'tag': [
+            {'jid': 'a@x', 'tag': 'tag', 'order': 1}]})
+        self.contacts.define_metacontacts('acc2', {'tag': [
+            {'jid': 'a@x', 'tag': 'tag', 'order': 2},
+            {'jid': 'd@x', 'tag': 'tag'}]})
+        self.assert_counters()
+
+        # removal
+        for contact in self.contacts.get_contacts('acc1', 'b@x')[:]:
+            self.contacts.remove_contact('acc1', contact)
+        self.contacts.remove_jid('acc2', 'd@x', remove_meta=False)
+        self.contacts.change_contact_jid('a@x', 'e@x', 'acc1')
+        self.assert_counters()
+
+    def test_rooms_joined_and_closed(self):
+        self._add('acc1', 'a@x', groups=['Friends'], sub='both')
+        self._add('acc1', 'room@conf.acc1', groups=['Friends'])
+        self._add('acc1', 'other@conf.acc1', groups=['Friends'])
+        self.assert_counters()
+        # Contacts is not told when app.gc_connected changes
+        app.gc_connected['acc1']['other@conf.acc1'] = True
+        self.assert_counters()
+        del app.gc_connected['acc1']['room@conf.acc1']
+        del app.gc_connected['acc1']['other@conf.acc1']
+        self.assert_counters()
+
+    def test_groups_are_copied(self):
+        groups = ['Friends']
+        contact = self._add('acc1', 'a@x', sub='both')
+        contact.groups = groups
+        groups.append('Work')
+        self.assertEqual(contact.groups, ['Friends'])
+        self.assertEqual(self.contacts.get_contacts_from_group('acc1',
+            'Work'), [])
+        self.assert_counters()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+'''
+Test for the lazy loading of emoticons themes
+
+With GAJIM_BENCHMARK set, also compares the time to load the noto theme
+with the time it takes when all pixbufs are cut and the whole popover is
+built, as it was at startup.
+'''
+import logging
+import os
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common import app
+from gajim import emoticons
+
+log = logging.getLogger('gajim.test.emoticons')
+
+THEME = 'noto-emoticons'
+
+
+class TestEmoticons(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(app.DATA_DIR, 'emoticons', THEME)
+        self.assertTrue(emoticons.load(self.path, True))
+
+    def test_pixbufs_cut_on_first_use(self):
+        self.assertEqual(emoticons.pixbufs, {})
+        pixbuf = emoticons.get_pixbuf(':-)')
+        self.assertIsNotNone(pixbuf)
+        self.assertIs(emoticons.get_pixbuf(':)'), pixbuf)
+        self.assertEqual(emoticons.get_codepoint(pixbuf), '☺')
+        self.assertIsNone(emoticons.get_pixbuf('no emoticon'))
+
+    def test_ascii_emoticons(self):
+        self.assertTrue(emoticons.load(self.path, False))
+        self.assertIsNone(emoticons.get_pixbuf(':-)'))
+        self.assertIsNotNone(emoticons.get_pixbuf('☺'))
+
+    def test_popover_populated_on_show(self):
+        self.assertIsNone(emoticons.popover_instance)
+        popover = emoticons.get_popover()
+        self.assertIs(emoticons.get_popover(), popover)
+        pages = popover.notebook.get_n_pages()
+        self.assertEqual(len(popover._unpopulated), pages)
+        popover.on_show(popover)
+        self.assertEqual(len(popover._unpopulated), pages - 1)
+        popover.notebook.set_current_page(1)
+        self.assertEqual(len(popover._unpopulated), pages - 2)
+
+    @lib.benchmark
+    def test_benchmark(self):
+        def _load():
+            emoticons.load(self.path, True)
+
+        def _load_all():
+            emoticons.load(self.path, True)
+            for index in range(emoticons.sub_pixbuf.count):
+                emoticons.sub_pixbuf.get_pixbuf(index)
+            popover = emoticons.get_popover()
+            for page in range(popover.notebook.get_n_pages()):
+                popover.populate(popover.notebook.get_nth_page(page))
+
+        lazy = lib.best_time(_load)
+        eager = lib.best_time(_load_all)
+        log.info('emoticons theme %s (%d emoticons): lazy load %.1fms, '
+            'everything loaded %.1fms', THEME, emoticons.sub_pixbuf.count,
+            lazy * 1000, eager * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+'''
+Test for the emoticons module when no image theme is loaded
+
+Needs no display: font themes and disabled emoticons create no pixbuf.
+'''
+import os
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common import app
+from gajim import emoticons
+
+
+class TestFontEmoticons(unittest.TestCase):
+
+    def test_disabled(self):
+        with self.assertLogs('gajim.emoticons', 'ERROR'):
+            self.assertIsNone(emoticons.load(os.path.join(
+                app.DATA_DIR, 'emoticons', 'no-such-theme'), True))
+        self.assertIsNone(emoticons.sub_pixbuf)
+        self.assertIsNone(emoticons.get_pixbuf(':-)'))
+        self.assertIsNone(emoticons.get_pixbuf('http://example.org'))
+        self.assertIsNone(emoticons.get_codepoint(None))
+
+    def test_font_theme(self):
+        self.assertTrue(emoticons.load(
+            os.path.join(app.DATA_DIR, 'emoticons', 'font-emoticons'), True))
+        self.assertIsNone(emoticons.sub_pixbuf)
+        self.assertIsNone(emoticons.get_pixbuf(':-)'))
+        self.assertIsNone(emoticons.get_pixbuf('*bold*'))
+        self.assertEqual(emoticons.pixbufs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
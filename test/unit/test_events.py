@@ -0,0 +1,236 @@
+'''
+Test for the indexed Events store, against the scanning implementation
+'''
+import random
+import time
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common.events import Events, Event
+
+
+class ReferenceEvents:
+    """
+    The Events store as it was before it kept counters and heaps: every
+    query walks all events
+    """
+
+    def __init__(self):
+        self._events = {}
+
+    def change_account_name(self, old_name, new_name):
+        if old_name in self._events:
+            self._events[new_name] = self._events[old_name]
+            del self._events[old_name]
+
+    def add_account(self, account):
+        self._events[account] = {}
+
+    def remove_account(self, account):
+        del self._events[account]
+
+    def add_event(self, account, jid, event):
+        self._events.setdefault(account, {}).setdefault(jid, []).append(event)
+
+    def remove_events(self, account, jid, event=None, types=None):
+        if account not in self._events:
+            return True
+        if jid not in self._events[account]:
+            return True
+        if event:
+            if event not in self._events[account][jid]:
+                return True
+            self._events[account][jid].remove(event)
+            if not self._events[account][jid]:
+                del self._events[account][jid]
+            return
+        if types:
+            new_list = [ev for ev in self._events[account][jid]
+                if ev.type_ not in types]
+            if len(new_list) == len(self._events[account][jid]):
+                return True
+            if new_list:
+                self._events[account][jid] = new_list
+            else:
+                del self._events[account][jid]
+            return
+        del self._events[account][jid]
+
+    def change_jid(self, account, old_jid, new_jid):
+        if account not in self._events:
+            return
+        if old_jid not in self._events[account]:
+            return
+        self._events[account].setdefault(new_jid, [])
+        self._events[account][new_jid] += self._events[account].pop(old_jid)
+
+    def get_events(self, account, jid=None, types=None):
+        types = types or []
+        if account not in self._events:
+            return []
+        if not jid:
+            events_list = {}
+            for jid_, events in self._events[account].items():
+                events = [ev for ev in events if not types or ev.type_ in types]
+                if events:
+                    events_list[jid_] = events
+            return events_list
+        return [ev for ev in self._events[account].get(jid, [])
+            if not types or ev.type_ in types]
+
+    def _get_nb_events(self, account=None, jid=None, attribute=None,
+    types=None):
+        types = types or []
+        nb = 0
+        accounts = [account] if account else self._events.keys()
+        for acct in accounts:
+            if acct not in self._events:
+                continue
+            jids = [jid] if jid else self._events[acct].keys()
+            for j in jids:
+                for event in self._events[acct].get(j, []):
+                    if types and event.type_ not in types:
+                        continue
+                    if not attribute or \
+                    attribute == 'systray' and event.show_in_systray or \
+                    attribute == 'roster' and event.show_in_roster:
+                        nb += 1
+        return nb
+
+    def _get_some_events(self, attribute):
+        events = {}
+        for account in self._events:
+            for jid in self._events[account]:
+                for event in self._events[account][jid]:
+                    if getattr(event, 'show_in_' + attribute):
+                        events.setdefault(account, {}).setdefault(jid,
+                            []).append(event)
+        return events
+
+    def _get_first(self, events):
+        first = (None, None, None)
+        first_event_time = time.time() + 1
+        for account in events:
+            for jid in events[account]:
+                for event in events[account][jid]:
+                    if event.time_ < first_event_time:
+                        first_event_time = event.time_
+                        first = (account, jid, event)
+        return first
+
+    def get_first_event(self):
+        return self._get_first(self._events)
+
+    def get_first_systray_event(self):
+        return self._get_first(self._get_some_events('systray'))
+
+
+ACCOUNTS = ['acc1', 'acc2', 'acc3']
+JIDS = ['a@x', 'b@x', 'c@x', 'd@x', 'e@x']
+TYPES = ['chat', 'normal', 'pm', 'gc-invitation', 'file-error']
+
+
+class TestIndexedEvents(unittest.TestCase):
+
+    def _new_event(self, rand):
+        event = Event(time_=self.now - rand.random() * 1000,
+            show_in_roster=rand.random() < 0.5,
+            show_in_systray=rand.random() < 0.7)
+        # type_ is a class attribute of the Event subclasses
+        event.type_ = rand.choice(TYPES)
+        return event
+
+    def _random_operation(self, rand, events, reference):
+        queued = [(account, jid, event)
+            for account, jids in reference._events.items()
+            for jid, events_ in jids.items() for event in events_]
+        operation = rand.random()
+        account = rand.choice(ACCOUNTS)
+        jid = rand.choice(JIDS)
+        if operation < 0.5:
+            event = self._new_event(rand)
+            events.add_event(account, jid, event)
+            reference.add_event(account, jid, event)
+        elif operation < 0.65 and queued:
+            account, jid, event = rand.choice(queued)
+            self.assertEqual(events.remove_events(account, jid, event),
+                reference.remove_events(account, jid, event))
+        elif operation < 0.75:
+            types = rand.sample(TYPES, rand.randint(1, 2))
+            self.assertEqual(events.remove_events(account, jid, types=types),
+                reference.remove_events(account, jid, types=types))
+        elif operation < 0.8:
+            self.assertEqual(events.remove_events(account, jid),
+                reference.remove_events(account, jid))
+        elif operation < 0.9:
+            new_jid = rand.choice(JIDS)
+            if new_jid != jid:
+                events.change_jid(account, jid, new_jid)
+                reference.change_jid(account, jid, new_jid)
+        elif operation < 0.94:
+            new_account = rand.choice(ACCOUNTS)
+            if new_account != account:
+                events.change_account_name(account, new_account)
+                reference.change_account_name(account, new_account)
+        elif operation < 0.97:
+            events.add_account(account)
+            reference.add_account(account)
+        elif account in reference._events:
+            events.remove_account(account)
+            reference.remove_account(account)
+
+    def _check_queries(self, rand, events, reference):
+        for account in [None] + ACCOUNTS:
+            for jid in [None] + JIDS:
+                types = rand.sample(TYPES, rand.randint(0, 3))
+                self.assertEqual(
+                    events.get_nb_roster_events(account, jid, types),
+                    reference._get_nb_events(account, jid, 'roster', types))
+            types = rand.sample(TYPES, rand.randint(0, 3))
+            self.assertEqual(events.get_nb_events(types, account),
+                reference._get_nb_events(account, types=types))
+            if account:
+                self.assertEqual(events.get_events(account, types=types),
+                    reference.get_events(account, types=types))
+        types = rand.sample(TYPES, rand.randint(0, 3))
+        self.assertEqual(events.get_nb_systray_events(types),
+            reference._get_nb_events(attribute='systray', types=types))
+        self.assertEqual(events.get_systray_events(),
+            reference._get_some_events('systray'))
+        self.assertEqual(events.get_roster_events(),
+            reference._get_some_events('roster'))
+        self.assertEqual(events.get_first_event(), reference.get_first_event())
+        self.assertEqual(events.get_first_systray_event(),
+            reference.get_first_systray_event())
+
+    def test_random_operations(self):
+        self.now = time.time()
+        for seed in range(20):
+            rand = random.Random(seed)
+            events = Events()
+            reference = ReferenceEvents()
+            for _i in range(300):
+                self._random_operation(rand, events, reference)
+                self._check_queries(rand, events, reference)
+
+    def test_removed_events_are_dropped_from_heaps(self):
+        events = Events()
+        first = Event(time_=1)
+        first.type_ = 'chat'
+        events.add_event('acc1', 'a@x', first)
+        for i in range(1000):
+            event = Event(time_=2 + i)
+            event.type_ = 'chat'
+            events.add_event('acc1', 'b@x', event)
+            events.remove_events('acc1', 'b@x', event)
+        self.assertLess(len(events._heaps[None]), 100)
+        self.assertEqual(events.get_first_event(), ('acc1', 'a@x', first))
+        events.remove_events('acc1', 'a@x')
+        self.assertEqual(events.get_first_event(), (None, None, None))
+        self.assertEqual(events.get_nb_events(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+'''
+Tests for the GlobalEventsDispatcher
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common import ged
+
+
+class Conn(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Event(object):
+    def __init__(self, account, jid, room_jid=None):
+        self.conn = Conn(account)
+        self.jid = jid
+        if room_jid:
+            self.room_jid = room_jid
+
+
+class TestGlobalEventsDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.ged = ged.GlobalEventsDispatcher()
+        self.calls = []
+
+    def _handler(self, name, result=None):
+        def handler(obj):
+            self.calls.append(name)
+            return result
+        handler.__qualname__ = name
+        return handler
+
+    def test_priority_order(self):
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('gui1'))
+        self.ged.register_event_handler('ev', ged.CORE, self._handler('core'),
+            account='acc1')
+        self.ged.register_event_handler('ev', ged.PRECORE,
+            self._handler('precore'))
+        self.ged.register_event_handler('ev', ged.POSTCORE,
+            self._handler('postcore'), account='acc1', jid='room@conf')
+        self.ged.raise_event('ev', Event('acc1', 'room@conf/nick',
+            room_jid='room@conf'))
+        self.assertEqual(self.calls, ['precore', 'core', 'postcore', 'gui1'])
+
+    def test_filtered_routing(self):
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('all'))
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('acc1'),
+            account='acc1')
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('acc2'),
+            account='acc2')
+        self.ged.register_event_handler('ev', ged.GUI1,
+            self._handler('room1'), account='acc1', jid='room1@conf')
+        self.ged.register_event_handler('ev', ged.GUI1,
+            self._handler('room2'), account='acc1', jid='room2@conf')
+        self.ged.register_event_handler('ev', ged.GUI1,
+            self._handler('contact'), jid='user@server')
+
+        self.ged.raise_event('ev', Event('acc1', 'room1@conf',
+            room_jid='room1@conf'))
+        self.assertEqual(self.calls, ['all', 'acc1', 'room1'])
+
+        self.calls = []
+        self.ged.raise_event('ev', Event('acc2', 'user@server/res'))
+        self.assertEqual(self.calls, ['all', 'acc2', 'contact'])
+
+    def test_stop_propagation(self):
+        self.ged.register_event_handler('ev', ged.CORE,
+            self._handler('core', True), account='acc1')
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('gui1'))
+        self.assertTrue(self.ged.raise_event('ev', Event('acc1', 'a@b')))
+        self.assertEqual(self.calls, ['core'])
+
+    def test_remove(self):
+        handler = self._handler('acc1')
+        self.ged.register_event_handler('ev', ged.GUI1, handler,
+            account='acc1')
+        # removing without the filter does not touch the filtered handler
+        self.ged.remove_event_handler('ev', ged.GUI1, handler)
+        self.ged.raise_event('ev', Event('acc1', 'a@b'))
+        self.assertEqual(self.calls, ['acc1'])
+
+        self.ged.remove_event_handler('ev', ged.GUI1, handler,
+            account='acc1')
+        self.ged.raise_event('ev', Event('acc1', 'a@b'))
+        self.assertEqual(self.calls, ['acc1'])
+        self.assertFalse(self.ged.filtered_handlers)
+
+    def test_change_account_name(self):
+        handler = self._handler('acc1')
+        self.ged.register_event_handler('ev', ged.GUI1, handler,
+            account='acc1', jid='room@conf')
+        self.ged.change_account_name('acc1', 'new')
+        self.ged.raise_event('ev', Event('acc1', 'room@conf'))
+        self.assertEqual(self.calls, [])
+        self.ged.raise_event('ev', Event('new', 'room@conf'))
+        self.assertEqual(self.calls, ['acc1'])
+        self.ged.remove_event_handler('ev', ged.GUI1, handler,
+            account='new', jid='room@conf')
+        self.assertFalse(self.ged.filtered_handlers)
+
+    def test_profiling(self):
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('a'))
+        self.ged.register_event_handler('ev', ged.GUI2, self._handler('b'))
+        self.ged.raise_event('ev', Event('acc1', 'a@b'))
+        self.assertIsNone(self.ged.profiler)
+
+        self.ged.enable_profiling(threshold=1000)
+        for i in range(3):
+            self.ged.raise_event('ev', Event('acc1', 'a@b'))
+        stats = self.ged.profiler.get_stats()
+        self.assertEqual(len(stats), 3)
+        counts = {(stat['kind'], stat['event'], stat['name']): stat['count']
+                  for stat in stats}
+        self.assertEqual(counts, {('handler', 'ev', 'a'): 3,
+                                  ('handler', 'ev', 'b'): 3,
+                                  ('dispatch', 'ev', ''): 3})
+        for stat in stats:
+            self.assertEqual(stat['slow'], 0)
+            self.assertLessEqual(stat['p50'], stat['max'])
+        self.assertEqual(len(self.ged.profiler.get_report().splitlines()), 4)
+
+        self.ged.profiler.reset()
+        self.assertEqual(self.ged.profiler.get_stats(), [])
+        self.ged.disable_profiling()
+        self.assertIsNone(self.ged.profiler)
+
+    def test_slow_handler(self):
+        self.ged.enable_profiling(threshold=0)
+        self.ged.register_event_handler('ev', ged.GUI1, self._handler('a'))
+        self.ged.raise_event('ev', Event('acc1', 'a@b'))
+        slow = [stat['slow'] for stat in self.ged.profiler.get_stats()
+                if stat['kind'] == 'handler']
+        self.assertEqual(slow, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
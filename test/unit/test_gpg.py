@@ -0,0 +1,117 @@
+'''
+Test for the decryption of GnuPG in the worker threads
+
+gpg itself is replaced, each ciphertext "enc:<text>" decrypts to <text>.
+'''
+import threading
+import unittest
+
+import lib
+lib.setup_env()
+
+from gi.repository import GLib
+
+from gajim.common import app
+if app.HAVE_GPG:
+    import gnupg
+    from gajim.common import gpg
+
+
+class DecryptResult:
+    def __init__(self, data):
+        self.ok = data.startswith('enc:')
+        self.data = data[4:] if self.ok else ''
+
+    def __str__(self):
+        return self.data
+
+
+@unittest.skipUnless(app.HAVE_GPG, 'python-gnupg is not installed')
+class TestGnuPGDecrypt(unittest.TestCase):
+
+    def setUp(self):
+        self.old_init = gnupg.GPG.__init__
+        self.old_decrypt = gnupg.GPG.decrypt
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+        def _init(gpg_, *args, **kwargs):
+            pass
+
+        def _decrypt(gpg_, data, passphrase=None):
+            data = gpg_._stripHeaderFooter(data.decode('utf8'))
+            with self.calls_lock:
+                self.calls.append(data)
+            return DecryptResult(data)
+
+        gnupg.GPG.__init__ = _init
+        gnupg.GPG.decrypt = _decrypt
+        self.gpg = gpg.GnuPG()
+
+    def tearDown(self):
+        gnupg.GPG.__init__ = self.old_init
+        gnupg.GPG.decrypt = self.old_decrypt
+
+    def _run(self, func, *args):
+        results = []
+        loop = GLib.MainLoop()
+
+        def _on_result(result):
+            results.append(result)
+            loop.quit()
+
+        func(*(args + (_on_result,)))
+        timeout_id = GLib.timeout_add_seconds(5, loop.quit)
+        loop.run()
+        GLib.source_remove(timeout_id)
+        self.assertEqual(len(results), 1, 'no result delivered')
+        return results[0]
+
+    def test_decrypt_batch(self):
+        messages = ['enc:m%d' % i for i in range(10)]
+        messages[3] = messages[7] = 'enc:duplicate'
+        messages[5] = 'not encrypted'
+        decrypted = self._run(self.gpg.decrypt_batch, messages, None)
+        expected = [message[4:] if message.startswith('enc:') else ''
+            for message in messages]
+        self.assertEqual(decrypted, expected)
+        # each distinct ciphertext runs gpg once
+        self.assertEqual(sorted(self.calls), sorted(set(messages)))
+
+        # decrypted messages are cached, failed ones are tried again
+        del self.calls[:]
+        self.assertEqual(self._run(self.gpg.decrypt_batch, messages, None),
+            expected)
+        self.assertEqual(self.calls, ['not encrypted'])
+
+        self.assertEqual(self.gpg.get_timings()['decrypt'][0],
+            len(set(messages)) + 1)
+        self.assertEqual(self.gpg.get_timings()['decrypt_batch'][0], 2)
+
+    def test_decrypt_batch_all_cached(self):
+        self.assertEqual(self.gpg.decrypt('enc:cached', None), 'cached')
+        del self.calls[:]
+        self.assertEqual(self._run(self.gpg.decrypt_batch,
+            ['enc:cached', 'enc:cached'], None), ['cached', 'cached'])
+        self.assertEqual(self.calls, [])
+
+    def test_decrypt_async(self):
+        self.assertEqual(self._run(self.gpg.decrypt_async, 'enc:hello', None),
+            'hello')
+        self.assertEqual(self._run(self.gpg.decrypt_async, 'enc:hello', None),
+            'hello')
+        self.assertEqual(self.calls, ['enc:hello'])
+        self.assertEqual(self._run(self.gpg.decrypt_async, 'broken', None), '')
+
+    def test_cache_size(self):
+        for i in range(gpg.DECRYPT_CACHE_SIZE + 1):
+            self.gpg.decrypt('enc:m%d' % i, None)
+        del self.calls[:]
+        # the oldest message was dropped from the cache
+        self.gpg.decrypt('enc:m1', None)
+        self.gpg.decrypt('enc:m0', None)
+        self.assertEqual(self.calls, ['enc:m0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
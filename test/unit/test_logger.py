@@ -0,0 +1,140 @@
+'''
+Tests for the Logger
+'''
+import io
+import os
+import time
+import unittest
+from contextlib import redirect_stdout
+
+import lib
+lib.setup_env()
+
+from gajim.common import app
+from gajim.common import check_paths
+from gajim.common import logger
+from gajim.common.logger import KindConstant
+
+DAY = 86400
+
+
+class LoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        for path in (logger.LOG_DB_PATH, logger.CACHE_DB_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+        with redirect_stdout(io.StringIO()):
+            check_paths.create_log_db()
+            check_paths.create_cache_db()
+        self.logger = logger.Logger()
+
+    def tearDown(self):
+        self.logger.close_db()
+        for year in logger.get_archive_years(logger.LOG_DB_FOLDER):
+            os.remove(os.path.join(logger.LOG_DB_FOLDER,
+                                   'logs-archive-%d.db' % year))
+
+    def insert(self, jid, time_, **kwargs):
+        self.logger.insert_into_logs('account', jid, time_,
+                                     KindConstant.CHAT_MSG_RECV,
+                                     unread=False, **kwargs)
+
+    def archive(self, before, compress_before=None, retention=()):
+        self.logger.flush()
+        maintenance = logger.LogMaintenance(
+            logger.LOG_DB_PATH, list(retention), before, compress_before,
+            lambda years: None, pause=0)
+        maintenance.run()
+        # reopen the database to attach the new archives
+        self.logger.init_vars()
+
+
+class TestCleanCaps(LoggerTest):
+
+    def test_clean_nothing(self):
+        # nothing is old enough, the step must not keep the write lock
+        self.assertFalse(self.logger._clean_caps_step())
+        self.assertFalse(self.logger.con.in_transaction)
+
+        self.logger._writer._max_latency = 0
+        self.logger.insert_into_logs(
+            'account', 'a@example.org', int(time.time()),
+            KindConstant.CHAT_MSG_RECV, message='hello')
+        start = time.monotonic()
+        self.logger.flush()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(self.logger.con.execute(
+            'SELECT message FROM logs').fetchall()[0].message, 'hello')
+
+
+class TestSearchArchives(LoggerTest):
+
+    def test_search_terms(self):
+        old = int(time.time()) - 400 * DAY
+        for message in ('good morning, see you', 'morning good',
+                        'hello world', 'bye'):
+            self.insert('a@example.org', old, message=message)
+        self.archive(old + DAY)
+        self.assertTrue(self.logger._archives)
+        now = int(time.time())
+        for message in ('good morning everyone', 'worldwide'):
+            self.insert('a@example.org', now, message=message)
+        self.logger.flush()
+
+        def search(query):
+            return [line.message for line in self.logger.search_log(
+                'account', 'a@example.org', query)]
+
+        self.assertTrue(self.logger._fts_enabled)
+        self.assertEqual(search('"good morning"'),
+                         ['good morning, see you', 'good morning everyone'])
+        self.assertEqual(search('wor*'), ['hello world', 'worldwide'])
+        self.assertEqual(search('world hello'), ['hello world'])
+        self.assertEqual(search('good morn*'),
+                         ['good morning, see you', 'morning good',
+                          'good morning everyone'])
+
+        # without the index the query is searched for as is
+        self.logger._fts_enabled = False
+        self.assertEqual(search('morning good'), ['morning good'])
+
+
+class TestFindStanzaId(LoggerTest):
+
+    def test_moved_lines(self):
+        now = int(time.time())
+        for i in range(logger.LOG_BLOCK_LINES):
+            self.insert('a@example.org', now - 100 * DAY + i,
+                        stanza_id='compressed-%d' % i)
+        self.insert('b@example.org', now - 400 * DAY, stanza_id='archived')
+        self.insert('b@example.org', now, stanza_id='recent')
+        self.archive(now - 200 * DAY, now - 50 * DAY)
+        self.assertEqual(self.logger.get_cold_storage_stats()[:2],
+                         (1, logger.LOG_BLOCK_LINES))
+        self.assertEqual(self.logger.con.execute(
+            'SELECT COUNT(*) AS count FROM logs').fetchone().count, 1)
+
+        own_jid = app.get_jid_from_account('account')
+        for stanza_id in ('compressed-0', 'compressed-199', 'archived',
+                          'recent'):
+            self.logger._recent_ids.clear()
+            self.assertTrue(self.logger.find_stanza_id(own_jid, stanza_id))
+        self.assertFalse(self.logger.find_stanza_id(own_jid, 'unknown'))
+        # the archive of a groupchat is looked up by its jid
+        self.logger._recent_ids.clear()
+        self.assertTrue(self.logger.find_stanza_id(
+            'b@example.org', 'archived', groupchat=True))
+        self.assertFalse(self.logger.find_stanza_id(
+            'b@example.org', 'compressed-0', groupchat=True))
+
+        # the ids go with the lines when they expire
+        account_id = self.logger.get_account_id('account')
+        self.archive(None, retention=[(account_id, False, now - DAY)])
+        for stanza_id in ('compressed-0', 'archived'):
+            self.assertFalse(self.logger.find_stanza_id(own_jid, stanza_id))
+        self.assertTrue(self.logger.find_stanza_id(own_jid, 'recent'))
+
+
+if __name__ == '__main__':
+    unittest.main()
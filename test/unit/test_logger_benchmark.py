@@ -0,0 +1,138 @@
+'''
+Microbenchmarks for the Logger
+
+Compares Logger.namedtuple_factory against the factory that created a
+new namedtuple class and decoded additional_data for every row, and
+measures the size and read latency of compressed blocks of history.
+The measures are logged when GAJIM_BENCHMARK is set.
+'''
+import logging
+import unittest
+import json
+import sqlite3 as sqlite
+from collections import namedtuple
+
+import lib
+lib.setup_env()
+
+from gajim.common.logger import Logger, LOG_BLOCK_LINES
+from gajim.common.logger import compress_block, decompress_block
+
+log = logging.getLogger('gajim.test.logger_benchmark')
+
+ROWS = 5000
+
+
+def old_namedtuple_factory(cursor, row):
+    fields = [col[0] for col in cursor.description]
+    Row = namedtuple("Row", fields)
+    named_row = Row(*row)
+    if 'additional_data' in fields:
+        named_row = named_row._replace(
+            additional_data=json.loads(named_row.additional_data or '{}'))
+    return named_row
+
+
+class TestRowFactoryBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.con = sqlite.connect(':memory:')
+        self.con.execute('''
+            CREATE TABLE logs (
+                log_line_id INTEGER PRIMARY KEY,
+                time INTEGER, kind INTEGER, message TEXT, subject TEXT,
+                additional_data TEXT)''')
+        data = json.dumps({'gajim': {'oob_url': 'https://example.org/a'}})
+        self.con.executemany(
+            'INSERT INTO logs (time, kind, message, subject, additional_data) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(i, 4, 'message %d' % i, None, data if i % 2 else None)
+             for i in range(ROWS)])
+
+    def tearDown(self):
+        self.con.close()
+
+    def _fetch(self, factory, sql='SELECT * FROM logs'):
+        self.con.row_factory = factory
+        return self.con.execute(sql).fetchall()
+
+    def test_same_result(self):
+        for sql in ('SELECT * FROM logs', 'SELECT time, message FROM logs'):
+            old_rows = self._fetch(old_namedtuple_factory, sql)
+            new_rows = self._fetch(Logger.namedtuple_factory, sql)
+            self.assertEqual(len(old_rows), len(new_rows))
+            for old, new in zip(old_rows, new_rows):
+                self.assertEqual(old._fields, new._fields)
+                for field in old._fields:
+                    self.assertEqual(getattr(old, field), getattr(new, field))
+                for i in range(-len(old), len(old)):
+                    self.assertEqual(old[i], new[i])
+                self.assertEqual(old[1:], new[1:])
+                self.assertEqual(tuple(old), tuple(new))
+                self.assertEqual(old._asdict(), new._asdict())
+                self.assertEqual(old._replace(time=0),
+                                 tuple(new._replace(time=0)))
+
+    def test_row_class_cached(self):
+        rows = self._fetch(Logger.namedtuple_factory)
+        self.assertIs(type(rows[0]), type(rows[-1]))
+        rows2 = self._fetch(Logger.namedtuple_factory)
+        self.assertIs(type(rows[0]), type(rows2[0]))
+
+    @lib.benchmark
+    def test_benchmark(self):
+        old_time = lib.best_time(lambda: self._fetch(old_namedtuple_factory))
+        new_time = lib.best_time(lambda: self._fetch(Logger.namedtuple_factory))
+        log.info('row factory (%d rows): old %d rows/s, new %d rows/s',
+                 ROWS, ROWS / old_time, ROWS / new_time)
+
+
+class TestCompressedBlocksBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = ('log_line_id', 'jid_id', 'contact_name', 'time',
+                        'kind', 'show', 'message', 'subject',
+                        'additional_data')
+        data = json.dumps({'gajim': {'oob_url': 'https://example.org/a'}})
+        self.rows = [(i, 1, 'nick%d' % (i % 7), 1500000000 + i * 60, 4, None,
+                      'message number %d, see you tomorrow' % i, None,
+                      data if i % 2 else None)
+                     for i in range(LOG_BLOCK_LINES)]
+
+    def test_roundtrip(self):
+        columns, rows = decompress_block(
+            compress_block(self.columns, self.rows))
+        self.assertEqual(columns, list(self.columns))
+        self.assertEqual([tuple(row) for row in rows], self.rows)
+
+    def _raw_size(self):
+        return sum(len(str(value)) for row in self.rows
+                   for value in row if value is not None)
+
+    def test_compressed_size(self):
+        self.assertLess(len(compress_block(self.columns, self.rows)),
+                        self._raw_size())
+
+    @lib.benchmark
+    def test_benchmark(self):
+        blocks = ROWS // LOG_BLOCK_LINES
+        con = sqlite.connect(':memory:')
+        con.execute('CREATE TABLE logs_blocks (data BLOB)')
+        con.executemany('INSERT INTO logs_blocks VALUES (?)',
+                        [(compress_block(self.columns, self.rows),)] * blocks)
+        raw_size = self._raw_size() * blocks
+        compressed_size = con.execute(
+            'SELECT SUM(LENGTH(data)) FROM logs_blocks').fetchone()[0]
+
+        def read():
+            for data, in con.execute('SELECT data FROM logs_blocks'):
+                decompress_block(data)
+        cold_time = lib.best_time(read)
+        con.close()
+        log.info('compressed blocks (%d rows): %d of %d bytes saved, '
+                 'cold read %d rows/s', ROWS, raw_size - compressed_size,
+                 raw_size, ROWS / cold_time)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+'''
+Test for the per-day summary of the logs database when lines are deleted
+'''
+import io
+import os
+import random
+import sqlite3 as sqlite
+import time
+import unittest
+from contextlib import redirect_stdout
+
+import lib
+lib.setup_env()
+
+from gajim.common import check_paths
+from gajim.common import logger
+
+DAY = 86400
+
+EXPECTED_SQL = '''
+    SELECT jid_id,
+        CAST(strftime('%Y%m%d', time, 'unixepoch', 'localtime') AS INTEGER)
+            AS day,
+        COUNT(*), MIN(log_line_id), MAX(log_line_id), MAX(time)
+    FROM ({lines}) WHERE kind NOT IN (0, 1) GROUP BY jid_id, day
+    ORDER BY jid_id, day'''
+
+
+class TestLogsDays(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(logger.LOG_DB_PATH):
+            os.remove(logger.LOG_DB_PATH)
+        with redirect_stdout(io.StringIO()):
+            check_paths.create_log_db()
+        self.con = sqlite.connect(logger.LOG_DB_PATH, isolation_level=None)
+        self.con.execute("INSERT INTO jids VALUES (1, 'a@x', 0)")
+        self.con.execute("INSERT INTO jids VALUES (2, 'room@x', 1)")
+        self.now = int(time.time())
+        rand = random.Random(0)
+        self.con.executemany(
+            '''INSERT INTO logs (jid_id, account_id, time, kind, message)
+            VALUES (?, 1, ?, ?, 'hello')''',
+            [(rand.choice((1, 2)), self.now - rand.randint(0, 400 * DAY),
+              rand.choice((0, 2, 4, 4, 6))) for _i in range(2000)])
+
+    def tearDown(self):
+        self.con.close()
+        for year in logger.get_archive_years(logger.LOG_DB_FOLDER):
+            os.remove(os.path.join(logger.LOG_DB_FOLDER,
+                                   'logs-archive-%d.db' % year))
+
+    def assert_days(self, tables=('logs',)):
+        lines = ' UNION ALL '.join(
+            'SELECT log_line_id, jid_id, time, kind FROM %s' % table
+            for table in tables)
+        self.assertEqual(
+            self.con.execute(EXPECTED_SQL.format(lines=lines)).fetchall(),
+            self.con.execute('SELECT * FROM logs_days '
+                             'ORDER BY jid_id, day').fetchall())
+
+    def test_delete_lines(self):
+        self.assert_days()
+        rand = random.Random(1)
+        ids = [row[0] for row in self.con.execute(
+            'SELECT log_line_id FROM logs')]
+        for log_line_id in rand.sample(ids, 1500):
+            self.con.execute('DELETE FROM logs WHERE log_line_id = ?',
+                             (log_line_id,))
+        self.assert_days()
+        # the last lines of every day
+        self.con.execute('''DELETE FROM logs WHERE log_line_id IN
+            (SELECT last_log_line_id FROM logs_days)''')
+        self.assert_days()
+
+    def test_retention_on_archives(self):
+        maintenance = logger.LogMaintenance(
+            logger.LOG_DB_PATH, [], self.now - 100 * DAY, None,
+            lambda years: None, pause=0)
+        maintenance.run()
+        years = logger.get_archive_years(logger.LOG_DB_FOLDER)
+        self.assertTrue(years)
+        for year in years:
+            self.con.execute("ATTACH DATABASE ? AS archive_%d" % year,
+                (os.path.join(logger.LOG_DB_FOLDER,
+                              'logs-archive-%d.db' % year),))
+        tables = ['logs'] + ['archive_%d.logs' % year for year in years]
+        self.assert_days(tables)
+
+        # keep the history of the room for 200 days
+        maintenance = logger.LogMaintenance(
+            logger.LOG_DB_PATH, [(1, True, self.now - 200 * DAY)], None,
+            None, lambda years: None, pause=0)
+        maintenance.run()
+        for table in tables:
+            self.assertEqual(self.con.execute(
+                'SELECT COUNT(*) FROM %s WHERE jid_id = 2 AND time < ?' % table,
+                (self.now - 200 * DAY,)).fetchone()[0], 0)
+        self.assert_days(tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+'''
+Test for the journal of OptionsParser
+
+With GAJIM_BENCHMARK set, also compares the load time of a config file
+with and without a journal, and the time to save a few changes against
+rewriting the whole file.
+'''
+import os
+import logging
+import shutil
+import tempfile
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common import app
+from gajim.common import config
+from gajim.common import optparser
+from gajim.common import caps_cache
+
+from gajim_mocks import MockLogger
+
+log = logging.getLogger('gajim.test.optparser')
+
+CONTACTS = 5000
+
+
+class TestOptionsParserJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.old_config = app.config
+        self.old_logger = app.logger
+        app.config = config.Config()
+        app.logger = MockLogger()
+        caps_cache.initialize(app.logger)
+        self.dir = tempfile.mkdtemp(dir=lib.configdir)
+        self.filename = os.path.join(self.dir, 'config')
+        self.parser = optparser.OptionsParser(self.filename)
+
+    def tearDown(self):
+        app.config = self.old_config
+        app.logger = self.old_logger
+        shutil.rmtree(self.dir)
+
+    def _wait_writes(self):
+        self.parser._get_writer().run_sync(lambda: None, ())
+
+    def _reload(self):
+        app.config = config.Config()
+        parser = optparser.OptionsParser(self.filename)
+        parser.read()
+        return parser
+
+    @staticmethod
+    def _get_lines(parser):
+        # reading the config updates its version
+        return [line for line in parser._get_lines()
+            if not line.startswith('version = ')]
+
+    def _fill(self):
+        for i in range(CONTACTS):
+            app.config.set_per('contacts', 'contact%d@example.org' % i,
+                'speller_language', 'en')
+        self.assertIsNone(self.parser.write())
+
+    def test_journal_roundtrip(self):
+        self._fill()
+        app.config.set('roster_width', 321)
+        app.config.set('show_avatars_in_roster', False)
+        app.config.set_per('contacts', 'contact1@example.org',
+            'speller_language', 'de')
+        app.config.add_per('rooms', 'room@conference.example.org')
+        app.config.set_per('rooms', 'room@conference.example.org',
+            'muc_restore_lines', 42)
+        app.config.del_per('contacts', 'contact2@example.org')
+        app.config.add_per('statusmsg', 'away for lunch')
+        self.parser.write_changes()
+        self._wait_writes()
+        self.assertTrue(os.path.exists(self.filename + '-journal'))
+        expected = self._get_lines(self.parser)
+
+        parser = self._reload()
+        self.assertEqual(self._get_lines(parser), expected)
+        self.assertEqual(app.config.get('roster_width'), 321)
+        self.assertIs(app.config.get('show_avatars_in_roster'), False)
+        # only the version update is left to save
+        self.assertEqual([change[:2] for change in app.config.pop_changes()],
+            [('set', 'version')])
+
+        # a full write removes the journal
+        self.assertIsNone(parser.write())
+        self.assertFalse(os.path.exists(self.filename + '-journal'))
+        self._reload()
+        self.assertEqual(self._get_lines(self.parser), expected)
+
+    def test_deleted_and_added_again(self):
+        app.config.add_per('rooms', 'room@conference.example.org')
+        app.config.set_per('rooms', 'room@conference.example.org',
+            'muc_restore_lines', 42)
+        self.parser.write_changes()
+        app.config.del_per('rooms', 'room@conference.example.org')
+        app.config.add_per('rooms', 'room@conference.example.org')
+        self.parser.write_changes()
+        self._wait_writes()
+        self._reload()
+        self.assertEqual(app.config.get_per('rooms',
+            'room@conference.example.org', 'muc_restore_lines'), -2)
+
+    def test_compaction(self):
+        self._fill()
+        app.config.set('roster_width', 321)
+        app.config.add_per('rooms', 'room@conference.example.org')
+        app.config.set_per('rooms', 'room@conference.example.org',
+            'muc_restore_lines', 42)
+        app.config.del_per('contacts', 'contact2@example.org')
+        self.parser.write_changes()
+        for i in range(optparser.JOURNAL_COMPACT_ENTRIES + 1):
+            app.config.set_per('contacts', 'contact%d@example.org' % i,
+                'speller_language', 'fr')
+        self.parser.write_changes()
+        self._wait_writes()
+        self.assertFalse(os.path.exists(self.filename + '-journal'))
+        # the same lines as a full write, maybe in another order
+        with open(self.filename) as fd:
+            self.assertEqual(sorted(fd), sorted(self.parser._get_lines()))
+        self._reload()
+        self.assertEqual(app.config.get_per('contacts', 'contact7@example.org',
+            'speller_language'), 'fr')
+
+    def test_failed_compaction_keeps_journal(self):
+        self._fill()
+        self.parser._write_file = lambda lines: 'No space left on device'
+        for i in range(optparser.JOURNAL_COMPACT_ENTRIES + 1):
+            app.config.set_per('contacts', 'contact%d@example.org' % i,
+                'speller_language', 'fr')
+        with self.assertLogs('gajim.c.optparser', 'ERROR'):
+            self.parser.write_changes()
+            self._wait_writes()
+        self._reload()
+        self.assertEqual(app.config.get_per('contacts', 'contact7@example.org',
+            'speller_language'), 'fr')
+
+    def test_writer_survives_errors(self):
+        def _fail():
+            raise OSError('Input/output error')
+        writer = self.parser._get_writer()
+        with self.assertLogs('gajim.c.optparser', 'ERROR'):
+            self.assertEqual(writer.run_sync(_fail, ()), 'Input/output error')
+        self.assertTrue(writer.is_alive())
+        self.assertIsNone(self.parser.write())
+
+    @lib.benchmark
+    def test_benchmark(self):
+        self._fill()
+        read_time = lib.best_time(self._reload)
+        app.config.set('roster_width', 300)
+        full_time = lib.best_time(self.parser.write)
+
+        def _save_change():
+            app.config.set('roster_width', app.config.get('roster_width') + 1)
+            self.parser.write_changes()
+            self._wait_writes()
+        change_time = lib.best_time(_save_change)
+
+        for i in range(optparser.JOURNAL_COMPACT_ENTRIES // 2):
+            app.config.set('roster_width', i)
+            self.parser.write_changes()
+        self._wait_writes()
+        journal_read_time = lib.best_time(self._reload)
+        log.info('config (%d contacts): read %.1fms, read with a journal of '
+            '%d changes %.1fms, full write %.1fms, journaled change %.1fms',
+            CONTACTS, read_time * 1000, optparser.JOURNAL_COMPACT_ENTRIES // 2,
+            journal_read_time * 1000, full_time * 1000, change_time * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()